@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the optimization harness itself.
+
+Runs evaluate.py end-to-end against the deterministic mock provider (no MLX, LM Studio or
+network) over synthetic corpora of several sizes, and appends one JSON line per run to a
+results file so numbers can be compared across commits:
+
+    python benchmark.py                          # 3, 100 and 10000 articles
+    python benchmark.py --sizes 100 --latency-mean 0.05 --failure-rate 0.02
+    python benchmark.py --import-only            # just the import-time budget check
+
+Every run also checks that `import evaluate` stays within an import-time budget and does not
+pull in a model backend (openai, mlx-lm) or rich; the process exits non-zero if it does.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from corpus import generate_synthetic_corpus
+from runstore import open_run_store
+
+REPO_DIR = Path(__file__).resolve().parent
+DEFAULT_RESULTS = REPO_DIR / "benchmarks" / "results.jsonl"
+IMPORT_BUDGET_MS = 200
+# Backends that must only be imported once a provider actually uses them
+HEAVY_MODULES = ("openai", "httpx", "mlx", "mlx_lm", "rich")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_import(module: str, repeats: int = 5) -> Dict:
+    """Best-of-`repeats` cumulative import time of `module` (python -X importtime) and the heavy modules it loads."""
+    script = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    pattern = re.compile(rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$", re.MULTILINE)
+    best_us = None
+    heavy: List[str] = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True)
+        match = pattern.search(result.stderr)
+        if match:
+            best_us = int(match.group(1)) if best_us is None else min(best_us, int(match.group(1)))
+        heavy = [m for m in result.stdout.strip().split(",") if m]
+    return {"import_ms": round(best_us / 1000, 1) if best_us is not None else None, "heavy_modules": heavy}
+
+
+def check_import_budget(budget_ms: float) -> Dict:
+    measured = measure_import("evaluate")
+    problems = []
+    if measured["import_ms"] is not None and measured["import_ms"] > budget_ms:
+        problems.append(f"took {measured['import_ms']} ms (budget {budget_ms} ms)")
+    if measured["heavy_modules"]:
+        problems.append(f"imported {', '.join(measured['heavy_modules'])}")
+    print(f"import evaluate: {measured['import_ms']} ms (budget {budget_ms} ms)" + (f" -- FAIL: {'; '.join(problems)}" if problems else ""))
+    return dict(measured, ok=not problems)
+
+
+def build_config(args, corpus_path: Path) -> Dict:
+    """Repository config with the provider swapped for the mock and the run made deterministic."""
+    with open(REPO_DIR / "config.json", 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config.update({
+        "use_mlx": False,
+        "cache_enabled": False,
+        "pipeline_mode": args.pipeline,
+        "max_iterations": args.iterations,
+        "min_iterations": args.iterations,  # no meta-evaluation, so every run does the same work
+        "population_size": args.population_size,
+        "teacher_pack_size": args.teacher_pack_size,
+    })
+    config["corpus"] = dict(config.get("corpus") or {}, source=str(corpus_path), sample_size=None, sample_rate=None)
+    # Each run starts from the same state: no warm start or reused grades, no learned surrogate
+    config["run_index"] = {"enabled": False}
+    config["surrogate"] = {"enabled": False}
+    # Mock outputs never name a place from the article, so location grounding would pre-grade everything
+    config["pregrade"] = dict(config.get("pregrade") or {}, check_locations=False)
+    config["mock"] = {
+        "enabled": True,
+        "latency": args.latency,
+        "latency_mean": args.latency_mean,
+        "latency_spread": args.latency_spread,
+        "tokens_per_sec": args.tokens_per_sec,
+        "failure_rate": args.failure_rate,
+        "seed": args.seed,
+    }
+    return config
+
+
+def count_iterations(run_dir: Path) -> int:
+    store = open_run_store(run_dir)
+    try:
+        return len({row["iteration"] for row in store.rows()})
+    finally:
+        store.close()
+
+
+def run_once(args, size: int, work_dir: Path) -> Dict:
+    corpus_path = work_dir / f"synthetic_{size}.jsonl.gz"
+    generate_synthetic_corpus(corpus_path, size, seed=args.seed)
+    config = build_config(args, corpus_path)
+    with open(work_dir / "config.json", 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+    env = dict(os.environ, PYTHONHASHSEED="0", COLUMNS="120")
+    with open(work_dir / "evaluate.log", 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(REPO_DIR / "evaluate.py")], cwd=work_dir, stdout=log, stderr=subprocess.STDOUT, env=env)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_s = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"evaluate.py exited with {process.returncode}; see {work_dir / 'evaluate.log'}")
+
+    # The runs root may also hold shared files (e.g. the run index), so only look at run directories
+    run_dir = max(p for p in (work_dir / "optimization_runs").iterdir() if p.is_dir() and p.name.startswith("run_"))
+    with open(run_dir / "profile.json", 'r', encoding='utf-8') as f:
+        profile = json.load(f)
+    requests = sum(p["items"] for p in profile["phases"])
+    iterations = count_iterations(run_dir)
+    counters = profile["counters"]
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    return {
+        "articles": size,
+        "iterations": iterations,
+        "wall_s": round(wall_s, 3),
+        "iterations_per_s": round(iterations / wall_s, 4),
+        "requests": requests,
+        "provider_calls": sum(p["calls"] for p in profile["phases"]),
+        "requests_per_s": round(requests / wall_s, 2),
+        "failures": sum(p["failures"] for p in profile["phases"]),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "artifact_writes": int(counters.get("artifact_write", 0)),
+        "artifact_write_s": round(counters.get("artifact_write_s", 0.0), 3),
+        "cpu_user_s": round(usage.ru_utime, 3),
+        "cpu_sys_s": round(usage.ru_stime, 3),
+    }
+
+
+def previous_results(path: Path, label: str, settings: Dict) -> Dict[int, Dict]:
+    """Most recent earlier result per corpus size with the same label and settings."""
+    latest: Dict[int, Dict] = {}
+    if path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get("label") == label and record.get("settings") == settings:
+                        latest[record["articles"]] = record
+    return latest
+
+
+def print_results(results: List[Dict], baseline: Dict[int, Dict]):
+    columns = ["articles", "iterations", "wall_s", "iterations_per_s", "requests_per_s", "peak_rss_mb", "artifact_write_s"]
+    print("  ".join(f"{c:>16}" for c in columns))
+    for result in results:
+        print("  ".join(f"{result[c]:>16}" for c in columns))
+        before = baseline.get(result["articles"])
+        if before:
+            deltas = []
+            for c in ("wall_s", "requests_per_s", "peak_rss_mb", "artifact_write_s"):
+                if before.get(c):
+                    deltas.append(f"{c} {(result[c] - before[c]) / before[c] * 100:+.1f}%")
+            print(f"{'':>16}  vs {before.get('git_revision') or '?'} ({before['timestamp']}): " + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the harness against the mock provider.")
+    parser.add_argument("--sizes", default="3,100,10000", help="Comma-separated corpus sizes")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--pipeline", action="store_true", help="Use the pipelined evaluator")
+    parser.add_argument("--population-size", type=int, default=1)
+    parser.add_argument("--teacher-pack-size", type=int, default=1)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="Seconds per mock call")
+    parser.add_argument("--latency-spread", type=float, default=0.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=None, help="Simulated generation speed")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="default", help="Results are compared against earlier runs with the same label")
+    parser.add_argument("--output", type=Path, default=DEFAULT_RESULTS)
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary run directories")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS, help="Maximum time for `import evaluate`")
+    parser.add_argument("--import-only", action="store_true", help="Only run the import-time check")
+    args = parser.parse_args()
+
+    imports = check_import_budget(args.import_budget_ms)
+    if args.import_only:
+        sys.exit(0 if imports["ok"] else 1)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    environment = {
+        "label": args.label,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("sizes", "label", "output", "keep", "import_budget_ms", "import_only")},
+        "import_ms": imports["import_ms"],
+    }
+    baseline = previous_results(args.output, args.label, environment["settings"])
+
+    results = []
+    for size in sizes:
+        work_dir = Path(tempfile.mkdtemp(prefix=f"bench_{size}_"))
+        try:
+            print(f"Running {size} articles x {args.iterations} iterations in {work_dir} ...", flush=True)
+            results.append(dict(environment, **run_once(args, size, work_dir)))
+        finally:
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result, default=str) + "\n")
+    print_results(results, baseline)
+    print(f"Results appended to {args.output}")
+    if not imports["ok"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Crash-safe optimizer checkpoints.
+
+The optimizer state (current prompt/schema or population beam, best-so-far, history) is
+written to <run_dir>/checkpoint.json after every iteration. Writes go to a temporary file
+that is fsynced and renamed over the old checkpoint, so a crash leaves either the previous or
+the new checkpoint, never a torn one. Grades already in the run store (see runstore.py) are
+read back on resume so completed student/teacher calls are not repeated.
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(run_dir: Path, state: Dict):
+    path = Path(run_dir) / CHECKPOINT_FILE
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".checkpoint-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(dict(state, version=CHECKPOINT_VERSION), f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def load_checkpoint(run_dir: Path) -> Optional[Dict]:
+    """Returns the saved state, or None if the run never completed an iteration."""
+    path = Path(run_dir) / CHECKPOINT_FILE
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} has checkpoint version {state.get('version')}, expected {CHECKPOINT_VERSION}")
+    return state
@@ -0,0 +1,206 @@
+"""
+Keeps teacher prompts that embed run history or feedback within a token budget.
+
+- Critiques that are near-identical (word-shingle Jaccard similarity) are merged into one
+  entry listing the affected articles.
+- The history keeps the first prompt in full and only sentence-level diffs for later ones.
+- Older iterations are summarized in levels (top critiques only, then ranges of iterations
+  merged into one line) until the text fits; the most recent iterations stay detailed.
+
+Token counts come from the target model's Hugging Face tokenizer when it is available locally,
+otherwise from a characters/4 estimate.
+"""
+
+import difflib
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+CHARS_PER_TOKEN = 4
+_SENTENCE = re.compile(r"(?<=[.!?])\s+")
+_FEEDBACK = re.compile(r"^Article (?P<article>.+?): (?P<critique>.*)$", re.DOTALL)
+
+
+class TokenCounter:
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+        self.tokenizer = _load_tokenizer(model) if model else None
+
+    @property
+    def exact(self) -> bool:
+        return self.tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@lru_cache(maxsize=8)
+def _load_tokenizer(model: str):
+    """The model's tokenizer from the local Hugging Face cache; None if unavailable (no downloads)."""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model, local_files_only=True)
+    except Exception:
+        return None
+
+
+# --- CRITIQUE DEDUPLICATION ---
+def _shingles(text: str, size: int = 3) -> frozenset:
+    words = re.findall(r"[a-z']+", text.lower())
+    if len(words) < size:
+        return frozenset([" ".join(words)])
+    return frozenset(" ".join(words[n:n + size]) for n in range(len(words) - size + 1))
+
+
+def _similarity(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def dedupe_feedback(feedback: List[str], threshold: float = 0.8, max_groups: int = 512) -> List[Dict]:
+    """
+    Groups "Article <id>: <critique>" entries whose critiques are near-identical.
+    Returns [{"articles": [...], "critique": str}] ordered by group size (largest first).
+    Each entry is compared against at most max_groups representatives, which bounds the cost
+    on large corpora; later entries that match none of them start a new group.
+    """
+    groups: List[Dict] = []
+    by_text: Dict[str, Dict] = {}
+    for entry in feedback:
+        match = _FEEDBACK.match(entry)
+        article, critique = (match.group("article"), match.group("critique")) if match else ("?", entry)
+        key = " ".join(critique.lower().split())
+        group = by_text.get(key)
+        if group is None:
+            shingles = _shingles(critique)
+            group = next((g for g in groups[:max_groups] if _similarity(shingles, g["shingles"]) >= threshold), None)
+            if group is None:
+                group = {"articles": [], "critique": critique, "shingles": shingles}
+                groups.append(group)
+            by_text[key] = group
+        group["articles"].append(article)
+    groups.sort(key=lambda g: len(g["articles"]), reverse=True)
+    return [{"articles": g["articles"], "critique": g["critique"]} for g in groups]
+
+
+def format_group(group: Dict, max_ids: int = 8) -> str:
+    articles = group["articles"]
+    shown = ", ".join(articles[:max_ids]) + (f" +{len(articles) - max_ids} more" if len(articles) > max_ids else "")
+    label = f"Article {shown}" if len(articles) == 1 else f"Articles {shown} ({len(articles)}x)"
+    return f"{label}: {group['critique']}"
+
+
+def fit_feedback(feedback: List[str], budget: int, counter: TokenCounter, threshold: float = 0.8) -> Tuple[List[str], Dict]:
+    """
+    Deduplicated feedback, most frequent critiques first, cut off at `budget` tokens.
+    Returns (entries, {"tokens_before", "tokens_after"}) measured on the JSON the prompt embeds.
+    """
+    before = counter.count(json.dumps(feedback))
+    entries: List[str] = []
+    used = 2
+    groups = dedupe_feedback(feedback, threshold)
+    for n, group in enumerate(groups):
+        line = format_group(group)
+        cost = counter.count(json.dumps(line)) + 1
+        if used + cost > budget and entries:
+            omitted = sum(len(g["articles"]) for g in groups[n:])
+            entries.append(f"(+{omitted} less frequent critiques omitted)")
+            break
+        entries.append(line)
+        used += cost
+    return entries, {"tokens_before": before, "tokens_after": counter.count(json.dumps(entries))}
+
+
+# --- HISTORY COMPRESSION ---
+def prompt_diff(old: str, new: str) -> str:
+    """Sentence-level diff of two prompts: '- removed' / '+ added' lines, or 'unchanged'."""
+    if old == new:
+        return "unchanged"
+    old_sentences = _SENTENCE.split(old.strip())
+    new_sentences = _SENTENCE.split(new.strip())
+    lines = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(a=old_sentences, b=new_sentences, autojunk=False).get_opcodes():
+        if tag in ("replace", "delete"):
+            lines.extend(f"- {s}" for s in old_sentences[i1:i2])
+        if tag in ("replace", "insert"):
+            lines.extend(f"+ {s}" for s in new_sentences[j1:j2])
+    return "\n".join(lines)
+
+
+def _detailed(entry: Dict, previous_prompt: Optional[str], threshold: float, max_critiques: Optional[int]) -> Dict:
+    detailed = {"iteration": entry["iteration"], "avg_score": round(entry["avg_score"], 2)}
+    if previous_prompt is None:
+        detailed["prompt"] = entry["prompt"]
+    else:
+        detailed["prompt_changes"] = prompt_diff(previous_prompt, entry["prompt"])
+    if entry.get("schema_snippet"):
+        detailed["schema_snippet"] = entry["schema_snippet"]
+    groups = dedupe_feedback(entry.get("critiques", []), threshold)
+    if max_critiques is not None:
+        groups = groups[:max_critiques]
+    detailed["critiques"] = [format_group(g) for g in groups]
+    if entry.get("candidates"):
+        detailed["candidates"] = entry["candidates"]
+    return detailed
+
+
+def _merged(entries: List[Dict], threshold: float) -> Dict:
+    """One line for a range of iterations: score trajectory and the most common critiques."""
+    critiques = [c for e in entries for c in e.get("critiques", [])]
+    top = dedupe_feedback(critiques, threshold)[:3]
+    return {
+        "iterations": f"{entries[0]['iteration']}-{entries[-1]['iteration']}",
+        "avg_scores": [round(e["avg_score"], 2) for e in entries],
+        "recurring_critiques": [f"({len(g['articles'])}x) {g['critique']}" for g in top],
+    }
+
+
+def compress_history(history: List[Dict], budget: int, counter: TokenCounter, recent: int = 3,
+                     threshold: float = 0.8) -> Tuple[str, Dict]:
+    """
+    Renders `history` (as built by evaluate.py) as JSON within `budget` tokens.
+    Levels, applied to iterations older than the last `recent` until the text fits:
+      0: deduplicated critiques and prompt diffs
+      1: older iterations keep only their top 3 critiques
+      2..: older iterations merged into ranges of 2, 4, 8, ... iterations
+      last: as above, and the recent iterations keep only their top 3 critiques too
+    Returns (text, {"tokens_before", "tokens_after", "level"}).
+    """
+    before = counter.count(json.dumps(history, indent=2))
+
+    split = max(0, len(history) - recent)
+    older, newer = history[:split], history[split:]
+    merge_levels = 1 + len(older).bit_length() if older else 1
+
+    def render(level: int) -> str:
+        recent_cap = 3 if level > merge_levels else None
+        rendered = []
+        previous_prompt = None
+        if level >= 2 and older:
+            width = 2 ** (level - 1)
+            rendered.extend(_merged(older[n:n + width], threshold) for n in range(0, len(older), width))
+            previous_prompt = older[-1]["prompt"]
+        else:
+            for entry in older:
+                rendered.append(_detailed(entry, previous_prompt, threshold, 3 if level >= 1 else None))
+                previous_prompt = entry["prompt"]
+        for entry in newer:
+            rendered.append(_detailed(entry, previous_prompt, threshold, recent_cap))
+            previous_prompt = entry["prompt"]
+        if previous_prompt is not None and not any("prompt" in r for r in rendered):
+            # Every detailed entry is a diff; keep the latest prompt in full as the reference point
+            rendered.append({"latest_prompt": previous_prompt})
+        return json.dumps(rendered)
+
+    level = 0
+    text = render(level)
+    while counter.count(text) > budget and level <= merge_levels:
+        level += 1
+        text = render(level)
+    return text, {"tokens_before": before, "tokens_after": counter.count(text), "level": level}
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Streaming article corpora for the optimization loop.
+
+Articles are read lazily from JSONL, CSV or a directory of .txt files (any of them may be
+gzip-compressed) and filtered with deterministic sampling and sharding, so a run can cover
+thousands of articles without holding them all in memory.
+
+    python corpus.py synth data/synthetic.jsonl.gz --n 10000
+    python corpus.py stats data/synthetic.jsonl.gz --sample-size 500
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import random
+import sys
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+
+class Article(NamedTuple):
+    id: str
+    text: str
+
+
+def open_text(path: Path, mode: str = "r"):
+    """Opens a text file, transparently handling .gz compression."""
+    path = Path(path)
+    if path.suffix == ".gz":
+        return io.TextIOWrapper(gzip.open(path, mode.replace("t", "") + "b"), encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _base_suffix(path: Path) -> str:
+    suffixes = [s for s in Path(path).suffixes if s != ".gz"]
+    return suffixes[-1].lower() if suffixes else ""
+
+
+def iter_jsonl(path: Path, text_field: str = "text", id_field: str = "id") -> Iterator[Article]:
+    with open_text(path) as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield Article(str(record.get(id_field, line_no)), record[text_field])
+
+
+def iter_csv(path: Path, text_field: str = "text", id_field: str = "id") -> Iterator[Article]:
+    # Article bodies can be long; lift the default per-field limit
+    csv.field_size_limit(sys.maxsize)
+    with open_text(path) as f:
+        for row_no, row in enumerate(csv.DictReader(f), start=1):
+            yield Article(str(row.get(id_field) or row_no), row[text_field])
+
+
+def iter_text_dir(path: Path) -> Iterator[Article]:
+    """One article per .txt / .txt.gz file; the ID is the path relative to the directory."""
+    root = Path(path)
+    files = sorted(p for p in root.rglob("*") if p.is_file() and (p.name.endswith(".txt") or p.name.endswith(".txt.gz")))
+    for file_path in files:
+        with open_text(file_path) as f:
+            article_id = file_path.relative_to(root).as_posix()
+            yield Article(article_id.removesuffix(".gz").removesuffix(".txt"), f.read())
+
+
+def iter_source(source: str, text_field: str = "text", id_field: str = "id") -> Iterator[Article]:
+    """Dispatches on the source type: directory, .jsonl or .csv (optionally .gz)."""
+    path = Path(source)
+    if path.is_dir():
+        return iter_text_dir(path)
+    suffix = _base_suffix(path)
+    if suffix in (".jsonl", ".ndjson"):
+        return iter_jsonl(path, text_field, id_field)
+    if suffix == ".csv":
+        return iter_csv(path, text_field, id_field)
+    raise ValueError(f"Unsupported corpus source: {source} (expected a directory, .jsonl or .csv)")
+
+
+def _stable_fraction(*parts) -> float:
+    """Maps the given values to a deterministic number in [0, 1)."""
+    digest = hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def shard(articles: Iterable[Article], shard_index: int, num_shards: int) -> Iterator[Article]:
+    """Keeps the articles whose ID hashes to this shard."""
+    for article in articles:
+        if num_shards <= 1 or int(_stable_fraction("shard", article.id) * num_shards) == shard_index:
+            yield article
+
+
+def sample_rate(articles: Iterable[Article], rate: float, seed: int = 0) -> Iterator[Article]:
+    """Streaming Bernoulli sample; membership depends only on (seed, article ID)."""
+    for article in articles:
+        if _stable_fraction(seed, article.id) < rate:
+            yield article
+
+
+def sample_size(articles: Iterable[Article], k: int, seed: int = 0) -> Iterator[Article]:
+    """
+    Deterministic fixed-size sample (bottom-k by hashed ID).
+    Only the k current candidates are held in memory; they are yielded in source order.
+    """
+    heap = []  # max-heap on the hash via negation: (-fraction, position, article)
+    for position, article in enumerate(articles):
+        key = _stable_fraction(seed, article.id)
+        if len(heap) < k:
+            heapq.heappush(heap, (-key, position, article))
+        elif -heap[0][0] > key:
+            heapq.heapreplace(heap, (-key, position, article))
+    for _, _, article in sorted(heap, key=lambda item: item[1]):
+        yield article
+
+
+class Corpus:
+    """
+    Re-iterable view over an article source.
+    Each iteration re-opens the source, so the loop can walk the corpus once per optimization round.
+    """
+
+    def __init__(self, factory: Callable[[], Iterable[Article]], name: str = "corpus",
+                 sample_size: Optional[int] = None, sample_rate: Optional[float] = None, seed: int = 0,
+                 shard_index: int = 0, num_shards: int = 1, limit: Optional[int] = None):
+        self.factory = factory
+        self.name = name
+        self.sample_size = sample_size
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.limit = limit
+        self._length = None
+
+    def __iter__(self) -> Iterator[Article]:
+        articles = iter(self.factory())
+        articles = shard(articles, self.shard_index, self.num_shards)
+        if self.sample_rate is not None:
+            articles = sample_rate(articles, self.sample_rate, self.seed)
+        if self.sample_size is not None:
+            articles = sample_size(articles, self.sample_size, self.seed)
+        if self.limit is not None:
+            articles = islice(articles, self.limit)
+        return articles
+
+    def __len__(self) -> int:
+        # Counting requires one streaming pass; remembered afterwards
+        if self._length is None:
+            self._length = sum(1 for _ in self)
+        return self._length
+
+    def describe(self) -> str:
+        parts = [self.name]
+        if self.num_shards > 1:
+            parts.append(f"shard {self.shard_index + 1}/{self.num_shards}")
+        if self.sample_rate is not None:
+            parts.append(f"rate={self.sample_rate}")
+        if self.sample_size is not None:
+            parts.append(f"sample={self.sample_size}")
+        if self.limit is not None:
+            parts.append(f"limit={self.limit}")
+        return ", ".join(parts)
+
+
+def from_texts(texts: List[str], name: str = "built-in") -> Corpus:
+    """Wraps an in-memory list of article texts; IDs are 1-based positions."""
+    return Corpus(lambda: (Article(str(i + 1), text) for i, text in enumerate(texts)), name=name)
+
+
+def load_corpus(corpus_config: Dict, default_texts: Optional[List[str]] = None) -> Corpus:
+    """Builds a Corpus from the "corpus" section of config.json (falls back to default_texts)."""
+    source = (corpus_config or {}).get("source")
+    if not source:
+        corpus = from_texts(default_texts or [])
+    else:
+        text_field = corpus_config.get("text_field", "text")
+        id_field = corpus_config.get("id_field", "id")
+        corpus = Corpus(lambda: iter_source(source, text_field, id_field), name=str(source))
+
+    corpus_config = corpus_config or {}
+    corpus.sample_size = corpus_config.get("sample_size")
+    corpus.sample_rate = corpus_config.get("sample_rate")
+    corpus.seed = corpus_config.get("seed", 0)
+    corpus.shard_index = corpus_config.get("shard_index", 0)
+    corpus.num_shards = corpus_config.get("num_shards", 1)
+    corpus.limit = corpus_config.get("limit")
+    return corpus
+
+
+def corpus_fingerprint(corpus_config: Optional[Dict], default_texts: Optional[List[str]] = None) -> str:
+    """
+    Identifies the articles a "corpus" config section selects: the source (file path, size and
+    modification time, or the built-in texts) plus field names, sampling and sharding. Runs with
+    the same fingerprint were graded on the same articles. It describes the corpus as it is now,
+    so runs record theirs when they start (see run_index.FINGERPRINT_FILE).
+    """
+    corpus_config = corpus_config or {}
+    source = corpus_config.get("source")
+    if source:
+        path = Path(source)
+        if path.is_dir():
+            stats = [p.stat() for p in path.rglob("*") if p.is_file()]
+            stamp = [sum(s.st_size for s in stats), max((s.st_mtime_ns for s in stats), default=None)]
+        else:
+            stamp = [path.stat().st_size, path.stat().st_mtime_ns] if path.exists() else None
+        origin = [str(path.resolve()), stamp]
+    else:
+        origin = hashlib.sha256("\x1e".join(default_texts or []).encode("utf-8")).hexdigest()
+    selection = {
+        "text_field": corpus_config.get("text_field", "text"), "id_field": corpus_config.get("id_field", "id"),
+        "sample_size": corpus_config.get("sample_size"), "sample_rate": corpus_config.get("sample_rate"),
+        "seed": corpus_config.get("seed", 0), "shard_index": corpus_config.get("shard_index", 0),
+        "num_shards": corpus_config.get("num_shards", 1), "limit": corpus_config.get("limit"),
+    }
+    return hashlib.sha256(json.dumps([origin, selection], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# --- SYNTHETIC CORPUS ---
+_PLACES = [
+    ("Germany", "BERLIN"), ("Brazil", "RIO DE JANEIRO"), ("Yemen", "AMMAN, Jordan"), ("Kenya", "NAIROBI"),
+    ("Philippines", "MANILA"), ("Chile", "SANTIAGO"), ("India", "NEW DELHI"), ("Italy", "ROME"),
+    ("Canada", "TORONTO"), ("Bangladesh", "DHAKA"), ("Peru", "LIMA"), ("Turkey", "ISTANBUL"),
+]
+_EVENTS = [
+    ("Heavy rains caused flooding across {region}", "The death toll has risen to {n}."),
+    ("A dam collapsed near {region}", "Electricity is cut off for nearly {n} residents."),
+    ("Workers launched a {h}-hour nationwide strike in {region}", "Only {p}% of trains would run."),
+    ("An earthquake struck {region}", "At least {n} people were injured and hundreds displaced."),
+    ("Wildfires spread through forests in {region}", "Authorities evacuated {n} people."),
+    ("A cholera outbreak was reported in {region}", "Health officials counted {n} cases."),
+]
+_AGENCIES = ["AP", "Reuters", "AFP", "CNS"]
+_FILLER = [
+    "Officials said the situation remained tense.",
+    "Aid organisations called for donations.",
+    "Local media reported long queues at shelters.",
+    "The government promised an inquiry.",
+    "Economists estimated the cost at {n} million euros per day.",
+]
+
+
+def synthetic_article(index: int, seed: int = 0) -> Article:
+    rng = random.Random(f"{seed}:{index}")
+    country, dateline = rng.choice(_PLACES)
+    region = rng.choice([country, f"northern {country}", f"southern {country}", f"eastern {country}"])
+    values = {"region": region, "n": rng.randint(10, 300000), "h": rng.choice([24, 35, 48]), "p": rng.randint(5, 60)}
+    lead, detail = rng.choice(_EVENTS)
+    sentences = [lead.format(**values) + ".", detail.format(**values)]
+    sentences += [rng.choice(_FILLER).format(**values) for _ in range(rng.randint(1, 6))]
+    text = f"{dateline} ({rng.choice(_AGENCIES)}) — " + " ".join(sentences)
+    return Article(f"syn-{index:06d}", text)
+
+
+def generate_synthetic_corpus(path: Path, n: int, seed: int = 0) -> Path:
+    """Writes n synthetic news articles as JSONL (gzip-compressed if the path ends in .gz)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open_text(path, "w") as f:
+        for index in range(n):
+            article = synthetic_article(index, seed)
+            f.write(json.dumps({"id": article.id, "text": article.text}, ensure_ascii=False) + "\n")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Article corpus tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    synth_parser = subparsers.add_parser("synth", help="Generate a synthetic JSONL corpus")
+    synth_parser.add_argument("path")
+    synth_parser.add_argument("--n", type=int, default=10000)
+    synth_parser.add_argument("--seed", type=int, default=0)
+
+    stats_parser = subparsers.add_parser("stats", help="Stream a corpus and print basic statistics")
+    stats_parser.add_argument("source")
+    stats_parser.add_argument("--sample-size", type=int)
+    stats_parser.add_argument("--sample-rate", type=float)
+    stats_parser.add_argument("--seed", type=int, default=0)
+    stats_parser.add_argument("--shard-index", type=int, default=0)
+    stats_parser.add_argument("--num-shards", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "synth":
+        out = generate_synthetic_corpus(Path(args.path), args.n, args.seed)
+        print(f"Wrote {args.n} synthetic articles to {out}")
+    else:
+        corpus = load_corpus({
+            "source": args.source, "sample_size": args.sample_size, "sample_rate": args.sample_rate,
+            "seed": args.seed, "shard_index": args.shard_index, "num_shards": args.num_shards,
+        })
+        count = 0
+        total_chars = 0
+        for article in corpus:
+            count += 1
+            total_chars += len(article.text)
+        print(f"{corpus.describe()}: {count} articles, {total_chars} chars (avg {total_chars / max(count, 1):.0f})")
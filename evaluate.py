@@ -4,31 +4,62 @@
 # dependencies = [
 #   "requests>=2.31",
 #   "rich",
-#   "openai>=1.0.0",
+#   "openai>=1.17.0",
 #   "mlx-lm>=0.30.2"
 # ]
 # [tool.uv]
 # prerelease = "allow"
 # ///
 
+import argparse
 import json
-import csv
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, Callable, Iterator, List, Dict, Optional
 from datetime import datetime
-from rich.console import Console
-from rich.panel import Panel
 
 # Import model provider
-from models import get_provider
+from models import ModelProvider, get_console, get_provider, find_provider, CachedProvider, InstrumentedProvider, MLXProvider, OpenAIProvider
+from routing import RoutingProvider
+from profiling import Tracer, phase
+from corpus import Article, corpus_fingerprint, load_corpus
+from scheduling import EarlyAbortTracker, Speculation, iter_sized_chunks, rung_sizes
+from pregrade import pregrade
+from checkpoint import load_checkpoint, save_checkpoint
+from runstore import RunStore, open_run_store, schema_id
+from run_index import FINGERPRINT_FILE, INDEX_FILE, RunIndex
+from surrogate import SURROGATE_CRITIQUE, SurrogateScorer
+from context_budget import TokenCounter, compress_history, fit_feedback
+
+if TYPE_CHECKING:
+    from rich.console import Console
 
 # --- CONFIGURATION ---
-def load_config():
-    config_path = Path("config.json")
+def load_config(config_path: Path = Path("config.json")) -> Dict:
     default_config = {
         "base_url": "http://localhost:1234/v1",
         "api_key": "lm-studio",
+        "max_concurrency": 1,
+        "cache_enabled": False,
+        "run_store": "csv",
+        "pipeline_mode": False,
+        "corpus": None,
+        "population_size": 1,
+        "beam_width": 2,
+        "early_abort": {"enabled": False},
+        "pregrade": {"enabled": False},
+        "teacher_pack_size": 1,
+        "context_budget": {"enabled": False},
+        "generation_limits": {"enabled": False},
+        "speculation": {"enabled": False},
+        "routing": {"enabled": False},
+        "run_index": {"enabled": False},
+        "surrogate": {"enabled": False},
+        "mock": {"enabled": False},
         "student_model": "liquid/lfm2.5-1.2b",
         "teacher_model": "qwen/qwen3-next-80b",
         "starting_prompt": "You are an event extraction AI. Read the text and output valid JSON.",
@@ -44,27 +75,13 @@ def load_config():
                 user_config = json.load(f)
                 default_config.update(user_config)
         except Exception as e:
-            print(f"Error loading config.json: {e}")
+            print(f"Error loading {config_path}: {e}")
             
     return default_config
 
-CONFIG = load_config()
-
-BASE_URL = CONFIG["base_url"]
-API_KEY = CONFIG["api_key"]
-
-# Models
-STUDENT_MODEL = CONFIG["student_model"]
-TEACHER_MODEL = CONFIG["teacher_model"]
-
-# Constraints
-MAX_PROMPT_LENGTH = CONFIG.get("max_prompt_length", 2000)
-SCORE_THRESHOLD = CONFIG.get("score_threshold", 9.3)
-MIN_ITERATIONS = CONFIG.get("min_iterations", 5)
-MAX_ITERATIONS = CONFIG.get("max_iterations", 20)
-STARTING_PROMPT = CONFIG.get("starting_prompt", "You are an event extraction AI. Read the text and output valid JSON.")
-OPTIMIZATION_TARGET = CONFIG.get("optimization_target", "prompt") # "prompt" or "schema"
-STARTING_SCHEMA = CONFIG.get("starting_schema", {
+# --- 1. STUDENT SCHEMA (Extraction) ---
+# Used when config.json has no "starting_schema"
+DEFAULT_STARTING_SCHEMA = {
   "type": "object",
   "properties": {
     "events": {
@@ -82,25 +99,7 @@ STARTING_SCHEMA = CONFIG.get("starting_schema", {
     }
   },
   "required": ["events"]
-})
-
-# Directories & Files
-TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
-ARTIFACT_BASE_DIR = Path("optimization_runs")
-ARTIFACT_DIR = ARTIFACT_BASE_DIR / f"run_{TIMESTAMP}"
-PROMPT_DIR = ARTIFACT_DIR / "prompts"
-SCHEMA_DIR = ARTIFACT_DIR / "schemas"
-RESPONSE_DIR = ARTIFACT_DIR / "responses"
-LOG_FILE = ARTIFACT_DIR / "optimization_log.csv"
-BEST_PROMPT_FILE = ARTIFACT_DIR / "best_prompt.txt"
-SUMMARY_FILE = ARTIFACT_DIR / "results_summary.txt"
-
-# Initialize Console
-console = Console()
-
-# --- 1. STUDENT SCHEMA (Extraction) ---
-# Loaded from config now
-STUDENT_SCHEMA = STARTING_SCHEMA
+}
 
 # --- 2. TEACHER SCHEMA (Evaluation) ---
 TEACHER_SCHEMA = {
@@ -113,6 +112,25 @@ TEACHER_SCHEMA = {
   "required": ["score", "critique", "missing_info"]
 }
 
+# Several (article, extraction) pairs graded in one request, see grade_outputs()
+PACKED_TEACHER_SCHEMA = {
+  "type": "object",
+  "properties": {
+    "grades": {
+      "type": "array",
+      "items": {
+        "type": "object",
+        "properties": {
+          "item": {"type": "integer", "description": "Number of the item being graded"},
+          **TEACHER_SCHEMA["properties"]
+        },
+        "required": ["item"] + TEACHER_SCHEMA["required"]
+      }
+    }
+  },
+  "required": ["grades"]
+}
+
 # --- 3. META-EVALUATION SCHEMA (Early Stopping) ---
 META_EVAL_SCHEMA = {
   "type": "object",
@@ -146,341 +164,1343 @@ TEST_ARTICLES = [
     """
 ]
 
-# Initialize Provider
-provider = get_provider(CONFIG)
+def build_student_messages(prompt: str, article: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": article}
+    ]
 
-def setup_directories():
-    """Creates necessary directories for artifacts and saves used configuration."""
-    PROMPT_DIR.mkdir(parents=True, exist_ok=True)
-    SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
-    RESPONSE_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # Save the configuration used for this run
-    config_save_path = ARTIFACT_DIR / "config_used.json"
-    with open(config_save_path, 'w', encoding='utf-8') as f:
-        json.dump(CONFIG, f, indent=2)
-    console.print(f"Artifacts will be saved to: [bold]{ARTIFACT_DIR}[/bold]")
-
-def get_completion(model: str, messages: list, target_schema: Optional[dict] = None, temperature: float = 0.1):
-    """Handles API calls via the shared provider."""
-    return provider.get_completion(model, messages, target_schema, temperature)
-
-def get_batch_completion(model: str, messages_list: List[list], target_schema: Optional[dict] = None, temperature: float = 0.1):
-    """Handles batched API calls via the shared provider."""
-    return provider.get_batch_completion(model, messages_list, target_schema, temperature)
-
-def save_text(filepath: Path, content: str):
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(content)
-
-def ensure_prompt_length(prompt: str, max_length: int) -> str:
-    """Iteratively asks the Teacher model to shorten the prompt until it meets the max_length."""
-    prompt = prompt.strip().replace('"', '').replace("```", "")
-    
-    attempts = 0
-    max_attempts = 10
-    
-    while len(prompt) > max_length:
-        attempts += 1
-        console.print(f"[bold red]Prompt length ({len(prompt)}) exceeds limit ({max_length}). Attempting to shorten (Attempt {attempts}/{max_attempts})...[/bold red]")
-        
-        shorten_msg = f"""
-        The following prompt is too long ({len(prompt)} characters). 
-        The maximum allowed length is {max_length} characters.
-        
-        Please rewrite it to be SIGNIFICANTLY more concise while maintaining all critical instructions.
-        
-        PROMPT:
-        {prompt}
-        """
-        shortened = get_completion(TEACHER_MODEL, [{"role": "user", "content": shorten_msg}], temperature=0.5)
-        
-        if shortened:
-            prompt = shortened.strip().replace('"', '').replace("```", "")
-            if len(prompt) <= max_length:
-                console.print(f"[green]Successfully shortened prompt to {len(prompt)} characters.[/green]")
-                return prompt
-        
-        if attempts >= max_attempts:
-            console.print(f"[bold red]Failed to shorten prompt after {max_attempts} attempts.[/bold red]")
-            return None
-            
-    return prompt
+def clean_prompt(prompt: str) -> str:
+    return prompt.strip().replace('"', '').replace("```", "")
 
-def generate_summary(history: List[Dict]):
-    """
-    Asks the Teacher model to summarize the optimization process.
-    """
-    console.print("\n[bold cyan]Generating Final Summary...[/bold cyan]")
-    
-    summary_prompt = f"""
-    You are an expert Prompt Engineer. Review the history of this optimization session.
-    
-    HISTORY:
-    {json.dumps(history, indent=2)}
-    
-    Task:
-    1. Identify what prompt techniques improved the score.
-    2. Identify what techniques caused failures or low scores.
-    3. Summarize the best practices for this specific task (Event Extraction).
-    
-    Output a concise summary.
-    """
-    
-    summary = get_completion(TEACHER_MODEL, [{"role": "user", "content": summary_prompt}])
-    if summary:
-        save_text(SUMMARY_FILE, summary)
-        console.print(Panel(summary, title="Results Summary", border_style="green"))
-    else:
-        console.print("[red]Failed to generate summary.[/red]")
-
-def run_benchmark():
-    setup_directories()
-    
-    # Initialize Log
-    with open(LOG_FILE, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["Iteration", "Article_ID", "Student_Output", "Teacher_Score", "Teacher_Critique", "Prompt_Used"])
-
-    # State Tracking
-    current_prompt = ensure_prompt_length(STARTING_PROMPT, MAX_PROMPT_LENGTH)
-    current_schema = STUDENT_SCHEMA # This is now loaded from CONFIG in lines 80+
-    
-    if current_prompt is None:
-        console.print(f"[bold red][FATAL] Starting prompt exceeds {MAX_PROMPT_LENGTH} characters and could not be shortened. Please check your config.json.[/bold red]")
-        return
+def shorten_targets(max_length: int, count: int) -> List[int]:
+    """Target lengths for `count` shortening candidates, spread from 90% down to 60% of max_length."""
+    if count <= 1:
+        return [int(max_length * 0.9)]
+    return [int(max_length * (0.9 - 0.3 * n / (count - 1))) for n in range(count)]
 
-    global_best_score = -1.0
-    global_best_prompt = current_prompt
-    global_best_schema = current_schema
-    
-    # History for Summary
-    history = [] 
-
-    console.print(f"[bold green]--- Starting Optimization Loop ---[/bold green]")
-    console.print(f"Student: [cyan]{STUDENT_MODEL}[/cyan]")
-    console.print(f"Teacher: [cyan]{TEACHER_MODEL}[/cyan]")
-
-    for i in range(MAX_ITERATIONS):
-        console.print(f"\n[bold yellow]=== ITERATION {i+1} ===[/bold yellow]")
-        
-        # 1. Save Current Artifacts
-        prompt_path = PROMPT_DIR / f"iter_{i+1}.txt"
-        save_text(prompt_path, current_prompt)
-        console.print(f"Prompt saved to: {prompt_path} (Length: {len(current_prompt)})")
-
-        schema_path = SCHEMA_DIR / f"iter_{i+1}_schema.json"
-        with open(schema_path, 'w', encoding='utf-8') as f:
-            json.dump(current_schema, f, indent=2)
-        console.print(f"Schema saved to: {schema_path}")
-
-        feedback_bucket = []
-        iteration_scores = []
-
-        # 2. STUDENT BATCH GENERATION
-        student_msgs_list = [
-            [
-                {"role": "system", "content": current_prompt},
-                {"role": "user", "content": article}
-            ]
-            for article in TEST_ARTICLES
-        ]
-        
-        console.print(f"  > Batching {len(TEST_ARTICLES)} articles through Student ({STUDENT_MODEL})...")
-        # Use current_schema here
-        student_outputs = get_batch_completion(STUDENT_MODEL, student_msgs_list, target_schema=current_schema)
-
-        feedback_bucket = []
-        iteration_scores = []
-        
-        # Prepare for Teacher Evaluation
-        teacher_msgs_list = []
-        valid_indices = []
-
-        for idx, output in enumerate(student_outputs):
-            if not output:
-                console.print(f"  [red]> Art {idx+1} | Generation failed[/red]")
-                continue
-            
-            # Save Student Answer
-            json_path = RESPONSE_DIR / f"iter_{i+1}_art_{idx+1}.json"
-            save_text(json_path, output)
-            
-            article = TEST_ARTICLES[idx]
-            eval_instruction = f"""
+def build_shorten_messages(prompt: str, max_length: int, target_length: int) -> List[Dict]:
+    return [{"role": "user", "content": f"""
+            The following prompt is too long ({len(prompt)} characters). 
+            The maximum allowed length is {max_length} characters; aim for about {target_length}.
+
+            Please rewrite it to be SIGNIFICANTLY more concise while maintaining all critical instructions.
+
+            PROMPT:
+            {prompt}
+            """}]
+
+def build_teacher_messages(article: str, output: str) -> List[Dict]:
+    eval_instruction = f"""
             Evaluate this extraction based on the text. 
             Article: {article}
             Extraction: {output}
             
             Check for: 1. Factuality 2. Correct Schema 3. Missing Events.
             """
-            
-            teacher_msgs_list.append([
-                {"role": "system", "content": "You are a data auditor."},
-                {"role": "user", "content": eval_instruction}
-            ])
-            valid_indices.append(idx)
-
-        # 3. TEACHER BATCH EVALUATION
-        if teacher_msgs_list:
-            console.print(f"  > Batching {len(teacher_msgs_list)} outputs through Teacher ({TEACHER_MODEL})...")
-            teacher_outputs = get_batch_completion(TEACHER_MODEL, teacher_msgs_list, target_schema=TEACHER_SCHEMA)
-            
-            for idx, eval_raw in enumerate(teacher_outputs):
-                original_idx = valid_indices[idx]
-                output = student_outputs[original_idx]
-                
-                score = 0
-                critique = "Error parsing eval"
-                
-                try:
-                    eval_json = json.loads(eval_raw)
-                    score = eval_json.get("score", 0)
-                    critique = eval_json.get("critique", "")
-                    
-                    feedback_bucket.append(f"Article {original_idx+1}: {critique}")
-                    iteration_scores.append(score)
-                    
-                    console.print(f"  > Art {original_idx+1} | Score: [bold]{score}[/bold] | {critique[:60]}...")
-
-                    with open(LOG_FILE, 'a', newline='', encoding='utf-8') as f:
-                        writer = csv.writer(f)
-                        writer.writerow([i+1, original_idx+1, output, score, critique, current_prompt])
-                        
-                except Exception as e:
-                    console.print(f"    (Eval parsing failed for Art {original_idx+1}: {e})")
-
-        # C. CALCULATE AVERAGES
-        avg = sum(iteration_scores)/len(iteration_scores) if iteration_scores else 0
-        console.print(f"  > Iteration Average Score: [bold cyan]{avg:.2f}/10[/bold cyan]")
-
-        # D. UPDATE GLOBAL BEST
-        if avg > global_best_score:
-            global_best_score = avg
-            global_best_prompt = current_prompt
-            global_best_schema = current_schema
-            console.print("  [bold green]> New Best Found![/bold green]")
-        
-        # Add to history for final summary
-        history.append({
-            "iteration": i+1,
-            "prompt": current_prompt,
-            "schema_snippet": str(current_schema)[:100] + "...",
-            "avg_score": avg,
-            "critiques": feedback_bucket
-        })
-
-        # D. META-EVALUATION: Should we stop?
-        if i + 1 >= MIN_ITERATIONS:
-            console.print("  > Meta-evaluating optimization status...")
-            meta_eval_prompt = f"""
-            Review the performance of the current prompt in Iteration {i+1}.
-            Average Score: {avg:.2f}/10 (Threshold: {SCORE_THRESHOLD})
-            Feedback bucket: {json.dumps(feedback_bucket)}
-            
-            Decide if we should 'stop_optimization'. 
-            Stop if:
-            1. The average score is >= {SCORE_THRESHOLD}.
-            2. The scores have plateaued and major issues are resolved.
-            3. The feedback indicates only minor nitpicks remain.
+    return [
+        {"role": "system", "content": "You are a data auditor."},
+        {"role": "user", "content": eval_instruction}
+    ]
+
+def new_candidate(prompt: str, schema: dict, candidate_id: str = "1", parent: Optional[str] = None) -> Dict:
+    """A prompt/schema pair under evaluation; "avg" and "feedback" are filled in once graded."""
+    return {"id": candidate_id, "prompt": prompt, "schema": schema, "parent": parent, "avg": None, "feedback": []}
+
+def build_packed_teacher_messages(items: List[tuple]) -> List[Dict]:
+    """One grading request covering several (article, extraction) pairs."""
+    blocks = "\n".join(
+        f"""
+            --- ITEM {n} ---
+            Article: {article}
+            Extraction: {output}
             """
+        for n, (article, output) in enumerate(items, start=1)
+    )
+    eval_instruction = f"""
+            Evaluate each of the following {len(items)} extractions based on its own article.
+            {blocks}
             
-            meta_raw = get_completion(TEACHER_MODEL, [{"role": "user", "content": meta_eval_prompt}], target_schema=META_EVAL_SCHEMA)
-            try:
-                meta_json = json.loads(meta_raw)
-                if meta_json.get("stop_optimization", False):
-                    console.print(f"  [bold green]> Teacher decided to STOP: {meta_json.get('reasoning')}[/bold green]")
-                    break
+            Check each for: 1. Factuality 2. Correct Schema 3. Missing Events.
+            Return exactly one grade per item, using the item number.
+            """
+    return [
+        {"role": "system", "content": "You are a data auditor."},
+        {"role": "user", "content": eval_instruction}
+    ]
+
+def unpack_grades(raw: Optional[str], count: int) -> Optional[List[str]]:
+    """Splits a packed grading reply into per-item TEACHER_SCHEMA JSON strings; None if any item is missing."""
+    try:
+        grades = json.loads(raw)["grades"]
+        by_item = {int(grade["item"]): grade for grade in grades}
+        return [json.dumps({k: v for k, v in by_item[n].items() if k != "item"}) for n in range(1, count + 1)]
+    except Exception:
+        return None
+
+def collect_feedback(graded: Dict[int, tuple]) -> tuple:
+    """Turns {position: (article_id, score, critique)} into (feedback_bucket, iteration_scores) in corpus order."""
+    feedback_bucket = []
+    iteration_scores = []
+    for position in sorted(graded):
+        article_id, score, critique = graded[position]
+        if critique != SURROGATE_CRITIQUE: # surrogate estimates carry no critique to learn from
+            feedback_bucket.append(f"Article {article_id}: {critique}")
+        iteration_scores.append(score)
+    return feedback_bucket, iteration_scores
+
+def candidate_key(prompt: str, schema: dict) -> str:
+    return prompt + "\x1f" + json.dumps(schema, sort_keys=True)
+
+# --- OPTIMIZATION SESSION ---
+class OptimizationSession:
+    """
+    One optimization run: its config, provider, corpus, tracer, run store and artifact directory.
+    Sessions share nothing mutable, so several can run side by side in one process (see sweep.py).
+    """
+
+    def __init__(self, config: Dict, provider: Optional[ModelProvider] = None, run_dir: Optional[Path] = None,
+                 console: Optional["Console"] = None):
+        self.config = config
+
+        # Models
+        self.student_model = config["student_model"]
+        self.teacher_model = config["teacher_model"]
+
+        # Constraints
+        self.max_prompt_length = config.get("max_prompt_length", 2000)
+        self.shorten_candidates = max(1, config.get("shorten_candidates", 4)) # rewrites requested per shortening round
+        self.shorten_temperatures = config.get("shorten_temperatures", [0.5, 0.7, 0.9]) # one shortening round per temperature
+        self.score_threshold = config.get("score_threshold", 9.3)
+        self.min_iterations = config.get("min_iterations", 5)
+        self.max_iterations = config.get("max_iterations", 20)
+        self.starting_prompt = config.get("starting_prompt", "You are an event extraction AI. Read the text and output valid JSON.")
+        self.starting_schema = config.get("starting_schema", DEFAULT_STARTING_SCHEMA)
+        self.optimization_target = config.get("optimization_target", "prompt") # "prompt" or "schema"
+        self.pipeline_mode = config.get("pipeline_mode", False) # overlap student generation and teacher grading
+        self.pipeline_queue_depth = max(1, config.get("pipeline_queue_depth", 8))
+        self.population_size = max(1, config.get("population_size", 1)) # candidates proposed per round (1 = single-prompt loop)
+        self.beam_width = max(1, config.get("beam_width", 2)) # candidates surviving each round in population mode
+        self.early_abort_config = config.get("early_abort") or {} # stop scoring candidates that cannot beat the current best
+        self.pregrade_config = config.get("pregrade") or {} # grade mechanical failures locally instead of asking the teacher
+        self.teacher_pack_size = max(1, config.get("teacher_pack_size", 1)) # (article, extraction) pairs per teacher request
+        self.context_budget_config = config.get("context_budget") or {} # token budgets for history/feedback embedded in teacher prompts
+        self.speculation_config = config.get("speculation") or {} # run the optimize step while the Teacher meta-evaluates
+        self.run_index_config = config.get("run_index") or {} # start from / skip candidates graded in earlier runs
+        self.surrogate = SurrogateScorer.from_config(config.get("surrogate"), self.teacher_model) # grade confident outputs locally
+
+        # Directories & Files
+        self.set_artifact_dir(run_dir or Path("optimization_runs") / f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        self.run_store_backend = config.get("run_store", "csv") # "csv" (legacy), "jsonl" or "sqlite"; see runstore.py
+        self.run_store: Optional[RunStore] = None # opened by initialize_log()
+        self.run_index: Optional[RunIndex] = None # opened by open_run_index()
+        self.resuming = False # set by resume_from(): artifacts go to an existing run directory
+        self.resumed_grades: Dict[tuple, tuple] = {} # run_store.resume_key(...) -> (prompt, schema_id, score, critique)
+        self.resumed_schemas: Dict[str, str] = {} # saved schema file stem -> schema_id, read before this session overwrites them
+        self.speculation: Optional[Speculation] = None # optimize step in flight during meta-evaluation
+        self.prefetched_outputs: Dict[tuple, str] = {} # (iteration, candidate_key, article_id) -> speculative student output
+        self._prefetch_lock = threading.Lock()
+        self._shortened: Dict[tuple, Optional[str]] = {} # (prompt, max_length) -> shortened prompt, None if it failed
+        self._shorten_lock = threading.Lock()
+
+        self.console = console or get_console()
+
+        # Articles come from the "corpus" config section; TEST_ARTICLES are the default
+        self.corpus = load_corpus(config.get("corpus"), default_texts=TEST_ARTICLES)
+        self.corpus_fingerprint = corpus_fingerprint(config.get("corpus"), TEST_ARTICLES)
+        self.corpus_chunk_size = max(1, (config.get("corpus") or {}).get("chunk_size", 256))
+
+        # Provider: built on first use; a shared one is wrapped so this session's calls land in its own trace
+        self.tracer = Tracer()
+        self._token_counter: Optional[TokenCounter] = None # created on first use by token_counter()
+        self._shared_provider = provider
+        self._provider: Optional[ModelProvider] = None
+        self._provider_lock = threading.Lock()
+
+    @property
+    def provider(self) -> ModelProvider:
+        with self._provider_lock:
+            if self._provider is None:
+                if self._shared_provider is not None:
+                    self._provider = InstrumentedProvider(self._shared_provider, self.tracer)
                 else:
-                    console.print(f"  [bold blue]> Teacher decided to CONTINUE: {meta_json.get('reasoning')}[/bold blue]")
-            except:
-                if avg >= SCORE_THRESHOLD:
-                    console.print(f"  > Threshold {SCORE_THRESHOLD} reached. Stopping.")
-                    break
+                    self._provider = get_provider(self.config, tracer=self.tracer)
+            return self._provider
+
+    def set_artifact_dir(self, run_dir: Path):
+        self.artifact_dir = Path(run_dir)
+        self.prompt_dir = self.artifact_dir / "prompts"
+        self.schema_dir = self.artifact_dir / "schemas"
+        self.response_dir = self.artifact_dir / "responses"
+        self.best_prompt_file = self.artifact_dir / "best_prompt.txt"
+        self.summary_file = self.artifact_dir / "results_summary.txt"
+
+    def setup_directories(self):
+        """Creates necessary directories for artifacts and saves used configuration."""
+        self.prompt_dir.mkdir(parents=True, exist_ok=True)
+        self.schema_dir.mkdir(parents=True, exist_ok=True)
+        self.response_dir.mkdir(parents=True, exist_ok=True)
+
+        # Save the configuration used for this run (a resumed run keeps the original)
+        config_save_path = self.artifact_dir / "config_used.json"
+        if self.resuming and config_save_path.exists():
+            with open(config_save_path, 'r', encoding='utf-8') as f:
+                changed = sorted(k for k, v in json.load(f).items() if self.config.get(k) != v)
+            if changed:
+                self.console.print(f"[yellow]Resuming with config changes in: {', '.join(changed)}[/yellow]")
+            self.console.print(f"Resuming run in: [bold]{self.artifact_dir}[/bold]")
+            return
+        with open(config_save_path, 'w', encoding='utf-8') as f:
+            json.dump(self.config, f, indent=2)
+        # The run index matches runs by the corpus they were graded on, not the corpus file as it is later
+        self.save_text(self.artifact_dir / FINGERPRINT_FILE, self.corpus_fingerprint)
+        self.console.print(f"Artifacts will be saved to: [bold]{self.artifact_dir}[/bold]")
+
+    def resume_from(self, run_dir: Path):
+        """Points all artifact paths at an existing run directory and loads the grades it already logged."""
+        self.set_artifact_dir(run_dir)
+        self.resuming = True
+        self.run_store = open_run_store(self.artifact_dir, self.run_store_backend)
+        self.resumed_grades = self.run_store.grades()
+        for path in self.schema_dir.glob("iter_*_schema.json"):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.resumed_schemas[path.stem] = schema_id(json.load(f))
+
+    def write_checkpoint(self, state: Dict):
+        with self.tracer.timed("artifact_write"):
+            # Rows must be on disk before the checkpoint marks their iteration as done
+            self.run_store.flush()
+            save_checkpoint(self.artifact_dir, state)
+            if self.surrogate is not None:
+                # What it learned this run survives a crash or Ctrl-C
+                self.surrogate.save()
+
+    def get_completion(self, model: str, messages: list, target_schema: Optional[dict] = None, temperature: float = 0.1):
+        """Handles API calls via the session's provider."""
+        return self.provider.get_completion(model, messages, target_schema, temperature)
+
+    def get_batch_completion(self, model: str, messages_list: List[list], target_schema: Optional[dict] = None, temperature: float = 0.1):
+        """Handles batched API calls via the session's provider."""
+        return self.provider.get_batch_completion(model, messages_list, target_schema, temperature)
+
+    def save_text(self, filepath: Path, content: str):
+        with self.tracer.timed("artifact_write"):
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(content)
+
+    def ensure_prompt_length(self, prompt: str, max_length: int) -> Optional[str]:
+        """Asks the Teacher to shorten the prompt until it meets max_length; results are cached per prompt."""
+        prompt = clean_prompt(prompt)
+        if len(prompt) <= max_length:
+            return prompt
+
+        key = (prompt, max_length)
+        with self._shorten_lock:
+            if key in self._shortened:
+                self.tracer.count("shorten_cache_hits")
+                return self._shortened[key]
+        with self.tracer.timed("shorten"):
+            shortened = self.shorten_prompt(prompt, max_length)
+        with self._shorten_lock:
+            self._shortened[key] = shortened
+        return shortened
+
+    def shorten_prompt(self, prompt: str, max_length: int) -> Optional[str]:
+        """
+        Each round asks for shorten_candidates rewrites with different target lengths in one batch
+        and keeps the longest one that fits. If none fits, the next round (at the next of
+        shorten_temperatures) starts from the shortest rewrite.
+        """
+        targets = shorten_targets(max_length, self.shorten_candidates)
+        for round_number, temperature in enumerate(self.shorten_temperatures, start=1):
+            self.console.print(f"[bold red]Prompt length ({len(prompt)}) exceeds limit ({max_length}). Requesting {len(targets)} shorter versions (Round {round_number}/{len(self.shorten_temperatures)})...[/bold red]")
+            self.tracer.count("shorten_candidates", len(targets))
+            with phase("shorten"):
+                outputs = self.get_batch_completion(
+                    self.teacher_model, [build_shorten_messages(prompt, max_length, target) for target in targets], temperature=temperature
+                )
+
+            candidates = [clean_prompt(output) for output in outputs if output and output.strip()]
+            fitting = [candidate for candidate in candidates if len(candidate) <= max_length]
+            if fitting:
+                shortened = max(fitting, key=len)
+                self.console.print(f"[green]Successfully shortened prompt to {len(shortened)} characters ({len(fitting)}/{len(targets)} candidates fit).[/green]")
+                return shortened
+            if candidates:
+                prompt = min(candidates, key=len)
+
+        self.console.print(f"[bold red]Failed to shorten prompt after {len(self.shorten_temperatures)} rounds.[/bold red]")
+        return None
+
+    def token_counter(self) -> TokenCounter:
+        """Counts tokens with the Teacher's tokenizer (the model that reads the compressed context)."""
+        if self._token_counter is None:
+            self._token_counter = TokenCounter(self.teacher_model)
+            if not self._token_counter.exact:
+                self.console.print(f"[dim]No local tokenizer for {self.teacher_model}; estimating tokens as characters/4.[/dim]")
+        return self._token_counter
+
+    def record_context_savings(self, stats: Dict):
+        self.tracer.count("context_tokens_before", stats["tokens_before"])
+        self.tracer.count("context_tokens_after", stats["tokens_after"])
+
+    def format_feedback(self, feedback_bucket: List[str]) -> str:
+        """The feedback bucket as embedded in teacher prompts: deduplicated and budgeted if context_budget is enabled."""
+        if not self.context_budget_config.get("enabled", False):
+            return json.dumps(feedback_bucket)
+        entries, stats = fit_feedback(
+            feedback_bucket,
+            self.context_budget_config.get("feedback_tokens", 3000),
+            self.token_counter(),
+            threshold=self.context_budget_config.get("dedupe_threshold", 0.8)
+        )
+        self.record_context_savings(stats)
+        return json.dumps(entries)
+
+    def generate_summary(self, history: List[Dict]):
+        """
+        Asks the Teacher model to summarize the optimization process.
+        """
+        self.console.print("\n[bold cyan]Generating Final Summary...[/bold cyan]")
+
+        if self.context_budget_config.get("enabled", False):
+            history_text, stats = compress_history(
+                history,
+                self.context_budget_config.get("summary_tokens", 6000),
+                self.token_counter(),
+                recent=self.context_budget_config.get("recent_iterations", 3),
+                threshold=self.context_budget_config.get("dedupe_threshold", 0.8)
+            )
+            self.record_context_savings(stats)
+            if stats["level"] > 0:
+                self.console.print(f"  > History compressed to level {stats['level']} to fit {self.context_budget_config.get('summary_tokens', 6000)} tokens")
         else:
-            console.print(f"  > (Iteration {i+1} < Min Iterations {MIN_ITERATIONS}. Continuing optimization...)")
+            history_text = json.dumps(history, indent=2)
 
-        if i < MAX_ITERATIONS - 1: # Don't optimize after the last run
-            # E. OPTIMIZE
-            console.print(f"  > Optimizing {OPTIMIZATION_TARGET}...")
-            
-            if OPTIMIZATION_TARGET == "prompt":
-                opt_msg = f"""
-                The current system prompt is: "{current_prompt}"
-                
-                It failed on these points in the last round: 
-                {json.dumps(feedback_bucket)}
-                
-                Task: Write a BETTER system prompt to fix these errors.
-                Guidelines:
-                1. Keep it concise but comprehensive.
-                2. Address the specific failures mentioned in the feedback.
-                3. Return ONLY the new system prompt text. No "Here is the prompt" or "System Prompt:".
-                4. The prompt MUST be under {MAX_PROMPT_LENGTH} characters.
-                """
-                
-                new_prompt = get_completion(TEACHER_MODEL, [{"role": "user", "content": opt_msg}], temperature=0.7)
-                if new_prompt:
-                    cleaned_prompt = new_prompt.strip().replace('"', '').replace("```", "")
-                    
-                    # Check length constraint and shorten if needed
-                    shortened_prompt = ensure_prompt_length(cleaned_prompt, MAX_PROMPT_LENGTH)
-                    
-                    if shortened_prompt is None or len(shortened_prompt) > MAX_PROMPT_LENGTH:
-                         console.print(f"[bold red]Could not satisfy length constraint ({len(cleaned_prompt) if cleaned_prompt else 'N/A'} chars). Keeping previous valid prompt.[/bold red]")
-                         continue
-
-                    current_prompt = shortened_prompt
-            
-            elif OPTIMIZATION_TARGET == "schema":
-                opt_msg = f"""
-                The current JSON schema is: 
-                {json.dumps(current_schema, indent=2)}
-                
-                The current system prompt is: "{current_prompt}"
-                
-                The extraction had these errors in the last round: 
-                {json.dumps(feedback_bucket)}
-                
-                Task: Write a BETTER JSON Schema to fix these errors.
-                Guidelines:
-                1. You may add fields, change descriptions, or modify enums to enforce better content.
-                2. Do not remove core requirements unless they are the cause of the error.
-                3. Return ONLY the valid JSON schema. No markdown formatting like ```json or "Here is the schema".
-                """
-                
-                new_schema_str = get_completion(TEACHER_MODEL, [{"role": "user", "content": opt_msg}], temperature=0.7)
-                if new_schema_str:
+        summary_prompt = f"""
+        You are an expert Prompt Engineer. Review the history of this optimization session.
+
+        HISTORY:
+        {history_text}
+
+        Task:
+        1. Identify what prompt techniques improved the score.
+        2. Identify what techniques caused failures or low scores.
+        3. Summarize the best practices for this specific task (Event Extraction).
+
+        Output a concise summary.
+        """
+
+        with phase("summary"):
+            summary = self.get_completion(self.teacher_model, [{"role": "user", "content": summary_prompt}])
+        if summary:
+            self.save_text(self.summary_file, summary)
+            from rich.panel import Panel
+            self.console.print(Panel(summary, title="Results Summary", border_style="green"))
+        else:
+            self.console.print("[red]Failed to generate summary.[/red]")
+
+    def report_profile(self):
+        """Writes the call trace into the run directory and prints per-phase timings."""
+        paths = self.tracer.write(self.artifact_dir)
+        rows = self.tracer.summary()
+        total_wall = sum(r["wall_s"] for r in rows) or 1.0
+
+        from rich.table import Table
+        table = Table(title="Run Profile (provider calls by phase)")
+        # Time to first token is only measured for MLX generations streamed one at a time; batches and OpenAI requests are not streamed
+        show_ttft = any(r["avg_ttft_s"] is not None for r in rows)
+        columns = ["Phase", "Calls", "Items", "Fail", "Wall s", "Share", "Prompt tok", "Compl tok", "Compl tok/s", "Queue s"]
+        for column in columns + (["TTFT s"] if show_ttft else []) + ["Retries", "Trunc"]:
+            table.add_column(column, justify="left" if column == "Phase" else "right")
+        for r in rows:
+            ttft = [f"{r['avg_ttft_s']:.2f}" if r["avg_ttft_s"] is not None else "-"] if show_ttft else []
+            table.add_row(
+                r["phase"], str(r["calls"]), str(r["items"]), str(r["failures"]), f"{r['wall_s']:.1f}",
+                f"{r['wall_s'] / total_wall * 100:.0f}%", str(r["prompt_tokens"]), str(r["completion_tokens"]),
+                f"{r['completion_tok_per_s']:.1f}", f"{r['queue_s']:.1f}",
+                *ttft, str(r["retries"]), str(r["truncated"])
+            )
+        self.console.print(table)
+
+        counters = self.tracer.counters
+        self.console.print(
+            f"Shortening: {int(counters.get('shorten', 0))} prompt(s) in {counters.get('shorten_s', 0.0):.1f}s "
+            f"({int(counters.get('shorten_candidates', 0))} candidates, {int(counters.get('shorten_cache_hits', 0))} cache hits) | "
+            f"Artifact writes: {int(counters.get('artifact_write', 0))} ({counters.get('artifact_write_s', 0.0):.2f}s) | "
+            f"Elapsed: {self.tracer.now():.1f}s"
+        )
+        if counters.get("context_tokens_before"):
+            before = int(counters["context_tokens_before"])
+            after = int(counters.get("context_tokens_after", 0))
+            self.console.print(f"Context budget: {before - after} tokens saved in teacher prompts ({before} -> {after}{'' if self.token_counter().exact else ', estimated'})")
+        if counters.get("speculations"):
+            self.console.print(
+                f"Speculation: {int(counters['speculations'])} optimize step(s) overlapped with meta-evaluation, "
+                f"{int(counters.get('speculations_discarded', 0))} discarded | "
+                f"{int(counters.get('speculative_outputs_used', 0))}/{int(counters.get('speculative_outputs', 0))} prefetched student outputs used"
+            )
+        self.report_generation_limits(rows)
+        self.console.print(f"Trace written to: [bold]{paths['jsonl']}[/bold] and [bold]{paths['chrome']}[/bold]")
+
+    def report_generation_limits(self, rows: List[Dict]):
+        """Prints the learned max_tokens per phase next to how often outputs ran into it."""
+        provider = find_provider(self.provider, MLXProvider) or find_provider(self.provider, OpenAIProvider)
+        if provider is None or provider.limits is None:
+            return
+        by_phase = {r["phase"]: r for r in rows}
+        parts = []
+        for phase_name, max_tokens in sorted(provider.limits.snapshot().items()):
+            r = by_phase.get(phase_name, {})
+            parts.append(
+                f"{phase_name} {max_tokens} ({r.get('truncated', 0)} cut off, {r.get('stopped_early', 0)} stopped at JSON end, "
+                f"{r.get('repetition_aborts', 0)} repetition aborts)"
+            )
+        if parts:
+            self.console.print("Generation limits: " + " | ".join(parts))
+
+    def report_cache_stats(self):
+        """Prints completion cache hit/miss counters if the provider is cached."""
+        cached = find_provider(self.provider, CachedProvider)
+        if cached is None:
+            return
+        cached.cache.flush()
+        stats = cached.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (stats["hits"] / lookups * 100) if lookups else 0.0
+        self.console.print(
+            f"Completion cache: [bold]{stats['hits']}[/bold] hits, {stats['misses']} misses "
+            f"({hit_rate:.1f}% hit rate), {stats['bypassed']} bypassed, "
+            f"{stats['evictions']} evicted, {stats['entries']} entries stored"
+        )
+
+    def report_constrained_decoding(self):
+        """Prints how many MLX outputs were schema-constrained and how many still hit max_tokens."""
+        mlx = find_provider(self.provider, MLXProvider)
+        if mlx is None or not mlx.constrained_decoding:
+            return
+        stats = mlx.constraint_stats
+        self.console.print(
+            f"Constrained decoding: [bold]{stats['outputs']}[/bold] outputs, {stats['incomplete']} cut off at max_tokens, "
+            f"{stats['unsupported']} schema(s) generated unconstrained"
+        )
+
+    def report_batching(self):
+        """Prints how the MLX provider split requests into length-bucketed batches."""
+        mlx = find_provider(self.provider, MLXProvider)
+        if mlx is None or not mlx.batch_stats["batches"]:
+            return
+        stats = mlx.batch_stats
+        padded = stats["prompt_tokens"] + stats["padding_tokens"]
+        self.console.print(
+            f"Batching: [bold]{stats['sequences']}[/bold] sequences in {stats['batches']} batches "
+            f"({stats['sequences'] / stats['batches']:.1f} per batch), "
+            f"{stats['padding_tokens'] / padded * 100 if padded else 0.0:.1f}% of prompt tokens were padding"
+        )
+
+    def report_routing(self):
+        """Prints per-endpoint request and failure counts when requests are routed across endpoints."""
+        router = find_provider(self.provider, RoutingProvider)
+        if router is None:
+            return
+        from rich.table import Table
+        table = Table(title="Endpoints")
+        for column in ["Role", "Endpoint", "Requests", "Failures", "Backoffs", "Health fails", "State"]:
+            table.add_column(column, justify="left" if column in ("Role", "Endpoint", "State") else "right")
+        for row in router.stats():
+            table.add_row(
+                row["role"], row["endpoint"], str(row["requests"]), str(row["failures"]), str(row["backoffs"]),
+                str(row["health_checks_failed"]), "[yellow]backing off[/yellow]" if row["backing_off"] else "ok"
+            )
+        self.console.print(table)
+
+    def grade_outputs(self, items: List[tuple]) -> List[Optional[str]]:
+        with phase("teacher-grade"):
+            return self._grade_outputs(items)
+
+    def _grade_outputs(self, items: List[tuple]) -> List[Optional[str]]:
+        """
+        Grades (article, extraction) pairs with the Teacher and returns one raw TEACHER_SCHEMA reply per pair.
+        With teacher_pack_size > 1 several pairs share one request; packs whose reply cannot be
+        demultiplexed are re-graded item by item.
+        """
+        if self.teacher_pack_size <= 1 or len(items) <= 1:
+            return self.get_batch_completion(self.teacher_model, [build_teacher_messages(a, o) for a, o in items], target_schema=TEACHER_SCHEMA)
+
+        packs = [items[start:start + self.teacher_pack_size] for start in range(0, len(items), self.teacher_pack_size)]
+        packed_raws = self.get_batch_completion(self.teacher_model, [build_packed_teacher_messages(pack) for pack in packs], target_schema=PACKED_TEACHER_SCHEMA)
+
+        results: List[Optional[str]] = []
+        fallback = []
+        for pack, raw in zip(packs, packed_raws):
+            grades = unpack_grades(raw, len(pack))
+            if grades is None:
+                fallback.extend(range(len(results), len(results) + len(pack)))
+                grades = [None] * len(pack)
+            results.extend(grades)
+
+        if fallback:
+            self.console.print(f"  [yellow]> Packed grading failed to parse for {len(fallback)} item(s); re-grading them individually[/yellow]")
+            single_raws = self.get_batch_completion(self.teacher_model, [build_teacher_messages(*items[n]) for n in fallback], target_schema=TEACHER_SCHEMA)
+            for n, raw in zip(fallback, single_raws):
+                results[n] = raw
+        return results
+
+    def log_evaluation(self, iteration: int, article_id: str, output: str, score, critique: str, prompt: str, candidate_id: str = "1", schema: Optional[dict] = None):
+        """Buffers one graded row in the run store (safe to call from worker threads)."""
+        with self.tracer.timed("artifact_write"):
+            self.run_store.log(iteration, article_id, output, score, critique, prompt, candidate_id, schema)
+
+    def response_path(self, iteration: int, article_id: str, candidate: Optional[Dict] = None) -> Path:
+        safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(article_id))
+        if self.population_size > 1 and candidate is not None:
+            return self.response_dir / f"iter_{iteration}_cand_{candidate['id']}_art_{safe_id}.json"
+        return self.response_dir / f"iter_{iteration}_art_{safe_id}.json"
+
+    def resumed_grade(self, iteration: int, candidate: Dict, article: Article) -> Optional[tuple]:
+        """(score, critique) logged for this item before a restart, if it was graded with the same prompt and schema."""
+        if not self.resumed_grades:
+            return None
+        entry = self.resumed_grades.get(self.run_store.resume_key(iteration, candidate["id"], candidate["prompt"], article.id))
+        if entry is None or entry[0] != candidate["prompt"]:
+            return None
+        logged_schema = entry[1]
+        if logged_schema is None:
+            # The legacy CSV log keeps no schema; the one saved for that iteration stands in
+            suffix = f"_cand_{candidate['id']}" if self.population_size > 1 else ""
+            logged_schema = self.resumed_schemas.get(f"iter_{iteration}{suffix}_schema")
+        if logged_schema != schema_id(candidate["schema"]):
+            return None
+        self.tracer.count("resumed_grades")
+        return entry[2], entry[3]
+
+    def resumed_output(self, iteration: int, candidate: Dict, article: Article) -> Optional[str]:
+        """Student output saved before a restart whose grade was not logged yet."""
+        if not self.resuming:
+            return None
+        path = self.response_path(iteration, article.id, candidate)
+        if not path.exists():
+            return None
+        self.tracer.count("resumed_outputs")
+        return path.read_text(encoding='utf-8')
+
+    def reusable_output(self, iteration: int, candidate: Dict, article: Article) -> Optional[str]:
+        """Student output generated speculatively for this candidate, or saved before a restart."""
+        with self._prefetch_lock:
+            output = self.prefetched_outputs.pop((iteration, candidate_key(candidate["prompt"], candidate["schema"]), str(article.id)), None)
+        if output is not None:
+            self.tracer.count("speculative_outputs_used")
+            return output
+        return self.resumed_output(iteration, candidate, article)
+
+    def report_resumed(self):
+        if self.resuming:
+            counters = self.tracer.counters
+            self.console.print(f"  > Resume: {int(counters.get('resumed_grades', 0))} grade(s) and {int(counters.get('resumed_outputs', 0))} student output(s) reused so far")
+
+    def record_grade(self, iteration: int, candidate: Dict, article_id: str, output: str, score, critique: str):
+        from rich.markup import escape
+        label = f"Cand {candidate['id']} | Art {article_id}" if self.population_size > 1 else f"Art {article_id}"
+        self.console.print(f"  > {label} | Score: [bold]{score}[/bold] | {escape(critique[:60])}...")
+        self.log_evaluation(iteration, article_id, output, score, critique, candidate["prompt"], candidate["id"], candidate["schema"])
+
+    def record_teacher_eval(self, iteration: int, candidate: Dict, article: Article, output: str, eval_raw: Optional[str]) -> Optional[tuple]:
+        """Parses a teacher grading, logs it, trains the surrogate on it and returns (score, critique), or None if unparseable."""
+        article_id = article.id
+        try:
+            eval_json = json.loads(eval_raw)
+            score = eval_json.get("score", 0)
+            critique = eval_json.get("critique", "")
+        except Exception as e:
+            label = f"Cand {candidate['id']} | Art {article_id}" if self.population_size > 1 else f"Art {article_id}"
+            self.console.print(f"    (Eval parsing failed for {label}: {e})")
+            return None
+        self.record_grade(iteration, candidate, article_id, output, score, critique)
+        if self.surrogate is not None and isinstance(score, (int, float)):
+            with self.tracer.timed("surrogate"):
+                self.surrogate.observe(article.text, output, score)
+        return score, critique
+
+    def run_pregrade(self, iteration: int, candidate: Dict, article: Article, output: str) -> Optional[tuple]:
+        """Grades mechanical failures locally; returns (score, critique) if the teacher call can be skipped."""
+        if not self.pregrade_config.get("enabled", False):
+            return None
+        verdict = pregrade(output, article.text, candidate["schema"], check_location_grounding=self.pregrade_config.get("check_locations", True))
+        if verdict is not None:
+            self.record_grade(iteration, candidate, article.id, output, *verdict)
+        return verdict
+
+    def report_pregrade(self, avoided: int, escalated: int):
+        if self.pregrade_config.get("enabled", False):
+            self.console.print(f"  > Pre-grader: {avoided} teacher call(s) avoided, {escalated} output(s) escalated")
+
+    def run_surrogate(self, iteration: int, candidate: Dict, article: Article, output: str) -> Optional[tuple]:
+        """Grades the output with the surrogate scorer; returns (score, critique) if the teacher call can be skipped."""
+        if self.surrogate is None:
+            return None
+        with self.tracer.timed("surrogate"):
+            score = self.surrogate.estimate(article.text, output)
+        if score is None:
+            return None
+        self.record_grade(iteration, candidate, article.id, output, score, SURROGATE_CRITIQUE)
+        return score, SURROGATE_CRITIQUE
+
+    def report_surrogate(self):
+        if self.surrogate is None:
+            return
+        stats = self.surrogate.stats
+        agreement = self.surrogate.agreement()
+        checks = f"{agreement * 100:.0f}% agreement (mean error {self.surrogate.mean_error():.2f}) over the last {len(self.surrogate.checks)} checks" if agreement is not None else "no checks yet"
+        self.console.print(
+            f"  > Surrogate: {stats['estimated']} output(s) graded locally so far, {stats['audited']} audited by the Teacher; "
+            f"{checks}, {'trusted' if self.surrogate.trusted else 'not trusted'} ({self.surrogate.samples} grades learned)"
+        )
+
+    def make_abort_tracker(self, abort_below: Optional[float]) -> EarlyAbortTracker:
+        """Builds the early-abort tracker for one evaluation round (inactive unless enabled and a bar exists)."""
+        return EarlyAbortTracker(
+            abort_below if self.early_abort_config.get("enabled", False) else None,
+            min_articles=self.early_abort_config.get("min_articles", 8),
+            z=self.early_abort_config.get("z", 1.96),
+            min_std=self.early_abort_config.get("min_std", 1.0)
+        )
+
+    def chunk_schedule(self, tracker: EarlyAbortTracker) -> Iterator[int]:
+        if tracker.active:
+            return rung_sizes(self.early_abort_config.get("min_articles", 8), self.early_abort_config.get("eta", 2), self.corpus_chunk_size)
+        return repeat(self.corpus_chunk_size)
+
+    def report_aborts(self, tracker: EarlyAbortTracker, candidates: List[Dict]):
+        if not tracker.aborted:
+            return
+        total = len(self.corpus)
+        skipped = 0
+        for candidate in candidates:
+            if tracker.is_aborted(candidate["id"]):
+                candidate["aborted"] = True
+                n, _ = tracker.stats(candidate["id"])
+                skipped += max(0, total - n)
+        self.console.print(f"  > Early abort: {len(tracker.aborted)} candidate(s) stopped, ~{skipped} student+teacher call pairs skipped")
+
+    def announce_abort(self, tracker: EarlyAbortTracker, candidate: Dict):
+        n, mean = tracker.stats(candidate["id"])
+        self.console.print(f"  [yellow]> Aborting candidate {candidate['id']} after {n} articles (avg {mean:.2f}, upper bound {tracker.aborted[candidate['id']]:.2f} < {tracker.threshold:.2f})[/yellow]")
+
+    def generate_student_outputs(self, work: List[tuple]) -> List[Optional[str]]:
+        """
+        Runs the student on (candidate, position, article) work items.
+        Items sharing a schema go out as a single batch, so all prompt candidates share one batch.
+        """
+        groups = {}
+        for n, (candidate, _, _) in enumerate(work):
+            groups.setdefault(json.dumps(candidate["schema"], sort_keys=True), []).append(n)
+
+        outputs: List[Optional[str]] = [None] * len(work)
+        for indices in groups.values():
+            schema = work[indices[0]][0]["schema"]
+            msgs_list = [build_student_messages(work[n][0]["prompt"], work[n][2].text) for n in indices]
+            with phase("student"):
+                batch_outputs = self.get_batch_completion(self.student_model, msgs_list, target_schema=schema)
+            for n, output in zip(indices, batch_outputs):
+                outputs[n] = output
+        return outputs
+
+    def evaluate_batched(self, iteration: int, candidates: List[Dict], abort_below: Optional[float] = None) -> Dict[str, tuple]:
+        """
+        Runs the student batch for every candidate, then grades all outputs in one teacher batch.
+        The corpus is streamed in chunks of corpus.chunk_size articles to bound memory. With early
+        abort enabled, chunks follow a growing rung schedule and candidates that cannot beat
+        abort_below stop being evaluated.
+        Returns {candidate_id: (feedback_bucket, iteration_scores)}.
+        """
+        graded = {candidate["id"]: {} for candidate in candidates}
+        tracker = self.make_abort_tracker(abort_below)
+        active = list(candidates)
+        position = 0
+        avoided = 0
+        escalated = 0
+        self.console.print(f"  > Batching articles from {self.corpus.describe()} x {len(candidates)} candidate(s) through Student ({self.student_model})...")
+
+        for chunk in iter_sized_chunks(self.corpus, self.chunk_schedule(tracker)):
+            work = []
+            for candidate in active:
+                for idx, article in enumerate(chunk):
+                    result = self.resumed_grade(iteration, candidate, article)
+                    if result is not None:
+                        graded[candidate["id"]][position + idx] = (article.id, *result)
+                        tracker.add(candidate["id"], result[0])
+                    else:
+                        work.append((candidate, position + idx, article))
+
+            student_outputs = [self.reusable_output(iteration, candidate, article) for candidate, _, article in work]
+            missing = [n for n, output in enumerate(student_outputs) if output is None]
+            for n, output in zip(missing, self.generate_student_outputs([work[n] for n in missing])):
+                student_outputs[n] = output
+
+            # Prepare for Teacher Evaluation
+            teacher_items = []
+            valid_indices = []
+
+            for n, output in enumerate(student_outputs):
+                candidate, _, article = work[n]
+                if not output:
+                    self.console.print(f"  [red]> Art {article.id} | Generation failed[/red]")
+                    continue
+
+                # Save Student Answer
+                self.save_text(self.response_path(iteration, article.id, candidate), output)
+
+                verdict = self.run_pregrade(iteration, candidate, article, output)
+                if verdict is not None:
+                    avoided += 1
+                else:
+                    escalated += 1
+                    verdict = self.run_surrogate(iteration, candidate, article, output)
+                if verdict is not None:
+                    graded[candidate["id"]][work[n][1]] = (article.id, *verdict)
+                    tracker.add(candidate["id"], verdict[0])
+                    continue
+
+                teacher_items.append((article.text, output))
+                valid_indices.append(n)
+
+            if teacher_items:
+                self.console.print(f"  > Batching {len(teacher_items)} outputs through Teacher ({self.teacher_model})...")
+                teacher_outputs = self.grade_outputs(teacher_items)
+
+                for n, eval_raw in zip(valid_indices, teacher_outputs):
+                    candidate, article_position, article = work[n]
+                    result = self.record_teacher_eval(iteration, candidate, article, student_outputs[n], eval_raw)
+                    if result is not None:
+                        graded[candidate["id"]][article_position] = (article.id, *result)
+                        tracker.add(candidate["id"], result[0])
+            position += len(chunk)
+            with self.tracer.timed("artifact_write"):
+                self.run_store.flush()
+
+            # Rung boundary: drop candidates that can no longer reach the bar
+            for candidate in active:
+                if tracker.check(candidate["id"]):
+                    self.announce_abort(tracker, candidate)
+            active = [candidate for candidate in active if not tracker.is_aborted(candidate["id"])]
+            if not active:
+                break
+
+        self.report_pregrade(avoided, escalated)
+        self.report_surrogate()
+        self.report_aborts(tracker, candidates)
+        self.report_resumed()
+        return {candidate_id: collect_feedback(rows) for candidate_id, rows in graded.items()}
+
+    def evaluate_pipelined(self, iteration: int, candidates: List[Dict], abort_below: Optional[float] = None) -> Dict[str, tuple]:
+        """
+        Streams each student output to teacher grading as soon as it arrives.
+        Student and teacher requests overlap; a bounded queue between them applies backpressure.
+        Aborted candidates (see evaluate_batched) get no further student or teacher calls.
+        """
+        tracker = self.make_abort_tracker(abort_below)
+        workers = max(1, self.config.get("max_concurrency", 1))
+        handoff = queue.Queue(maxsize=self.pipeline_queue_depth)
+        # Caps student work that is in flight or waiting for the teacher
+        slots = threading.BoundedSemaphore(workers + self.pipeline_queue_depth)
+        graded = {candidate["id"]: {} for candidate in candidates}
+        graded_lock = threading.Lock()
+        pregrade_counts = {"avoided": 0, "escalated": 0}
+
+        self.console.print(f"  > Pipelining articles from {self.corpus.describe()} x {len(candidates)} candidate(s): Student ({self.student_model}) -> Teacher ({self.teacher_model})...")
+
+        def student_stage():
+            try:
+                produce_student_work()
+            finally:
+                # Always signal end-of-stream, or the teacher consumers would wait forever
+                handoff.put(None)
+
+        def produce_student_work():
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="student") as pool:
+                def generate(candidate: Dict, position: int, article: Article):
+                    output = self.reusable_output(iteration, candidate, article)
                     try:
-                        # Clean up markdown if present
-                        if "```json" in new_schema_str:
-                            new_schema_str = new_schema_str.split("```json")[1].split("```")[0].strip()
-                        elif "```" in new_schema_str:
-                            new_schema_str = new_schema_str.split("```")[1].split("```")[0].strip()
-                            
-                        new_schema = json.loads(new_schema_str)
-                        current_schema = new_schema
-                        console.print("[green]Successfully optimized schema.[/green]")
-                    except json.JSONDecodeError as e:
-                        console.print(f"[bold red]Failed to parse new schema: {e}. Keeping previous schema.[/bold red]")
+                        if output is None:
+                            with phase("student"):
+                                output = self.get_completion(self.student_model, build_student_messages(candidate["prompt"], article.text), target_schema=candidate["schema"])
+                    except Exception as e:
+                        self.console.print(f"  [red]> Art {article.id} | Student error: {e}[/red]")
+                        output = None
+                    handoff.put((candidate, position, article, output))
+
+                for position, article in enumerate(self.corpus):
+                    for candidate in candidates:
+                        if tracker.is_aborted(candidate["id"]):
+                            continue
+                        result = self.resumed_grade(iteration, candidate, article)
+                        if result is not None:
+                            finish(candidate, position, article, result)
+                            continue
+                        slots.acquire()
+                        pool.submit(generate, candidate, position, article)
+
+        def finish(candidate: Dict, position: int, article: Article, result: Optional[tuple]):
+            if result is None:
+                return
+            with graded_lock:
+                graded[candidate["id"]][position] = (article.id, *result)
+            if tracker.add(candidate["id"], result[0]):
+                self.announce_abort(tracker, candidate)
+
+        def teacher_stage():
+            finished = False
+            while not finished:
+                items = [handoff.get()]
+                # Drain outputs that are already waiting so they can share one packed teacher request
+                while len(items) < self.teacher_pack_size:
+                    try:
+                        items.append(handoff.get_nowait())
+                    except queue.Empty:
+                        break
+
+                to_grade = []
+                for item in items:
+                    if item is None:
+                        # Pass the end-of-stream marker on to the other consumers
+                        handoff.put(None)
+                        finished = True
                         continue
-                        
-    # --- FINALIZATION ---
-    console.print("\n[bold]=== OPTIMIZATION COMPLETE ===[/bold]")
-    
-    # 1. Save Best Artifacts
-    if OPTIMIZATION_TARGET == "prompt":
-        save_text(BEST_PROMPT_FILE, global_best_prompt)
-        console.print(f"Best Prompt (Score: {global_best_score}) saved to: [bold]{BEST_PROMPT_FILE}[/bold]")
-    else:
-        # Save best schema
-        BEST_SCHEMA_FILE = ARTIFACT_DIR / "best_schema.json"
-        with open(BEST_SCHEMA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(global_best_schema, f, indent=2)
-        console.print(f"Best Schema (Score: {global_best_score}) saved to: [bold]{BEST_SCHEMA_FILE}[/bold]")
-    
-    # 2. Generate Summary
-    generate_summary(history)
+                    candidate, position, article, output = item
+                    slots.release()
+                    if tracker.is_aborted(candidate["id"]):
+                        continue
+                    if not output:
+                        self.console.print(f"  [red]> Art {article.id} | Generation failed[/red]")
+                        continue
+
+                    self.save_text(self.response_path(iteration, article.id, candidate), output)
+                    result = self.run_pregrade(iteration, candidate, article, output)
+                    with graded_lock:
+                        pregrade_counts["avoided" if result is not None else "escalated"] += 1
+                    if result is None:
+                        result = self.run_surrogate(iteration, candidate, article, output)
+                    if result is not None:
+                        finish(candidate, position, article, result)
+                    else:
+                        to_grade.append(item)
+
+                if to_grade:
+                    eval_raws = self.grade_outputs([(article.text, output) for _, _, article, output in to_grade])
+                    for (candidate, position, article, output), eval_raw in zip(to_grade, eval_raws):
+                        finish(candidate, position, article, self.record_teacher_eval(iteration, candidate, article, output, eval_raw))
+
+        # Daemon threads so an interrupted run exits instead of finishing the iteration in the background
+        producer = threading.Thread(target=student_stage, name="student-producer", daemon=True)
+        consumers = [threading.Thread(target=teacher_stage, name=f"teacher-{n}", daemon=True) for n in range(workers)]
+        producer.start()
+        for consumer in consumers:
+            consumer.start()
+        producer.join()
+        for consumer in consumers:
+            consumer.join()
+
+        self.report_pregrade(pregrade_counts["avoided"], pregrade_counts["escalated"])
+        self.report_surrogate()
+        self.report_aborts(tracker, candidates)
+        self.report_resumed()
+        return {candidate_id: collect_feedback(rows) for candidate_id, rows in graded.items()}
+
+    def evaluate_candidates(self, iteration: int, candidates: List[Dict], abort_below: Optional[float] = None) -> Dict[str, tuple]:
+        if self.speculation is not None:
+            # Speculative student outputs for these candidates may still be generating
+            self.speculation.wait()
+            self.speculation = None
+        results = {}
+        for candidate in candidates:
+            indexed = self.indexed_result(candidate)
+            if indexed is not None:
+                results[candidate["id"]] = indexed
+        candidates = [candidate for candidate in candidates if candidate["id"] not in results]
+        if not candidates:
+            return results
+
+        # Let local backends load the Teacher while the Student generates
+        self.provider.prewarm(self.teacher_model)
+        if self.pipeline_mode and not self.config.get("use_mlx", False):
+            results.update(self.evaluate_pipelined(iteration, candidates, abort_below))
+        else:
+            results.update(self.evaluate_batched(iteration, candidates, abort_below))
+        return results
+
+    def open_run_index(self):
+        """Brings the cross-run index up to date with the runs written since it was last updated."""
+        if not self.run_index_config.get("enabled", False):
+            return
+        root = Path(self.run_index_config.get("root", "optimization_runs"))
+        self.run_index = RunIndex(Path(self.run_index_config.get("path") or root / INDEX_FILE))
+        stats = self.run_index.update(root, exclude=self.artifact_dir)
+        self.console.print(f"Run index: {stats['scanned']} new or changed run(s) indexed ({stats['evaluations']} evaluations), {stats['unchanged']} unchanged")
+
+    def warm_start_candidates(self, count: int) -> List[Dict]:
+        """The best candidates earlier runs graded on this whole corpus with this student model."""
+        if self.run_index is None or not self.run_index_config.get("warm_start", True):
+            return []
+        candidates = []
+        for entry in self.run_index.top(self.student_model, self.corpus_fingerprint, count, min_articles=len(self.corpus)):
+            # Same checks as the starting prompt: max_prompt_length may be lower than in the earlier run
+            prompt = self.ensure_prompt_length(entry["prompt"], self.max_prompt_length)
+            if prompt is None:
+                self.console.print(f"[yellow]Warm start: skipping a candidate from {entry['run_dir']} that exceeds {self.max_prompt_length} characters and could not be shortened[/yellow]")
+                continue
+            self.console.print(f"Warm start: [bold cyan]{entry['mean_score']:.2f}[/bold cyan] on {entry['articles']} articles from {entry['run_dir']}")
+            candidates.append(new_candidate(prompt, entry["schema"]))
+        return candidates
+
+    def indexed_result(self, candidate: Dict) -> Optional[tuple]:
+        """(feedback_bucket, scores) of an earlier run that graded this exact candidate on the whole corpus."""
+        if self.run_index is None or not self.run_index_config.get("skip_seen", True):
+            return None
+        entry = self.run_index.lookup(self.student_model, self.corpus_fingerprint, candidate["prompt"], candidate["schema"], len(self.corpus))
+        if entry is None:
+            return None
+        self.tracer.count("index_reused")
+        self.console.print(f"  > Candidate {candidate['id']} was graded on {entry['articles']} articles in {entry['run_dir']} (avg {entry['mean_score']:.2f}); reusing those grades")
+        return entry["feedback"], entry["scores"]
+
+    def save_candidate_artifacts(self, iteration: int, candidate: Dict):
+        suffix = f"_cand_{candidate['id']}" if self.population_size > 1 else ""
+        prompt_path = self.prompt_dir / f"iter_{iteration}{suffix}.txt"
+        self.save_text(prompt_path, candidate["prompt"])
+        self.console.print(f"Prompt saved to: {prompt_path} (Length: {len(candidate['prompt'])})")
+
+        schema_path = self.schema_dir / f"iter_{iteration}{suffix}_schema.json"
+        with open(schema_path, 'w', encoding='utf-8') as f:
+            json.dump(candidate["schema"], f, indent=2)
+        self.console.print(f"Schema saved to: {schema_path}")
+
+    def speculate(self, iteration: int, propose: Callable[[], object], candidates_of: Callable[[object], List[Dict]]) -> Speculation:
+        """
+        Starts the optimize step (`propose`) in the background so it overlaps the meta-evaluation.
+        Once it returns, the Student already runs the proposed candidates on the first articles
+        of `iteration` (speculation.prefetch_articles, default one corpus chunk).
+        """
+        self.tracer.count("speculations")
+        self.speculation = Speculation(propose, lambda proposal: self.prefetch_student_outputs(iteration, candidates_of(proposal)))
+        return self.speculation
+
+    def prefetch_student_outputs(self, iteration: int, candidates: List[Dict]):
+        # By default the first corpus chunk, which the next evaluation generates in one batch
+        limit = self.speculation_config.get("prefetch_articles")
+        articles = list(islice(self.corpus, self.corpus_chunk_size if limit is None else limit))
+        work = [(candidate, n, article) for candidate in candidates for n, article in enumerate(articles)]
+        if not work:
+            return
+        outputs = self.generate_student_outputs(work)
+        with self._prefetch_lock:
+            for (candidate, _, article), output in zip(work, outputs):
+                if output:
+                    self.prefetched_outputs[(iteration, candidate_key(candidate["prompt"], candidate["schema"]), str(article.id))] = output
+        self.tracer.count("speculative_outputs", sum(1 for output in outputs if output))
+
+    def discard_speculation(self):
+        """The Teacher decided to stop: the speculative optimize step and its student outputs are not needed."""
+        self.speculation.discard()
+        self.speculation = None
+        with self._prefetch_lock:
+            self.prefetched_outputs.clear()
+        self.tracer.count("speculations_discarded")
+        self.console.print("  > Discarded the speculative optimization step.")
+
+    def meta_evaluate(self, iteration: int, avg: float, feedback_bucket: List[str]) -> bool:
+        """Asks the Teacher whether to stop; falls back to the score threshold if the reply is unusable."""
+        with phase("student"):
+            self.provider.prewarm(self.student_model)
+        self.console.print("  > Meta-evaluating optimization status...")
+        meta_eval_prompt = f"""
+                Review the performance of the current prompt in Iteration {iteration}.
+                Average Score: {avg:.2f}/10 (Threshold: {self.score_threshold})
+                Feedback bucket: {self.format_feedback(feedback_bucket)}
+
+                Decide if we should 'stop_optimization'. 
+                Stop if:
+                1. The average score is >= {self.score_threshold}.
+                2. The scores have plateaued and major issues are resolved.
+                3. The feedback indicates only minor nitpicks remain.
+                """
+
+        with phase("meta-eval"):
+            meta_raw = self.get_completion(self.teacher_model, [{"role": "user", "content": meta_eval_prompt}], target_schema=META_EVAL_SCHEMA)
+        try:
+            meta_json = json.loads(meta_raw)
+            if meta_json.get("stop_optimization", False):
+                self.console.print(f"  [bold green]> Teacher decided to STOP: {meta_json.get('reasoning')}[/bold green]")
+                return True
+            self.console.print(f"  [bold blue]> Teacher decided to CONTINUE: {meta_json.get('reasoning')}[/bold blue]")
+        except:
+            if avg >= self.score_threshold:
+                self.console.print(f"  > Threshold {self.score_threshold} reached. Stopping.")
+                return True
+        return False
+
+    def build_optimize_message(self, prompt: str, schema: dict, feedback_bucket: List[str]) -> str:
+        feedback_text = self.format_feedback(feedback_bucket)
+        if self.optimization_target == "prompt":
+            return f"""
+                    The current system prompt is: "{prompt}"
+
+                    It failed on these points in the last round: 
+                    {feedback_text}
+
+                    Task: Write a BETTER system prompt to fix these errors.
+                    Guidelines:
+                    1. Keep it concise but comprehensive.
+                    2. Address the specific failures mentioned in the feedback.
+                    3. Return ONLY the new system prompt text. No "Here is the prompt" or "System Prompt:".
+                    4. The prompt MUST be under {self.max_prompt_length} characters.
+                    """
+        return f"""
+                    The current JSON schema is: 
+                    {json.dumps(schema, indent=2)}
+
+                    The current system prompt is: "{prompt}"
+
+                    The extraction had these errors in the last round: 
+                    {feedback_text}
+
+                    Task: Write a BETTER JSON Schema to fix these errors.
+                    Guidelines:
+                    1. You may add fields, change descriptions, or modify enums to enforce better content.
+                    2. Do not remove core requirements unless they are the cause of the error.
+                    3. Return ONLY the valid JSON schema. No markdown formatting like ```json or "Here is the schema".
+                    """
+
+    def optimize_candidate(self, prompt: str, schema: dict, feedback_bucket: List[str]) -> Optional[tuple]:
+        """Asks the Teacher for an improved (prompt, schema); None keeps the current one."""
+        self.console.print(f"  > Optimizing {self.optimization_target}...")
+        opt_msg = self.build_optimize_message(prompt, schema, feedback_bucket)
+        with phase("optimize"):
+            new_raw = self.get_completion(self.teacher_model, [{"role": "user", "content": opt_msg}], temperature=0.7)
+        return self.apply_optimization(new_raw, prompt, schema)
+
+    def apply_optimization(self, raw: Optional[str], prompt: str, schema: dict) -> Optional[tuple]:
+        """Turns the Teacher's optimize reply into a new (prompt, schema) pair, or None if it is unusable."""
+        if not raw:
+            return None
+
+        if self.optimization_target == "prompt":
+            cleaned_prompt = clean_prompt(raw)
+
+            # Check length constraint and shorten if needed
+            shortened_prompt = self.ensure_prompt_length(cleaned_prompt, self.max_prompt_length)
+
+            if shortened_prompt is None or len(shortened_prompt) > self.max_prompt_length:
+                self.console.print(f"[bold red]Could not satisfy length constraint ({len(cleaned_prompt) if cleaned_prompt else 'N/A'} chars). Keeping previous valid prompt.[/bold red]")
+                return None
+            return shortened_prompt, schema
+
+        elif self.optimization_target == "schema":
+            try:
+                # Clean up markdown if present
+                if "```json" in raw:
+                    raw = raw.split("```json")[1].split("```")[0].strip()
+                elif "```" in raw:
+                    raw = raw.split("```")[1].split("```")[0].strip()
+
+                new_schema = json.loads(raw)
+                self.console.print("[green]Successfully optimized schema.[/green]")
+                return prompt, new_schema
+            except json.JSONDecodeError as e:
+                self.console.print(f"[bold red]Failed to parse new schema: {e}. Keeping previous schema.[/bold red]")
+        return None
+
+    def propose_candidates(self, iteration: int, parents: List[Dict], count: int, seen: set) -> List[Dict]:
+        """Asks the Teacher for `count` children of the surviving parents in a single batch."""
+        opt_msgs_list = []
+        parent_of = []
+        for n in range(count):
+            parent = parents[n % len(parents)]
+            opt_msgs_list.append([{"role": "user", "content": self.build_optimize_message(parent["prompt"], parent["schema"], parent["feedback"])}])
+            parent_of.append(parent)
+
+        self.console.print(f"  > Requesting {count} candidate {self.optimization_target}s from Teacher...")
+        with phase("optimize"):
+            raw_outputs = self.get_batch_completion(self.teacher_model, opt_msgs_list, temperature=0.7)
+
+        children = []
+        for parent, raw in zip(parent_of, raw_outputs):
+            result = self.apply_optimization(raw, parent["prompt"], parent["schema"])
+            if result is None:
+                continue
+            key = candidate_key(*result)
+            if key in seen:
+                continue
+            seen.add(key)
+            children.append(new_candidate(result[0], result[1], candidate_id=f"{iteration}.{len(children)+1}", parent=parent["id"]))
+        return children
+
+    def initialize_log(self):
+        if self.run_store is None:
+            self.run_store = open_run_store(self.artifact_dir, self.run_store_backend)
+
+    def finalize_run(self, global_best_score: float, global_best_prompt: str, global_best_schema: dict, history: List[Dict]) -> Dict:
+        self.console.print("\n[bold]=== OPTIMIZATION COMPLETE ===[/bold]")
+        self.run_store.close()
+        if self.surrogate is not None and self.surrogate.path is not None:
+            self.surrogate.save()
+            self.console.print(f"Surrogate scorer ({self.surrogate.samples} grades learned) saved to {self.surrogate.path}")
+        self.console.print(f"Evaluations logged to the [bold]{self.run_store.backend}[/bold] run store in {self.artifact_dir}")
+
+        # 1. Save Best Artifacts
+        if self.optimization_target == "prompt":
+            self.save_text(self.best_prompt_file, global_best_prompt)
+            self.console.print(f"Best Prompt (Score: {global_best_score}) saved to: [bold]{self.best_prompt_file}[/bold]")
+        else:
+            # Save best schema
+            BEST_SCHEMA_FILE = self.artifact_dir / "best_schema.json"
+            with open(BEST_SCHEMA_FILE, 'w', encoding='utf-8') as f:
+                json.dump(global_best_schema, f, indent=2)
+            self.console.print(f"Best Schema (Score: {global_best_score}) saved to: [bold]{BEST_SCHEMA_FILE}[/bold]")
+
+        # 2. Generate Summary
+        self.generate_summary(history)
+
+        # 3. Cache Statistics
+        self.report_cache_stats()
+        self.report_constrained_decoding()
+        self.report_batching()
+        self.report_routing()
+
+        # 4. Run Profile
+        self.report_profile()
+
+        return {
+            "run_dir": str(self.artifact_dir),
+            "best_score": global_best_score,
+            "best_prompt": global_best_prompt,
+            "best_schema": global_best_schema,
+            "iterations": len(history),
+            "requests": sum(p["items"] for p in self.tracer.summary()),
+            "elapsed_s": round(self.tracer.now(), 3),
+        }
+
+    def run_population_search(self, initial: Optional[List[Dict]], state: Optional[Dict] = None) -> Dict:
+        """
+        Population mode: each round the Teacher proposes population_size children of the best
+        beam_width candidates so far, all of them are evaluated in one packed student batch,
+        and the top beam_width survive into the next round. `initial` holds the first round's
+        candidates (the starting prompt and any warm-start candidates).
+        """
+        if state is None:
+            pending, seen = [], []
+            for candidate in initial:
+                key = candidate_key(candidate["prompt"], candidate["schema"])
+                if key not in seen:
+                    pending.append(candidate)
+                    seen.append(key)
+            state = {"mode": "population", "next_iteration": 0, "beam": [], "pending": pending,
+                     "seen": seen, "history": [], "complete": False}
+            self.write_checkpoint(state)
+        beam: List[Dict] = state["beam"]
+        pending: List[Dict] = state["pending"]
+        seen = set(state["seen"])
+        history = state["history"]
+
+        def checkpoint(next_iteration: int, complete: bool = False):
+            self.write_checkpoint({"mode": "population", "next_iteration": next_iteration, "beam": beam, "pending": pending,
+                              "seen": sorted(seen), "history": history, "complete": complete})
+
+        for i in range(state["next_iteration"], self.max_iterations):
+            if state["complete"]:
+                break
+            self.console.print(f"\n[bold yellow]=== ITERATION {i+1} ({len(pending)} candidates, beam {len(beam)}) ===[/bold yellow]")
+
+            for candidate in pending:
+                self.save_candidate_artifacts(i + 1, candidate)
+
+            # A child that cannot beat the weakest survivor of a full beam would be discarded anyway
+            cutoff = beam[-1]["avg"] if len(beam) >= self.beam_width else None
+            results = self.evaluate_candidates(i + 1, pending, abort_below=cutoff)
+            for candidate in pending:
+                feedback_bucket, iteration_scores = results[candidate["id"]]
+                candidate["feedback"] = feedback_bucket
+                candidate["avg"] = sum(iteration_scores)/len(iteration_scores) if iteration_scores else 0
+                self.console.print(f"  > Candidate {candidate['id']} (parent {candidate['parent'] or '-'}) Average Score: [bold cyan]{candidate['avg']:.2f}/10[/bold cyan]")
+
+            # Survivors are kept with their scores; only new children are evaluated in later rounds
+            beam = sorted(beam + pending, key=lambda c: c["avg"], reverse=True)[:self.beam_width]
+            best = beam[0]
+            if best in pending:
+                self.console.print(f"  [bold green]> New Best Found! (Candidate {best['id']}: {best['avg']:.2f})[/bold green]")
+
+            history.append({
+                "iteration": i+1,
+                "prompt": best["prompt"],
+                "schema_snippet": str(best["schema"])[:100] + "...",
+                "avg_score": best["avg"],
+                "critiques": best["feedback"],
+                "candidates": [{"id": c["id"], "parent": c["parent"], "avg_score": c["avg"], "aborted": c.get("aborted", False)} for c in pending]
+            })
+
+            speculation = None
+            if i + 1 >= self.min_iterations:
+                if self.speculation_config.get("enabled", False) and i < self.max_iterations - 1:
+                    speculation = self.speculate(i + 2, lambda: self.propose_candidates(i + 2, beam, self.population_size, seen), lambda children: children)
+                if self.meta_evaluate(i + 1, best["avg"], best["feedback"]):
+                    if speculation is not None:
+                        self.discard_speculation()
+                    checkpoint(i + 1, complete=True)
+                    break
+            else:
+                self.console.print(f"  > (Iteration {i+1} < Min Iterations {self.min_iterations}. Continuing optimization...)")
+
+            if i < self.max_iterations - 1:
+                pending = speculation.result() if speculation is not None else self.propose_candidates(i + 2, beam, self.population_size, seen)
+                if not pending:
+                    self.console.print("[bold red]Teacher produced no usable new candidates. Stopping.[/bold red]")
+                    checkpoint(i + 1, complete=True)
+                    break
+            checkpoint(i + 1)
+
+        best = beam[0]
+        return self.finalize_run(best["avg"], best["prompt"], best["schema"], history)
+
+    def run(self) -> Optional[Dict]:
+        """Runs the optimization loop; returns the best result, or None if the run could not start."""
+        self.setup_directories()
+
+        # Initialize Log
+        self.initialize_log()
+        self.open_run_index()
+
+        state = load_checkpoint(self.artifact_dir) if self.resuming else None
+        expected_mode = "population" if self.population_size > 1 else "single"
+        if state is not None:
+            if state["mode"] != expected_mode:
+                self.console.print(f"[bold red][FATAL] Checkpoint is from a {state['mode']} run but population_size selects {expected_mode} mode.[/bold red]")
+                return None
+            self.console.print(f"[bold green]Resuming after iteration {state['next_iteration']} from {self.artifact_dir / 'checkpoint.json'}[/bold green]")
+
+        # State Tracking
+        warm_start = []
+        if state is None:
+            warm_start = self.warm_start_candidates(self.run_index_config.get("top_k", 3) if expected_mode == "population" else 1)
+        if warm_start and expected_mode == "single":
+            current_prompt = warm_start[0]["prompt"]
+            current_schema = warm_start[0]["schema"]
+        elif state is None:
+            current_prompt = self.ensure_prompt_length(self.starting_prompt, self.max_prompt_length)
+            current_schema = self.starting_schema
+        else:
+            current_prompt = state.get("current_prompt")
+            current_schema = state.get("current_schema")
+
+        if current_prompt is None and expected_mode == "single":
+            self.console.print(f"[bold red][FATAL] Starting prompt exceeds {self.max_prompt_length} characters and could not be shortened. Please check your config.json.[/bold red]")
+            return None
+
+        if state is None or expected_mode == "population":
+            global_best_score = -1.0
+            global_best_prompt = current_prompt
+            global_best_schema = current_schema
+            # History for Summary
+            history = []
+            start_iteration = 0
+        else:
+            global_best_score = state["best_score"]
+            global_best_prompt = state["best_prompt"]
+            global_best_schema = state["best_schema"]
+            history = state["history"]
+            start_iteration = state["next_iteration"] if not state["complete"] else self.max_iterations
+
+        def checkpoint(next_iteration: int, complete: bool = False):
+            self.write_checkpoint({
+                "mode": "single", "next_iteration": next_iteration, "complete": complete,
+                "current_prompt": current_prompt, "current_schema": current_schema,
+                "best_score": global_best_score, "best_prompt": global_best_prompt, "best_schema": global_best_schema,
+                "history": history
+            })
+
+        self.console.print(f"[bold green]--- Starting Optimization Loop ---[/bold green]")
+        self.console.print(f"Student: [cyan]{self.student_model}[/cyan]")
+        self.console.print(f"Teacher: [cyan]{self.teacher_model}[/cyan]")
+        self.console.print(f"Corpus: [cyan]{self.corpus.describe()}[/cyan]")
+        if self.pipeline_mode and self.config.get("use_mlx", False):
+            self.console.print("[yellow]Pipeline mode needs an HTTP provider; MLX runs use batched evaluation.[/yellow]")
+
+        if self.population_size > 1:
+            self.console.print(f"Population: [cyan]{self.population_size} candidates per round, beam width {self.beam_width}[/cyan]")
+            if state is None and current_prompt is None and not warm_start:
+                self.console.print(f"[bold red][FATAL] Starting prompt exceeds {self.max_prompt_length} characters and could not be shortened. Please check your config.json.[/bold red]")
+                return None
+            initial = [new_candidate(current_prompt, current_schema)] if current_prompt is not None else []
+            initial += [dict(candidate, id=f"1.{n}") for n, candidate in enumerate(warm_start, start=2)]
+            return self.run_population_search(initial if state is None else None, state)
+
+        if state is None:
+            checkpoint(0)
+
+        for i in range(start_iteration, self.max_iterations):
+            self.console.print(f"\n[bold yellow]=== ITERATION {i+1} ===[/bold yellow]")
+
+            # 1. Save Current Artifacts
+            candidate = new_candidate(current_prompt, current_schema)
+            self.save_candidate_artifacts(i + 1, candidate)
+
+            # 2-3. STUDENT GENERATION + TEACHER EVALUATION
+            abort_below = global_best_score if global_best_score > 0 else None
+            feedback_bucket, iteration_scores = self.evaluate_candidates(i + 1, [candidate], abort_below)[candidate["id"]]
+
+            # C. CALCULATE AVERAGES
+            avg = sum(iteration_scores)/len(iteration_scores) if iteration_scores else 0
+            self.console.print(f"  > Iteration Average Score: [bold cyan]{avg:.2f}/10[/bold cyan]")
+
+            # D. UPDATE GLOBAL BEST
+            if avg > global_best_score:
+                global_best_score = avg
+                global_best_prompt = current_prompt
+                global_best_schema = current_schema
+                self.console.print("  [bold green]> New Best Found![/bold green]")
+
+            # Add to history for final summary
+            history.append({
+                "iteration": i+1,
+                "prompt": current_prompt,
+                "schema_snippet": str(current_schema)[:100] + "...",
+                "avg_score": avg,
+                "critiques": feedback_bucket
+            })
+
+            # D. META-EVALUATION: Should we stop?
+            speculation = None
+            if i + 1 >= self.min_iterations:
+                if self.speculation_config.get("enabled", False) and i < self.max_iterations - 1:
+                    # E. OPTIMIZE speculatively, while the Teacher decides whether to stop
+                    speculation = self.speculate(
+                        i + 2,
+                        lambda: self.optimize_candidate(current_prompt, current_schema, feedback_bucket),
+                        lambda optimized: [new_candidate(*optimized)] if optimized is not None else []
+                    )
+                if self.meta_evaluate(i + 1, avg, feedback_bucket):
+                    if speculation is not None:
+                        self.discard_speculation()
+                    checkpoint(i + 1, complete=True)
+                    break
+            else:
+                self.console.print(f"  > (Iteration {i+1} < Min Iterations {self.min_iterations}. Continuing optimization...)")
+
+            if i < self.max_iterations - 1: # Don't optimize after the last run
+                # E. OPTIMIZE
+                optimized = speculation.result() if speculation is not None else self.optimize_candidate(current_prompt, current_schema, feedback_bucket)
+                if optimized is not None:
+                    current_prompt, current_schema = optimized
+            checkpoint(i + 1)
+
+        # --- FINALIZATION ---
+        return self.finalize_run(global_best_score, global_best_prompt, global_best_schema, history)
 
 if __name__ == "__main__":
-    run_benchmark()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Optimize the extraction prompt/schema with a student/teacher loop.")
+    parser.add_argument("--resume", metavar="RUN_DIR", type=Path, help="Continue an interrupted run from its last checkpoint")
+    args = parser.parse_args()
+    session = OptimizationSession(load_config())
+    if args.resume:
+        if not args.resume.is_dir():
+            parser.error(f"{args.resume} is not a run directory")
+        session.resume_from(args.resume)
+    session.run()
@@ -0,0 +1,113 @@
+"""
+Output-length policy for providers.
+
+- GenerationLimits learns a max_tokens per phase (student, teacher-grade, ...) from the lengths of
+  earlier outputs in that phase: a high percentile plus a margin, between min_tokens and the
+  configured max_tokens. Outputs cut off by the limit count as twice as long, so a limit that
+  turns out too tight grows back instead of locking itself in.
+- JsonCloseDetector spots the end of the first balanced top-level JSON object or array in a
+  stream of text, so schema-bound generations can stop there.
+- find_repetition() spots a generation that has degenerated into repeating the same span.
+"""
+
+import math
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+DEFAULT_MAX_TOKENS = 2048
+
+
+class GenerationLimits:
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, percentile: float = 0.99, margin: float = 0.25,
+                 min_tokens: int = 128, min_samples: int = 20, window: int = 1000,
+                 stop_on_json: bool = True, abort_repetition: bool = True):
+        self.default_max_tokens = max_tokens
+        self.percentile = percentile
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self.min_samples = min_samples
+        self.window = window
+        self.stop_on_json = stop_on_json
+        self.abort_repetition = abort_repetition
+        self._lengths: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, section: Optional[Dict]) -> Optional["GenerationLimits"]:
+        """None unless the "generation_limits" config section is enabled."""
+        section = section or {}
+        if not section.get("enabled", False):
+            return None
+        return cls(**{k: v for k, v in section.items() if k != "enabled"})
+
+    def max_tokens(self, phase: str) -> int:
+        with self._lock:
+            lengths = sorted(self._lengths.get(phase, ()))
+        if len(lengths) < self.min_samples:
+            return self.default_max_tokens
+        observed = lengths[min(len(lengths) - 1, math.ceil(self.percentile * len(lengths)) - 1)]
+        return int(min(self.default_max_tokens, max(self.min_tokens, observed * (1 + self.margin))))
+
+    def observe(self, phase: str, completion_tokens: int, truncated: bool = False):
+        with self._lock:
+            lengths = self._lengths.setdefault(phase, deque(maxlen=self.window))
+            lengths.append(completion_tokens * 2 if truncated else completion_tokens)
+
+    def snapshot(self) -> Dict[str, int]:
+        """Current limit per phase seen so far."""
+        with self._lock:
+            phases = list(self._lengths)
+        return {phase: self.max_tokens(phase) for phase in phases}
+
+
+class JsonCloseDetector:
+    """Fed text incrementally; `end` becomes the offset just past the first complete top-level JSON object/array."""
+    def __init__(self):
+        self.end: Optional[int] = None
+        self._offset = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> Optional[int]:
+        if self.end is not None:
+            return self.end
+        for n, ch in enumerate(text):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._depth:
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = self._offset + n + 1
+                    break
+        self._offset += len(text)
+        return self.end
+
+
+def find_repetition(text: str, min_span: int = 200, min_repeats: int = 4, max_period: int = 400) -> Optional[int]:
+    """
+    If `text` ends with one span repeated back to back (at least `min_repeats` times and
+    `min_span` characters in total), returns the length to keep: everything up to and including
+    the first repetition. Otherwise None.
+    """
+    for period in range(1, max_period + 1):
+        repeats = max(min_repeats, math.ceil(min_span / period))
+        span = period * repeats
+        if span > len(text):
+            if period * min_repeats > len(text):
+                break # longer periods need even longer spans
+            continue
+        unit = text[-period:]
+        if text.endswith(unit * repeats):
+            return len(text) - span + period
+    return None
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""
+JSON-schema-constrained decoding, independent of any model backend.
+
+A schema is compiled into a character-level pushdown automaton (SchemaAutomaton). Its states are
+small hashable tuples, so TokenConstraint can compute the set of vocabulary tokens allowed in a
+state once (by walking a trie of the token strings) and reuse it for every later generation with
+the same schema and tokenizer. Once the document is complete only end-of-sequence tokens are
+allowed, so generation stops as soon as the JSON closes.
+
+Supported: object (properties in schema order, required ones mandatory, no other keys), array
+(items, minItems, maxItems), string (minLength, maxLength), integer, number, boolean, null, enum,
+const, type lists and anyOf/oneOf whose alternatives start with different characters, and {}
+(any JSON value). Output is compact JSON without insignificant whitespace. Other constructs
+($ref, overlapping alternatives) raise UnsupportedSchema so callers can fall back to
+unconstrained generation.
+
+    python json_constraint.py sample schema.json --count 3   # random documents the automaton accepts
+    python json_constraint.py check schema.json output.json  # does the automaton accept a text?
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+MAX_DEPTH = 32 # schema nesting
+MAX_ANY_DEPTH = 6 # nesting of free-form JSON values ({} schemas)
+MAX_INT_DIGITS = 15
+MAX_FRAC_DIGITS = 8
+MAX_EXP_DIGITS = 3
+_DIGITS = "0123456789"
+_HEX = "0123456789abcdefABCDEF"
+_STRING_FREE = ("S", 0, None, 0, 0) # inside an unbounded string, not after a backslash
+
+State = Tuple[tuple, ...]
+
+
+class UnsupportedSchema(ValueError):
+    pass
+
+
+class SchemaAutomaton:
+    """
+    Pushdown automaton accepting the compact JSON documents valid under `schema`.
+    A state is a tuple of frames (innermost last); () is a complete document.
+    """
+    def __init__(self, schema: dict):
+        self.nodes: List[Dict] = []
+        self._compiled: Dict[str, int] = {}
+        self.root = self._compile(schema, 0)
+        self.initial: State = (("V", self.root),)
+
+    # --- schema compilation ---
+    def _add(self, node: Dict) -> int:
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+    def _compile(self, schema, depth: int) -> int:
+        if depth > MAX_DEPTH:
+            raise UnsupportedSchema(f"schema nested deeper than {MAX_DEPTH} levels")
+        if schema is True or schema == {}:
+            schema = {}
+        elif not isinstance(schema, dict):
+            raise UnsupportedSchema(f"not a schema: {schema!r}")
+        # Not sort_keys: property order is part of what the automaton accepts
+        key = json.dumps(schema)
+        if key in self._compiled:
+            return self._compiled[key]
+        nid = self._compile_node(schema, depth)
+        self._compiled[key] = nid
+        return nid
+
+    def _compile_node(self, schema: dict, depth: int) -> int:
+        if "$ref" in schema:
+            raise UnsupportedSchema("$ref is not supported")
+        if "const" in schema:
+            return self._add({"kind": "literal", "options": (json.dumps(schema["const"], ensure_ascii=False),)})
+        if "enum" in schema:
+            options = tuple(dict.fromkeys(json.dumps(v, ensure_ascii=False) for v in schema["enum"]))
+            if not options:
+                raise UnsupportedSchema("empty enum")
+            return self._add({"kind": "literal", "options": options})
+        alternatives = schema.get("anyOf") or schema.get("oneOf")
+        if alternatives:
+            return self._union([self._compile(alt, depth + 1) for alt in alternatives])
+
+        kind = schema.get("type")
+        if isinstance(kind, list):
+            return self._union([self._compile(dict(schema, type=t), depth + 1) for t in kind])
+        if kind is None:
+            kind = "object" if "properties" in schema else "array" if "items" in schema else None
+        if kind is None:
+            return self._add({"kind": "any"})
+
+        if kind == "object":
+            properties = schema.get("properties") or {}
+            if not properties:
+                return self._add({"kind": "free_object"})
+            required = set(schema.get("required") or [])
+            props = [(name, self._compile(sub, depth + 1), name in required) for name, sub in properties.items()]
+            return self._add({"kind": "object", "props": props})
+        if kind == "array":
+            min_items = int(schema.get("minItems", 0))
+            max_items = schema.get("maxItems")
+            max_items = int(max_items) if max_items is not None else None
+            if max_items is not None and max_items < min_items:
+                raise UnsupportedSchema("maxItems < minItems")
+            items = self._compile(schema.get("items", {}), depth + 1)
+            # Item counts beyond this do not change what may follow, so states stay finite
+            cap = max_items if max_items is not None else max(min_items, 1)
+            return self._add({"kind": "array", "items": items, "min": min_items, "max": max_items, "cap": cap})
+        if kind == "string":
+            min_length = int(schema.get("minLength", 0))
+            max_length = schema.get("maxLength")
+            return self._add({"kind": "string", "min": min_length, "max": int(max_length) if max_length is not None else None})
+        if kind in ("integer", "number"):
+            return self._add({"kind": "number", "integer": kind == "integer"})
+        if kind == "boolean":
+            return self._add({"kind": "literal", "options": ("true", "false")})
+        if kind == "null":
+            return self._add({"kind": "literal", "options": ("null",)})
+        raise UnsupportedSchema(f"unsupported type {kind!r}")
+
+    def _first_chars(self, nid: int) -> Optional[frozenset]:
+        """Characters a value of node `nid` can start with (None: any value)."""
+        node = self.nodes[nid]
+        kind = node["kind"]
+        if kind in ("object", "free_object"):
+            return frozenset("{")
+        if kind == "array":
+            return frozenset("[")
+        if kind == "string":
+            return frozenset('"')
+        if kind == "number":
+            return frozenset("-" + _DIGITS)
+        if kind == "literal":
+            return frozenset(o[0] for o in node["options"])
+        if kind == "union":
+            return frozenset().union(*node["first"])
+        return None
+
+    def _union(self, members: List[int]) -> int:
+        firsts = [self._first_chars(m) for m in members]
+        seen = set()
+        for first in firsts:
+            if first is None or seen & first:
+                raise UnsupportedSchema("alternatives that can start with the same character are not supported")
+            seen |= first
+        return self._add({"kind": "union", "members": members, "first": firsts})
+
+    # --- transitions ---
+    def advance(self, state: Optional[State], text: str) -> Optional[State]:
+        """State after reading `text`, or None if no valid document starts that way."""
+        for ch in text:
+            if state is None:
+                return None
+            state = self.step(state, ch)
+        return state
+
+    def step(self, state: State, ch: str) -> Optional[State]:
+        while state:
+            replaced = self._step_frame(state[-1], ch)
+            if replaced is not None:
+                return state[:-1] + replaced
+            # A number or literal that may end here hands the character to its parent
+            if not self._can_end(state[-1]):
+                return None
+            state = state[:-1]
+        return None
+
+    def is_complete(self, state: Optional[State]) -> bool:
+        return state is not None and all(self._can_end(frame) for frame in state)
+
+    def _can_end(self, frame: tuple) -> bool:
+        if frame[0] == "N":
+            return frame[2] in ("zero", "int", "frac", "expd")
+        if frame[0] == "L":
+            return any(len(option) == frame[2] for option in frame[1])
+        return False
+
+    def _step_frame(self, frame: tuple, ch: str) -> Optional[tuple]:
+        """Frames replacing `frame` after `ch` (empty when it closes), or None if `ch` is invalid."""
+        kind = frame[0]
+        if kind == "S":
+            return self._step_string(frame, ch)
+        if kind == "V":
+            return self._step_value(frame[1], ch)
+        if kind == "O":
+            return self._step_object(frame, ch)
+        if kind == "K":
+            return self._step_key(frame, ch)
+        if kind == "A":
+            return self._step_array(frame, ch)
+        if kind == "N":
+            return self._step_number(frame, ch)
+        if kind == "L":
+            options = tuple(o for o in frame[1] if len(o) > frame[2] and o[frame[2]] == ch)
+            return (("L", options, frame[2] + 1),) if options else None
+        if kind == "Y":
+            return self._step_any(frame[1], ch)
+        if kind == "FO":
+            return self._step_free_object(frame, ch)
+        if kind == "FA":
+            return self._step_free_array(frame, ch)
+        raise ValueError(f"unknown frame {frame!r}")
+
+    def _step_value(self, nid: int, ch: str) -> Optional[tuple]:
+        node = self.nodes[nid]
+        kind = node["kind"]
+        if kind == "object":
+            return (("O", nid, 0, True),) if ch == "{" else None
+        if kind == "free_object":
+            return (("FO", 0, "start"),) if ch == "{" else None
+        if kind == "array":
+            return (("A", nid, 0, True),) if ch == "[" else None
+        if kind == "string":
+            return (("S", node["min"], node["max"], 0, 0),) if ch == '"' else None
+        if kind == "number":
+            return self._step_number(("N", node["integer"], "start", 0), ch)
+        if kind == "literal":
+            return self._step_frame(("L", node["options"], 0), ch)
+        if kind == "union":
+            for member, first in zip(node["members"], node["first"]):
+                if ch in first:
+                    return self._step_value(member, ch)
+            return None
+        return self._step_any(0, ch)
+
+    def _step_object(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, nid, index, first = frame
+        props = self.nodes[nid]["props"]
+        if ch == "}" and not any(required for _, _, required in props[index:]):
+            return ()
+        options = []
+        for j in range(index, len(props)):
+            options.append(((("" if first else ",") + json.dumps(props[j][0], ensure_ascii=False) + ":"), j))
+            if props[j][2]:
+                break # a required property cannot be skipped
+        if not options:
+            return None
+        return self._step_key(("K", nid, 0, tuple(options)), ch)
+
+    def _step_key(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, nid, pos, options = frame
+        remaining = tuple((text, j) for text, j in options if len(text) > pos and text[pos] == ch)
+        if not remaining:
+            return None
+        text, j = remaining[0]
+        if len(remaining) == 1 and len(text) == pos + 1:
+            return (("O", nid, j + 1, False), ("V", self.nodes[nid]["props"][j][1]))
+        return (("K", nid, pos + 1, remaining),)
+
+    def _step_array(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, nid, count, first = frame
+        node = self.nodes[nid]
+        if ch == "]" and count >= node["min"]:
+            return ()
+        if first:
+            if node["max"] == 0:
+                return None
+            child = self._step_value(node["items"], ch)
+            return (("A", nid, min(1, node["cap"]), False),) + child if child is not None else None
+        if ch == "," and (node["max"] is None or count < node["max"]):
+            return (("A", nid, min(count + 1, node["cap"]), False), ("V", node["items"]))
+        return None
+
+    def _step_string(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, min_length, max_length, escape, length = frame
+        bounded = min_length > 0 or max_length is not None
+
+        def grown() -> int:
+            # Lengths are only tracked for bounded strings, so unbounded ones share one state
+            return min(length + 1, max(min_length, max_length or 0)) if bounded else 0
+
+        if escape == 0:
+            if ch == '"':
+                return () if length >= min_length else None
+            if ord(ch) < 0x20 or (max_length is not None and length >= max_length):
+                return None
+            if ch == "\\":
+                return (("S", min_length, max_length, -1, length),)
+            return (("S", min_length, max_length, 0, grown()),)
+        if escape == -1:
+            if ch in '"\\/bfnrt':
+                return (("S", min_length, max_length, 0, grown()),)
+            if ch == "u":
+                return (("S", min_length, max_length, 4, length),)
+            return None
+        if ch not in _HEX:
+            return None
+        if escape == 1:
+            return (("S", min_length, max_length, 0, grown()),)
+        return (("S", min_length, max_length, escape - 1, length),)
+
+    def _step_number(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, integer, phase, digits = frame
+
+        def to(next_phase: str, count: int = 0) -> tuple:
+            return (("N", integer, next_phase, count),)
+
+        if phase in ("start", "minus"):
+            if ch == "-" and phase == "start":
+                return to("minus")
+            if ch == "0":
+                return to("zero")
+            return to("int", 1) if ch in _DIGITS else None
+        if phase in ("zero", "int"):
+            if ch in _DIGITS and phase == "int":
+                return to("int", digits + 1) if digits < MAX_INT_DIGITS else None
+            if integer:
+                return None
+            if ch == ".":
+                return to("dot")
+            return to("exp") if ch in "eE" else None
+        if phase in ("dot", "frac"):
+            if ch in _DIGITS:
+                return to("frac", digits + 1) if digits < MAX_FRAC_DIGITS else None
+            return to("exp") if ch in "eE" and phase == "frac" else None
+        if phase == "exp" and ch in "+-":
+            return to("expsign")
+        if ch in _DIGITS and digits < MAX_EXP_DIGITS:
+            return to("expd", digits + 1)
+        return None
+
+    def _step_any(self, depth: int, ch: str) -> Optional[tuple]:
+        if ch == "{" and depth < MAX_ANY_DEPTH:
+            return (("FO", depth, "start"),)
+        if ch == "[" and depth < MAX_ANY_DEPTH:
+            return (("FA", depth, True),)
+        if ch == '"':
+            return (_STRING_FREE,)
+        if ch in "-" + _DIGITS:
+            return self._step_number(("N", False, "start", 0), ch)
+        return self._step_frame(("L", ("true", "false", "null"), 0), ch)
+
+    def _step_free_object(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, depth, phase = frame
+        if phase in ("start", "after") and ch == "}":
+            return ()
+        if phase in ("start", "key") and ch == '"':
+            return (("FO", depth, "colon"), _STRING_FREE)
+        if phase == "colon" and ch == ":":
+            return (("FO", depth, "after"), ("Y", depth + 1))
+        if phase == "after" and ch == ",":
+            return (("FO", depth, "key"),)
+        return None
+
+    def _step_free_array(self, frame: tuple, ch: str) -> Optional[tuple]:
+        _, depth, first = frame
+        if ch == "]":
+            return ()
+        if first:
+            child = self._step_any(depth + 1, ch)
+            return (("FA", depth, False),) + child if child is not None else None
+        if ch == ",":
+            return (("FA", depth, False), ("Y", depth + 1))
+        return None
+
+
+@lru_cache(maxsize=32)
+def _compile_cached(schema_json: str) -> SchemaAutomaton:
+    return SchemaAutomaton(json.loads(schema_json))
+
+
+def compile_schema(schema: dict) -> SchemaAutomaton:
+    """Compiled automaton for `schema`, shared by every caller using the same schema."""
+    return _compile_cached(json.dumps(schema))
+
+
+# --- TOKEN LEVEL ---
+def _in_plain_string(text: str) -> bool:
+    return all(ch not in '"\\' and ord(ch) >= 0x20 for ch in text)
+
+
+class TokenVocabulary:
+    """
+    The decoded text of every token id (None for special tokens and partial UTF-8 bytes, which
+    are never allowed) arranged in a trie, plus the ids that can appear anywhere inside a string.
+    """
+    def __init__(self, strings: Sequence[Optional[str]], eos_ids: Iterable[int]):
+        self.strings = list(strings)
+        self.eos_ids = tuple(sorted(set(eos_ids)))
+        self.trie: Dict = {} # {char: child}; child[""] lists the ids whose text ends there
+        self.special_trie: Dict = {} # the same for tokens that are not plain string content
+        plain = []
+        eos = set(self.eos_ids)
+        for token_id, text in enumerate(self.strings):
+            if not text or token_id in eos:
+                continue
+            self._insert(self.trie, text, token_id)
+            if _in_plain_string(text):
+                plain.append(token_id)
+            else:
+                self._insert(self.special_trie, text, token_id)
+        self.plain_string_ids = tuple(plain)
+
+    @staticmethod
+    def _insert(trie: Dict, text: str, token_id: int):
+        node = trie
+        for ch in text:
+            node = node.setdefault(ch, {})
+        node.setdefault("", []).append(token_id)
+
+
+def vocabulary_from_tokenizer(tokenizer) -> TokenVocabulary:
+    """Builds a TokenVocabulary from a Hugging Face tokenizer (or mlx-lm's wrapper around one)."""
+    vocab = tokenizer.get_vocab()
+    strings: List[Optional[str]] = [None] * (max(vocab.values()) + 1)
+    special = set(getattr(tokenizer, "all_special_ids", None) or [])
+    for piece, token_id in vocab.items():
+        if token_id in special:
+            continue
+        text = tokenizer.decode([token_id])
+        if "�" in text:
+            continue # part of a multi-byte character; not decodable on its own
+        if piece.startswith("▁") and not text.startswith(" "):
+            text = " " + text # SentencePiece drops the leading space when decoding a single piece
+        strings[token_id] = text
+    eos_ids = getattr(tokenizer, "eos_token_ids", None) or [tokenizer.eos_token_id]
+    return TokenVocabulary(strings, eos_ids)
+
+
+class TokenConstraint:
+    """Allowed-token sets for the states of one automaton over one vocabulary, computed once per state."""
+    def __init__(self, automaton: SchemaAutomaton, vocabulary: TokenVocabulary, max_cached_states: int = 4096):
+        self.automaton = automaton
+        self.vocabulary = vocabulary
+        self.initial = automaton.initial
+        self.max_cached_states = max_cached_states
+        self._masks: "OrderedDict[State, Tuple[int, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def advance(self, state: Optional[State], token_id: int) -> Optional[State]:
+        if state is None or token_id >= len(self.vocabulary.strings):
+            return None
+        if token_id in self.vocabulary.eos_ids:
+            return state if self.automaton.is_complete(state) else None
+        return self.automaton.advance(state, self.vocabulary.strings[token_id] or "")
+
+    def allowed(self, state: Optional[State]) -> Tuple[int, ...]:
+        """Sorted ids of the tokens that keep `state` on the way to a valid document."""
+        if state is None:
+            return ()
+        with self._lock:
+            mask = self._masks.get(state)
+            if mask is not None:
+                self._masks.move_to_end(state)
+                self.stats["hits"] += 1
+                return mask
+        mask = self._compute(state)
+        with self._lock:
+            self.stats["misses"] += 1
+            self._masks[state] = mask
+            if len(self._masks) > self.max_cached_states:
+                self._masks.popitem(last=False)
+        return mask
+
+    def _compute(self, state: State) -> Tuple[int, ...]:
+        ids: List[int] = []
+        if self.automaton.is_complete(state):
+            ids.extend(self.vocabulary.eos_ids)
+        if state and state[-1] == _STRING_FREE:
+            # Plain string content leaves this state unchanged; only tokens with quotes or
+            # backslashes need to be checked character by character
+            ids.extend(self.vocabulary.plain_string_ids)
+            self._walk(self.vocabulary.special_trie, state, ids)
+        else:
+            self._walk(self.vocabulary.trie, state, ids)
+        return tuple(sorted(set(ids)))
+
+    def _walk(self, node: Dict, state: State, ids: List[int]):
+        step = self.automaton.step
+        for ch, child in node.items():
+            if ch == "":
+                continue
+            after = step(state, ch)
+            if after is None:
+                continue
+            ids.extend(child.get("", ()))
+            if len(child) > 1 or "" not in child:
+                self._walk(child, after, ids)
+
+
+# --- CLI ---
+def _demo_vocabulary() -> TokenVocabulary:
+    """Single printable ASCII characters plus a few multi-character tokens, like a tiny tokenizer."""
+    strings = [None] + [chr(c) for c in range(32, 127)] + ['":', '",', '"}', '{"', '},{"', '"]', "true", "false", "null"]
+    return TokenVocabulary(strings, eos_ids=[0])
+
+
+def sample_document(constraint: TokenConstraint, rng: random.Random, max_tokens: int = 4000) -> Optional[str]:
+    """Random document drawn from the allowed tokens, favouring tokens that close the current value."""
+    state = constraint.initial
+    text = []
+    for _ in range(max_tokens):
+        allowed = constraint.allowed(state)
+        if not allowed:
+            return None
+        weights = []
+        for token_id in allowed:
+            if token_id in constraint.vocabulary.eos_ids:
+                weights.append(1000.0)
+                continue
+            after = constraint.advance(state, token_id)
+            weights.append(10.0 if after is not None and len(after) < len(state) else 1.0)
+        token_id = rng.choices(allowed, weights)[0]
+        if token_id in constraint.vocabulary.eos_ids:
+            return "".join(text)
+        state = constraint.advance(state, token_id)
+        text.append(constraint.vocabulary.strings[token_id])
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the JSON-schema decoding constraint without a model.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sample_parser = subparsers.add_parser("sample", help="Print random documents accepted for a schema")
+    sample_parser.add_argument("schema", help="JSON schema file")
+    sample_parser.add_argument("--count", type=int, default=3)
+    sample_parser.add_argument("--seed", type=int, default=0)
+    check_parser = subparsers.add_parser("check", help="Check whether the automaton accepts a text")
+    check_parser.add_argument("schema", help="JSON schema file")
+    check_parser.add_argument("text", help="File with the candidate output")
+    args = parser.parse_args()
+
+    with open(args.schema, 'r', encoding='utf-8') as f:
+        schema = json.load(f)
+    try:
+        automaton = compile_schema(schema)
+    except UnsupportedSchema as e:
+        parser.error(f"schema not supported for constrained decoding: {e}")
+
+    if args.command == "sample":
+        constraint = TokenConstraint(automaton, _demo_vocabulary())
+        rng = random.Random(args.seed)
+        for _ in range(args.count):
+            document = sample_document(constraint, rng)
+            print(document if document is not None else "(no document within the token limit)")
+        print(f"{len(constraint._masks)} states, {constraint.stats['hits']} mask cache hits", file=sys.stderr)
+    else:
+        with open(args.text, 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+        state = automaton.advance(automaton.initial, text)
+        if automaton.is_complete(state):
+            print("accepted")
+        else:
+            print("rejected" if state is None else "incomplete")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Deterministic stand-in for a real model backend.
+
+MockProvider answers every request locally: schema-constrained requests get a small instance
+of the schema, free-text requests get a canned prompt or schema. Latency, token rates and
+failures are simulated from a seeded RNG keyed on the request content, so the same run
+produces the same outputs regardless of thread scheduling. Select it with
+"mock": {"enabled": true} in config.json; its other settings go in the same section.
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from models import ModelProvider
+from profiling import report_usage
+from stub_server import example_from_schema
+
+
+class MockProvider(ModelProvider):
+    """
+    latency: "fixed" (latency_mean), "uniform" (latency_mean +/- latency_spread) or
+    "lognormal" (median latency_mean, sigma latency_spread); generation time is added on top as
+    completion_tokens / tokens_per_sec. Batches take as long as their slowest item.
+    """
+    def __init__(self, latency: str = "fixed", latency_mean: float = 0.0, latency_spread: float = 0.0,
+                 tokens_per_sec: Optional[float] = None, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.tokens_per_sec = tokens_per_sec
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.items = 0
+
+    def _rng(self, model: str, messages: List[Dict], target_schema: Optional[dict], temperature: float) -> random.Random:
+        payload = json.dumps([self.seed, model, messages, target_schema, temperature], sort_keys=True, default=str)
+        return random.Random(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+
+    def _delay(self, rng: random.Random, completion_tokens: int) -> float:
+        if self.latency == "uniform":
+            delay = rng.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread)
+        elif self.latency == "lognormal" and self.latency_mean > 0:
+            delay = rng.lognormvariate(0, self.latency_spread) * self.latency_mean
+        else:
+            delay = self.latency_mean
+        if self.tokens_per_sec:
+            delay += completion_tokens / self.tokens_per_sec
+        return max(0.0, delay)
+
+    def _respond(self, messages: List[Dict], target_schema: Optional[dict], rng: random.Random) -> str:
+        if target_schema:
+            return json.dumps(example_from_schema(target_schema, rng))
+        request = messages[-1]["content"]
+        if "BETTER JSON Schema" in request:
+            schema = {
+                "type": "object",
+                "properties": {"events": {"type": "array", "items": {"type": "object", "properties": {
+                    "event": {"type": "string", "description": f"Event (variant {rng.randint(0, 10**6)})"},
+                    "location": {"type": "string"}}, "required": ["event", "location"]}}},
+                "required": ["events"]
+            }
+            return json.dumps(schema)
+        return f"Extract events and their locations from the article (variant {rng.randint(0, 10**6)})."
+
+    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
+        start = time.perf_counter()
+        results: List[Optional[str]] = []
+        batch_delay = 0.0
+        for messages in messages_list:
+            rng = self._rng(model, messages, target_schema, temperature)
+            if rng.random() < self.failure_rate:
+                results.append(None)
+                continue
+            text = self._respond(messages, target_schema, rng)
+            prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+            completion_tokens = max(1, len(text) // 4)
+            batch_delay = max(batch_delay, self._delay(rng, completion_tokens))
+            report_usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            results.append(text)
+
+        if batch_delay > 0:
+            time.sleep(batch_delay)
+        report_usage(start=start, end=time.perf_counter(), thread=threading.current_thread().name)
+        with self._lock:
+            self.calls += 1
+            self.items += len(messages_list)
+        return results
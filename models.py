@@ -1,17 +1,42 @@
+import contextvars
+import copy
+import gc
+import hashlib
+import importlib.util
+import inspect
 import json
-from typing import List, Dict, Optional, Union
-from openai import OpenAI
-from rich.console import Console
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Dict, Optional, Tuple, Union
 
-console = Console()
+from cache import CompletionCache, request_key
+from generation_limits import DEFAULT_MAX_TOKENS, GenerationLimits, JsonCloseDetector, find_repetition
+from json_constraint import TokenConstraint, UnsupportedSchema, compile_schema, vocabulary_from_tokenizer
+from profiling import Tracer, build_event, current_phase, report_usage, usage_sink
+from scheduling import length_buckets
 
-try:
-    # IMPORT generate AS WELL
-    from mlx_lm import batch_generate, generate, load
+# openai, mlx-lm and rich take most of the import time, so they are imported on first use
+HAS_MLX = importlib.util.find_spec("mlx_lm") is not None
+_console = None
+
+def get_console():
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+def _import_mlx():
+    """Binds the mlx / mlx-lm names used below; called before the first MLX model is loaded."""
+    global mx, tree_flatten, batch_generate, stream_generate, load, make_prompt_cache, can_trim_prompt_cache, trim_prompt_cache, make_sampler
+    import mlx.core as mx
+    from mlx.utils import tree_flatten
+    from mlx_lm import batch_generate, stream_generate, load
+    from mlx_lm.models.cache import make_prompt_cache, can_trim_prompt_cache, trim_prompt_cache
     from mlx_lm.sample_utils import make_sampler
-    HAS_MLX = True
-except ImportError:
-    HAS_MLX = False
 
 class ModelProvider:
     def get_completion(self, model: str, messages: List[Dict], target_schema: Optional[dict] = None, temperature: float = 0.1) -> Optional[str]:
@@ -20,129 +45,776 @@ class ModelProvider:
     def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
         raise NotImplementedError
 
+    def prewarm(self, model: str):
+        """Hint that `model` will be needed soon; providers that load weights locally may start loading it."""
+        pass
+
 class OpenAIProvider(ModelProvider):
-    def __init__(self, base_url: str, api_key: str):
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+    def __init__(self, base_url: str, api_key: str, max_concurrency: int = 1, limits: Optional[GenerationLimits] = None,
+                 max_retries: Optional[int] = None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max_retries # None keeps the openai client's default
+        self.limits = limits
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._executor = None
 
-    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
-        results = []
-        for messages in messages_list:
-            params = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-            }
-            if target_schema:
-                params["response_format"] = {
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "response_data",
-                        "schema": target_schema,
-                        "strict": False
-                    }
+    @property
+    def client(self):
+        # Created on the first request so that constructing the provider does not import openai
+        with self._client_lock:
+            if self._client is None:
+                import httpx
+                from openai import OpenAI, DefaultHttpxClient
+                # Size the keep-alive pool to the worker count so concurrent requests reuse connections
+                http_client = DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency
+                    )
+                )
+                retries = {"max_retries": self.max_retries} if self.max_retries is not None else {}
+                self._client = OpenAI(base_url=self.base_url, api_key=self.api_key, http_client=http_client, **retries)
+            return self._client
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created once and reused so worker threads (and their connections) survive across batches.
+        # Sweep sessions share providers, so creation is locked.
+        with self._client_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="openai-provider")
+            return self._executor
+
+    def _single_completion(self, model: str, messages: List[Dict], target_schema: Optional[dict], temperature: float, submitted: Optional[float] = None) -> Optional[str]:
+        params = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+        }
+        if self.limits is not None:
+            params["max_tokens"] = self.limits.max_tokens(current_phase())
+        if target_schema:
+            params["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "response_data",
+                    "schema": target_schema,
+                    "strict": False
                 }
-            try:
-                response = self.client.chat.completions.create(**params)
-                results.append(response.choices[0].message.content)
-            except Exception as e:
-                console.print(f"[bold red][ERROR] OpenAI Provider | Model: {model} | Error: {e}[/bold red]")
-                results.append(None)
-        return results
+            }
+        start = time.perf_counter()
+        try:
+            # Not streamed, so there is no time to first token to report (ttft_s); only the full request time
+            raw = self.client.chat.completions.with_raw_response.create(**params)
+            response = raw.parse()
+            usage = response.usage
+            content = response.choices[0].message.content
+            truncated = response.choices[0].finish_reason == "length"
+            repetition_abort = False
+            if self.limits is not None and self.limits.abort_repetition and content:
+                # The server generates the whole completion; a repetition loop can only be cut afterwards
+                keep = find_repetition(content)
+                if keep is not None:
+                    content = content[:keep]
+                    repetition_abort = True
+            report_usage(
+                start=start, end=time.perf_counter(), thread=threading.current_thread().name,
+                queue_s=(start - submitted) if submitted else 0.0,
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+                retries=getattr(raw, "retries_taken", 0),
+                truncated=truncated,
+                repetition_abort=repetition_abort,
+                output=content
+            )
+            if self.limits is not None and usage and not repetition_abort:
+                self.limits.observe(current_phase(), usage.completion_tokens, truncated)
+            return content
+        except Exception as e:
+            report_usage(start=start, end=time.perf_counter(), thread=threading.current_thread().name,
+                         queue_s=(start - submitted) if submitted else 0.0, error=str(e))
+            get_console().print(f"[bold red][ERROR] OpenAI Provider | Model: {model} | Error: {e}[/bold red]")
+            return None
+
+    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
+        if self.max_concurrency == 1 or len(messages_list) <= 1:
+            return [self._single_completion(model, messages, target_schema, temperature) for messages in messages_list]
+
+        # Each item runs in a copy of the caller's context so usage reports reach the caller's trace
+        submitted = time.perf_counter()
+        contexts = [contextvars.copy_context() for _ in messages_list]
+        # executor.map yields results in submission order, so output indices match messages_list
+        return list(self._get_executor().map(
+            lambda item: item[0].run(self._single_completion, model, item[1], target_schema, temperature, submitted),
+            zip(contexts, messages_list)
+        ))
+
+def _clear_mlx_cache():
+    clear_cache = getattr(mx, "clear_cache", None) or mx.metal.clear_cache
+    clear_cache()
+
+def _model_nbytes(model) -> int:
+    return sum(v.nbytes for _, v in tree_flatten(model.parameters()))
+
+class ModelResidencyManager:
+    """
+    Keeps loaded MLX checkpoints within a memory budget.
+
+    Models are evicted least-recently-used first (never the one currently in use) and their
+    weights are released explicitly. prewarm() loads a model on a background thread so it is
+    ready by the time it is needed, as long as it is known to fit next to the active model.
+
+    MLX is not safe to drive from two threads at once, so background loads hold compute_lock,
+    the lock the provider generates under, and only run between generations. get() must be
+    called with compute_lock held.
+    """
+    def __init__(self, budget_gb: Optional[float] = None, loader: Optional[Callable] = None,
+                 compute_lock: Optional[threading.Lock] = None):
+        self.budget_bytes = int(budget_gb * 1024**3) if budget_gb else None
+        self.loader = loader or (lambda checkpoint: load(path_or_hf_repo=checkpoint, model_config={"trust_remote_code": True}))
+        self.resident = OrderedDict() # {checkpoint: (model, tokenizer, nbytes)}
+        self.known_sizes = {} # sizes of models loaded earlier in this process
+        self.load_times = {} # {checkpoint: [seconds, ...]}
+        self.active = None
+        self._lock = threading.RLock()
+        self._pending = set() # checkpoints with a background load queued or running
+        self.compute_lock = compute_lock or threading.Lock()
+
+    def resident_bytes(self) -> int:
+        return sum(entry[2] for entry in self.resident.values())
+
+    def get(self, checkpoint: str) -> Tuple[object, object]:
+        """Returns (model, tokenizer), loading (and evicting) as needed; marks it as the active model."""
+        # The caller holds compute_lock, so a background load of this checkpoint has not started
+        # yet; it is loaded here and the background load finds it resident.
+        with self._lock:
+            self.active = checkpoint
+            if checkpoint in self.resident:
+                self.resident.move_to_end(checkpoint)
+                model, tokenizer, _ = self.resident[checkpoint]
+                return model, tokenizer
+            return self._load(checkpoint)
+
+    def _load(self, checkpoint: str, background: bool = False) -> Tuple[object, object]:
+        expected = self.known_sizes.get(checkpoint)
+        if expected is not None:
+            with self._lock:
+                self._evict_for(expected, keep=checkpoint)
+
+        get_console().print(f"[bold cyan]MLX Provider: Loading model {checkpoint}{' in background' if background else ''}...[/bold cyan]")
+        start = time.perf_counter()
+        model, tokenizer = self.loader(checkpoint)
+        # Materialize the weights now so load time is measured here rather than on first generation
+        mx.eval(model.parameters())
+        elapsed = time.perf_counter() - start
+
+        nbytes = _model_nbytes(model)
+        with self._lock:
+            self.known_sizes[checkpoint] = nbytes
+            self.load_times.setdefault(checkpoint, []).append(elapsed)
+            self.resident[checkpoint] = (model, tokenizer, nbytes)
+            self._evict_for(0, keep=checkpoint)
+
+        budget = f" / {self.budget_bytes / 1024**3:.1f} GB budget" if self.budget_bytes else ""
+        get_console().print(
+            f"[cyan]MLX Provider: Loaded {checkpoint} in {elapsed:.1f}s ({nbytes / 1024**3:.2f} GB; "
+            f"{len(self.resident)} resident, {self.resident_bytes() / 1024**3:.2f} GB{budget})[/cyan]"
+        )
+        return model, tokenizer
+
+    def _evict_for(self, incoming_bytes: int, keep: str):
+        """Evicts LRU models (never `keep` or the active model) until incoming_bytes fits the budget."""
+        if self.budget_bytes is None:
+            return
+        for checkpoint in list(self.resident):
+            if self.resident_bytes() + incoming_bytes <= self.budget_bytes:
+                return
+            if checkpoint in (keep, self.active):
+                continue
+            self.release(checkpoint)
+
+    def release(self, checkpoint: str):
+        """Drops a resident model and returns its memory to the system."""
+        with self._lock:
+            entry = self.resident.pop(checkpoint, None)
+            if entry is None:
+                return
+            nbytes = entry[2]
+            del entry
+            gc.collect()
+            _clear_mlx_cache()
+            get_console().print(f"[cyan]MLX Provider: Evicted {checkpoint} (freed {nbytes / 1024**3:.2f} GB)[/cyan]")
+
+    def prewarm(self, checkpoint: str):
+        """Starts loading `checkpoint` on a background thread if it is not resident and fits alongside the active model."""
+        with self._lock:
+            if checkpoint in self.resident or checkpoint in self._pending:
+                return
+            if self.budget_bytes is not None:
+                expected = self.known_sizes.get(checkpoint)
+                active_bytes = self.resident[self.active][2] if self.active in self.resident else 0
+                # Unknown sizes could force out the model that is generating right now
+                if expected is None or active_bytes + expected > self.budget_bytes:
+                    return
+            self._pending.add(checkpoint)
+
+        def run():
+            with self.compute_lock:
+                try:
+                    if checkpoint not in self.resident:
+                        self._load(checkpoint, background=True)
+                except Exception as e:
+                    get_console().print(f"[yellow]MLX Provider: Background load of {checkpoint} failed: {e}[/yellow]")
+                finally:
+                    self._pending.discard(checkpoint)
+
+        threading.Thread(target=run, name=f"prewarm-{checkpoint}", daemon=True).start()
+
+class ConstraintLogitsProcessor:
+    """mlx-lm logits processor that masks out the tokens a TokenConstraint does not allow next."""
+    def __init__(self, constraint: TokenConstraint, biases: OrderedDict, max_biases: int):
+        self.constraint = constraint
+        self.biases = biases # {state: additive mask}, shared by all generations with this constraint
+        self.max_biases = max_biases
+        self.state = constraint.initial
+        self.started = False
+
+    def __call__(self, tokens, logits):
+        # `tokens` ends with the token sampled after the previous call (the first call only sees the prompt)
+        if self.started and self.state is not None:
+            self.state = self.constraint.advance(self.state, tokens[-1].item())
+        self.started = True
+        if self.state is None:
+            return logits
+        bias = self.biases.get(self.state)
+        if bias is None:
+            allowed = [i for i in self.constraint.allowed(self.state) if i < logits.shape[-1]]
+            if not allowed:
+                return logits
+            bias = mx.full((logits.shape[-1],), -float("inf"))
+            bias[mx.array(allowed)] = 0.0
+            self.biases[self.state] = bias
+            while len(self.biases) > self.max_biases:
+                self.biases.popitem(last=False)
+        else:
+            self.biases.move_to_end(self.state)
+        return logits + bias
 
 class MLXProvider(ModelProvider):
-    def __init__(self):
+    # Tokens per forward pass when prefilling a shared prefix
+    PREFILL_STEP = 2048
+    # Compiled schema constraints kept per model, and vocabulary-sized masks kept per constraint
+    CONSTRAINT_SLOTS = 8
+    MASKS_PER_CONSTRAINT = 256
+    # Output token limit when no GenerationLimits are configured
+    MAX_TOKENS = DEFAULT_MAX_TOKENS
+    # Streamed generations are checked for repetition loops every this many tokens
+    REPETITION_CHECK_TOKENS = 32
+
+    def __init__(self, prefix_cache: bool = False, prefix_cache_min_tokens: int = 64, prefix_cache_slots: int = 4,
+                 memory_budget_gb: Optional[float] = None, prewarm: bool = False, constrained_decoding: bool = False,
+                 limits: Optional[GenerationLimits] = None, batch_token_budget: Optional[int] = None,
+                 max_batch_size: Optional[int] = None):
         if not HAS_MLX:
             raise ImportError("mlx-lm package is required for MLXProvider but not found. Install with 'pip install mlx-lm'")
-        self.cached_models = {} # {checkpoint: (model, tokenizer)}
+        _import_mlx()
+        # One generation at a time: the loaded model and prefix caches are shared by every caller.
+        # Background model loads take the same lock.
+        self._generate_lock = threading.Lock()
+        self.residency = ModelResidencyManager(memory_budget_gb, compute_lock=self._generate_lock)
+        self.prewarm_enabled = prewarm
+        self.limits = limits
+        # Batches are bucketed by prompt length and capped by tokens (prompt + max_tokens per sequence)
+        self.batch_token_budget = batch_token_budget
+        self.max_batch_size = max_batch_size
+        self.batch_stats = {"batches": 0, "sequences": 0, "prompt_tokens": 0, "padding_tokens": 0}
         self.current_model = None
         self.current_tokenizer = None
         self.current_checkpoint = None
 
+        # Prefix KV caches: {(checkpoint, prefix_hash): (prefix_tokens, prompt_cache)}
+        self.prefix_cache = prefix_cache
+        self.prefix_cache_min_tokens = prefix_cache_min_tokens
+        self.prefix_cache_slots = max(1, prefix_cache_slots)
+        self.prefix_caches = OrderedDict()
+        self.prefix_stats = {"hits": 0, "misses": 0, "tokens_reused": 0}
+
+        # Schema-constrained decoding: {(checkpoint, schema_json): (TokenConstraint, masks) or None if unsupported}
+        self.constrained_decoding = constrained_decoding
+        self.constraints = OrderedDict()
+        self.vocabularies = {} # {checkpoint: TokenVocabulary}
+        self.constraint_stats = {"outputs": 0, "incomplete": 0, "unsupported": 0}
+
     def _load_model(self, checkpoint: str):
-        if self.current_checkpoint != checkpoint:
-            if checkpoint in self.cached_models:
-                # console.print(f"[bold cyan]MLX Provider: Switching to cached model {checkpoint}...[/bold cyan]")
-                self.current_model, self.current_tokenizer = self.cached_models[checkpoint]
-                self.current_checkpoint = checkpoint
-            else:
-                console.print(f"[bold cyan]MLX Provider: Loading model {checkpoint}...[/bold cyan]")
-                # Trust remote code is often needed for experimental/new architectures like Qwen3/Mamba
-                model, tokenizer = load(path_or_hf_repo=checkpoint, model_config={"trust_remote_code": True})
-                self.cached_models[checkpoint] = (model, tokenizer)
-                self.current_model = model
-                self.current_tokenizer = tokenizer
-                self.current_checkpoint = checkpoint
+        if self.current_checkpoint != checkpoint or self.current_checkpoint not in self.residency.resident:
+            # Drop our references first so eviction can free the old weights before the new ones load
+            self.current_model = None
+            self.current_tokenizer = None
+            self.current_checkpoint = None
+            self.current_model, self.current_tokenizer = self.residency.get(checkpoint)
+            self.current_checkpoint = checkpoint
+            # Prefix caches of evicted models would keep their memory alive
+            for key in [k for k in self.prefix_caches if k[0] not in self.residency.resident]:
+                del self.prefix_caches[key]
+            for key in [k for k in self.constraints if k[0] not in self.residency.resident]:
+                del self.constraints[key]
+            for key in [k for k in self.vocabularies if k not in self.residency.resident]:
+                del self.vocabularies[key]
 
-    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
-        self._load_model(model)
-        
+    def prewarm(self, model: str):
+        if self.prewarm_enabled:
+            self.residency.prewarm(model)
+
+    def _format_prompts(self, messages_list: List[List[Dict]], target_schema: Optional[dict]) -> list:
         formatted_prompts = []
         for messages in messages_list:
-            if target_schema and messages[-1]["role"] == "user":
-                schema_hint = f"\n\nOutput MUST follow this JSON schema: {json.dumps(target_schema)}"
-                messages[-1]["content"] += schema_hint
+            # Copy so the caller's messages are not modified
+            messages = [dict(m) for m in messages]
+            if target_schema:
+                # Constrained decoding enforces the structure; the compact schema only conveys the field descriptions
+                schema_text = json.dumps(target_schema, separators=(",", ":")) if self.constrained_decoding else json.dumps(target_schema)
+                schema_hint = f"\n\nOutput MUST follow this JSON schema: {schema_text}"
+                if self.prefix_cache and messages[0]["role"] == "system":
+                    # Keep the hint in the shared system prefix so it is prefilled once, not per article
+                    messages[0]["content"] += schema_hint
+                elif messages[-1]["role"] == "user":
+                    messages[-1]["content"] += schema_hint
 
-            # apply_chat_template returns a string
+            # apply_chat_template returns token ids (or a string for some tokenizers)
             prompt = self.current_tokenizer.apply_chat_template(
                 messages,
                 add_generation_prompt=True,
             )
             formatted_prompts.append(prompt)
+        return formatted_prompts
+
+    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
+        with self._generate_lock:
+            return self._batch_completion(model, messages_list, target_schema, temperature)
+
+    def _batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict], temperature: float) -> List[Optional[str]]:
+        self._load_model(model)
+        
+        formatted_prompts = self._format_prompts(messages_list, target_schema)
+        prefix = self._shared_prefix(formatted_prompts) if self.prefix_cache else None
+        max_tokens = self._max_tokens()
+        stop_on_json = bool(target_schema) and self.limits is not None and self.limits.stop_on_json
             
         try:
             sampler = make_sampler(temp=temperature)
+
+            constraint = self._constraint(target_schema) if self.constrained_decoding and target_schema else None
+            if constraint is not None:
+                # Masks follow each sequence's own state, so constrained requests are generated one at a time
+                if prefix is not None:
+                    generated_texts, details = self._generate_with_prefix(formatted_prompts, prefix, sampler, max_tokens, stop_on_json, allow_batch=False, constraint=constraint)
+                else:
+                    generated_texts, details = self._sequential_generate(formatted_prompts, temperature, max_tokens, stop_on_json, constraint=constraint)
+                self._count_constrained(constraint, generated_texts)
+                self._report_usage(formatted_prompts, generated_texts, max_tokens, details)
+                return generated_texts
+
+            if prefix is not None and (len(formatted_prompts) == 1 or self._batch_supports_prompt_caches()):
+                generated_texts, details = self._generate_with_prefix(formatted_prompts, prefix, sampler, max_tokens, stop_on_json)
+                self._report_usage(formatted_prompts, generated_texts, max_tokens, details)
+                return generated_texts
             
             # Try Batch Generation first
-            results = batch_generate(
-                self.current_model, 
-                self.current_tokenizer, 
-                formatted_prompts, 
-                verbose=False,
-                max_tokens=2048,
-                sampler=sampler
-            )
-            generated_texts = results.texts
-            del results
+            generated_texts, details = self._trim_repetitions(self._bucketed_batch_generate(formatted_prompts, sampler, max_tokens))
+            self._report_usage(formatted_prompts, generated_texts, max_tokens, details)
             return generated_texts
 
         except AttributeError as e:
             # Catch the MambaCache error specifically
             if "extract" in str(e) or "MambaCache" in str(e):
-                console.print(f"[yellow]Batch generation not supported for this model architecture (Mamba/SSM). Falling back to sequential generation.[/yellow]")
-                return self._sequential_generate(formatted_prompts, temperature)
+                get_console().print(f"[yellow]Batch generation not supported for this model architecture (Mamba/SSM). Falling back to sequential generation.[/yellow]")
+                if prefix is not None:
+                    generated_texts, details = self._generate_with_prefix(formatted_prompts, prefix, make_sampler(temp=temperature), max_tokens, stop_on_json, allow_batch=False)
+                else:
+                    generated_texts, details = self._sequential_generate(formatted_prompts, temperature, max_tokens, stop_on_json)
+                self._report_usage(formatted_prompts, generated_texts, max_tokens, details)
+                return generated_texts
             else:
-                console.print(f"[bold red][ERROR] MLX Provider | Model: {model} | Batch Error: {e}[/bold red]")
+                get_console().print(f"[bold red][ERROR] MLX Provider | Model: {model} | Batch Error: {e}[/bold red]")
                 return [None] * len(messages_list)
         except Exception as e:
-            console.print(f"[bold red][ERROR] MLX Provider | Model: {model} | General Error: {e}[/bold red]")
+            get_console().print(f"[bold red][ERROR] MLX Provider | Model: {model} | General Error: {e}[/bold red]")
             return [None] * len(messages_list)
 
-    def _sequential_generate(self, prompts: List[str], temperature: float) -> List[Optional[str]]:
-        results = []
+    def _constraint(self, schema: dict) -> Optional[Tuple[TokenConstraint, OrderedDict]]:
+        """The (constraint, mask cache) for `schema` with the current tokenizer; None if the schema is not supported."""
+        key = (self.current_checkpoint, json.dumps(schema)) # key order matters to the constraint
+        if key in self.constraints:
+            self.constraints.move_to_end(key)
+            return self.constraints[key]
+        try:
+            automaton = compile_schema(schema)
+        except UnsupportedSchema as e:
+            get_console().print(f"[yellow]MLX Provider: Schema not supported for constrained decoding ({e}); generating unconstrained.[/yellow]")
+            self.constraint_stats["unsupported"] += 1
+            self.constraints[key] = None
+        else:
+            if self.current_checkpoint not in self.vocabularies:
+                self.vocabularies[self.current_checkpoint] = vocabulary_from_tokenizer(self.current_tokenizer)
+            self.constraints[key] = (TokenConstraint(automaton, self.vocabularies[self.current_checkpoint]), OrderedDict())
+        while len(self.constraints) > self.CONSTRAINT_SLOTS:
+            self.constraints.popitem(last=False)
+        return self.constraints[key]
+
+    def _generation_kwargs(self, constraint: Optional[Tuple[TokenConstraint, OrderedDict]]) -> Dict:
+        if constraint is None:
+            return {}
+        return {"logits_processors": [ConstraintLogitsProcessor(constraint[0], constraint[1], self.MASKS_PER_CONSTRAINT)]}
+
+    def _count_constrained(self, constraint: Tuple[TokenConstraint, OrderedDict], texts: List[Optional[str]]):
+        """Outputs that did not close their JSON ran into max_tokens."""
+        automaton = constraint[0].automaton
+        for text in texts:
+            self.constraint_stats["outputs"] += 1
+            if text is None or not automaton.is_complete(automaton.advance(automaton.initial, text.strip())):
+                self.constraint_stats["incomplete"] += 1
+
+    def _bucketed_batch_generate(self, prompts: list, sampler, max_tokens: int, prefix_cache=None, prefix_len: int = 0) -> List[Optional[str]]:
+        """
+        batch_generate over batches of similar prompt length (scheduling.length_buckets), so one long
+        article does not pad every other sequence; texts come back in the order of `prompts`.
+        With a prefix cache, each sequence gets its own copy and `prompts` are the suffixes.
+        """
+        lengths = [prefix_len + (len(p) if isinstance(p, list) else len(self.current_tokenizer.encode(p))) for p in prompts]
+        texts: List[Optional[str]] = [None] * len(prompts)
+        for batch in length_buckets(lengths, self.batch_token_budget, reserve=max_tokens, max_batch=self.max_batch_size):
+            kwargs = {"prompt_caches": [copy.deepcopy(prefix_cache) for _ in batch]} if prefix_cache is not None else {}
+            results = batch_generate(
+                self.current_model,
+                self.current_tokenizer,
+                [prompts[i] for i in batch],
+                verbose=False,
+                max_tokens=max_tokens,
+                sampler=sampler,
+                **kwargs
+            )
+            for i, text in zip(batch, results.texts):
+                texts[i] = text
+            del results
+            longest = max(lengths[i] for i in batch)
+            self.batch_stats["batches"] += 1
+            self.batch_stats["sequences"] += len(batch)
+            self.batch_stats["prompt_tokens"] += sum(lengths[i] for i in batch)
+            self.batch_stats["padding_tokens"] += sum(longest - lengths[i] for i in batch)
+        return texts
+
+    def _max_tokens(self) -> int:
+        return self.limits.max_tokens(current_phase()) if self.limits is not None else self.MAX_TOKENS
+
+    def _trim_repetitions(self, texts: List[Optional[str]]) -> Tuple[List[Optional[str]], List[Dict]]:
+        """Batched sequences cannot be stopped one by one, so repetition loops are cut afterwards."""
+        details = [{} for _ in texts]
+        if self.limits is None or not self.limits.abort_repetition:
+            return texts, details
+        trimmed = []
+        for text, detail in zip(texts, details):
+            keep = find_repetition(text) if text else None
+            if keep is not None:
+                text = text[:keep]
+                detail["repetition_abort"] = True
+            trimmed.append(text)
+        return trimmed, details
+
+    def _report_usage(self, prompts: list, texts: List[Optional[str]], max_tokens: int, details: List[Dict]):
+        phase_name = current_phase()
+        for prompt, text, detail in zip(prompts, texts, details):
+            completion_tokens = len(self.current_tokenizer.encode(text)) if text else 0
+            # Without a finish reason, an output that used up max_tokens is counted as cut off
+            truncated = detail.get("truncated", completion_tokens >= max_tokens)
+            report_usage(
+                prompt_tokens=len(prompt) if isinstance(prompt, list) else len(self.current_tokenizer.encode(prompt)),
+                completion_tokens=completion_tokens,
+                truncated=truncated,
+                stopped_early=detail.get("stopped_early", False),
+                repetition_abort=detail.get("repetition_abort", False),
+                ttft_s=detail.get("ttft_s"),
+                output=text
+            )
+            if self.limits is not None and text is not None:
+                self.limits.observe(phase_name, completion_tokens, truncated)
+
+    # --- PREFIX KV CACHE ---
+    def _shared_prefix(self, prompts: list) -> Optional[List[int]]:
+        """
+        Token prefix shared by every prompt in the batch (system prompt + schema hint + template
+        preamble). Single prompts can only reuse a prefix cached by an earlier call.
+        Each prompt keeps at least one token of its own so generation has logits to start from.
+        """
+        if not prompts or not all(isinstance(p, list) for p in prompts):
+            return None
+
+        if len(prompts) >= 2:
+            shortest = min(len(p) for p in prompts)
+            length = 0
+            first = prompts[0]
+            while length < shortest - 1 and all(p[length] == first[length] for p in prompts):
+                length += 1
+            prefix = first[:length]
+        else:
+            prefix = []
+            for (checkpoint, _), (tokens, _) in self.prefix_caches.items():
+                if checkpoint == self.current_checkpoint and len(tokens) > len(prefix) and len(tokens) < len(prompts[0]) and prompts[0][:len(tokens)] == tokens:
+                    prefix = tokens
+
+        if len(prefix) < self.prefix_cache_min_tokens:
+            return None
+        return prefix
+
+    def _prefix_kv_cache(self, prefix: List[int]):
+        """Returns the prefilled KV cache for this prefix, computing it on first use."""
+        key = (self.current_checkpoint, hashlib.sha256(json.dumps(prefix).encode("utf-8")).hexdigest())
+        if key in self.prefix_caches:
+            self.prefix_caches.move_to_end(key)
+            self.prefix_stats["hits"] += 1
+            return self.prefix_caches[key][1]
+
+        self.prefix_stats["misses"] += 1
+        prompt_cache = make_prompt_cache(self.current_model)
+        tokens = mx.array(prefix)
+        for start in range(0, len(prefix), self.PREFILL_STEP):
+            self.current_model(tokens[start:start + self.PREFILL_STEP][None], cache=prompt_cache)
+            mx.eval([c.state for c in prompt_cache])
+
+        self.prefix_caches[key] = (prefix, prompt_cache)
+        while len(self.prefix_caches) > self.prefix_cache_slots:
+            self.prefix_caches.popitem(last=False)
+        return prompt_cache
+
+    def _batch_supports_prompt_caches(self) -> bool:
+        try:
+            return "prompt_caches" in inspect.signature(batch_generate).parameters
+        except (TypeError, ValueError):
+            return False
+
+    def _generate_with_prefix(self, prompts: List[List[int]], prefix: List[int], sampler, max_tokens: int, stop_on_json: bool,
+                              allow_batch: bool = True,
+                              constraint: Optional[Tuple[TokenConstraint, OrderedDict]] = None) -> Tuple[List[Optional[str]], List[Dict]]:
+        """Generates from the prefilled prefix cache, feeding only each prompt's own suffix tokens."""
+        prefix_cache = self._prefix_kv_cache(prefix)
+        suffixes = [p[len(prefix):] for p in prompts]
+        self.prefix_stats["tokens_reused"] += len(prefix) * len(prompts)
+
+        if allow_batch and len(suffixes) > 1:
+            return self._trim_repetitions(self._bucketed_batch_generate(suffixes, sampler, max_tokens, prefix_cache=prefix_cache, prefix_len=len(prefix)))
+
+        # Attention caches can be rolled back to the prefix after each article; others (SSM state) are copied
+        reuse_in_place = can_trim_prompt_cache(prefix_cache)
+        results, details = [], []
+        for i, suffix in enumerate(suffixes):
+            prompt_cache = prefix_cache if reuse_in_place else copy.deepcopy(prefix_cache)
+            try:
+                response, detail = self._stream_one(
+                    suffix, sampler, max_tokens, stop_on_json,
+                    prompt_cache=prompt_cache,
+                    **self._generation_kwargs(constraint)
+                )
+                results.append(response)
+                details.append(detail)
+            except Exception as e:
+                get_console().print(f"[red]Error generating sequence {i}: {e}[/red]")
+                results.append(None)
+                details.append({})
+            finally:
+                if reuse_in_place:
+                    trim_prompt_cache(prefix_cache, prefix_cache[0].offset - len(prefix))
+        return results, details
+
+    def _sequential_generate(self, prompts: List[str], temperature: float, max_tokens: int, stop_on_json: bool,
+                             constraint: Optional[Tuple[TokenConstraint, OrderedDict]] = None) -> Tuple[List[Optional[str]], List[Dict]]:
+        results, details = [], []
         # Create sampler once
         sampler = make_sampler(temp=temperature)
         
         for i, prompt in enumerate(prompts):
             try:
-                # Use standard generate() for one prompt at a time
-                response = generate(
-                    self.current_model,
-                    self.current_tokenizer,
-                    prompt=prompt,
-                    verbose=False,
-                    max_tokens=2048,
-                    sampler=sampler
-                )
+                # Generate one prompt at a time
+                response, detail = self._stream_one(prompt, sampler, max_tokens, stop_on_json, **self._generation_kwargs(constraint))
                 results.append(response)
+                details.append(detail)
                 # print progress for sequential generation as it is slower
                 print(f"Processed {i+1}/{len(prompts)} sequentially...")
             except Exception as e:
-                console.print(f"[red]Error generating sequence {i}: {e}[/red]")
+                get_console().print(f"[red]Error generating sequence {i}: {e}[/red]")
                 results.append(None)
+                details.append({})
+        return results, details
+
+    def _stream_one(self, prompt, sampler, max_tokens: int, stop_on_json: bool, **kwargs) -> Tuple[str, Dict]:
+        """
+        Streams one generation so it can end before max_tokens: once the top-level JSON object is
+        closed (stop_on_json) or when the output starts looping (limits.abort_repetition).
+        """
+        detector = JsonCloseDetector() if stop_on_json else None
+        check_repetition = self.limits is not None and self.limits.abort_repetition
+        detail = {"truncated": False, "stopped_early": False, "repetition_abort": False, "ttft_s": None}
+        text = ""
+        start = time.perf_counter()
+        for n, response in enumerate(stream_generate(
+            self.current_model, self.current_tokenizer, prompt=prompt, max_tokens=max_tokens, sampler=sampler, **kwargs
+        ), start=1):
+            if n == 1:
+                detail["ttft_s"] = time.perf_counter() - start # prompt prefill plus the first decoding step
+            text += response.text
+            if response.finish_reason is not None:
+                detail["truncated"] = response.finish_reason == "length"
+                break
+            if detector is not None and detector.feed(response.text) is not None:
+                text = text[:detector.end]
+                detail["stopped_early"] = True
+                break
+            if check_repetition and n % self.REPETITION_CHECK_TOKENS == 0:
+                keep = find_repetition(text)
+                if keep is not None:
+                    text = text[:keep]
+                    detail["repetition_abort"] = True
+                    break
+        return text, detail
+
+class CachedProvider(ModelProvider):
+    """
+    Wraps another provider with a persistent content-addressed completion cache.
+
+    policy: "all" caches every request, "deterministic" only caches requests with
+    temperature <= max_temperature, "off" passes everything through.
+    """
+    def __init__(self, provider: ModelProvider, cache: CompletionCache, policy: str = "deterministic", max_temperature: float = 0.1,
+                 layout: Optional[str] = None):
+        self.provider = provider
+        self.cache = cache
+        self.policy = policy
+        self.max_temperature = max_temperature
+        self.layout = layout # prompt layout of the wrapped provider, part of every key
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._stats_lock = threading.Lock() # sweep sessions share the provider across threads
+
+    def _is_cacheable(self, temperature: float) -> bool:
+        if self.policy == "all":
+            return True
+        if self.policy == "deterministic":
+            return temperature <= self.max_temperature
+        return False
+
+    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
+        if not self._is_cacheable(temperature):
+            with self._stats_lock:
+                self.bypassed += len(messages_list)
+            return self.provider.get_batch_completion(model, messages_list, target_schema, temperature)
+
+        # Hash before delegating: providers may modify the messages in place
+        keys = [request_key(model, messages, target_schema, temperature, self.layout) for messages in messages_list]
+        results: List[Optional[str]] = [None] * len(messages_list)
+        missing = []
+        for idx, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[idx] = cached
+            else:
+                missing.append(idx)
+        with self._stats_lock:
+            self.hits += len(messages_list) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            usage: List[Dict] = []
+            with usage_sink(usage):
+                fresh = self.provider.get_batch_completion(model, [messages_list[idx] for idx in missing], target_schema, temperature)
+            for fields in usage:
+                report_usage(**fields) # forward to the enclosing trace
+            # Cut-off outputs depend on the generation limits in force, which are not part of the key
+            limited = {u.get("output") for u in usage if u.get("truncated") or u.get("repetition_abort")}
+            for idx, response in zip(missing, fresh):
+                results[idx] = response
+                # Failures are not cached so they get retried next time
+                if response is not None and response not in limited:
+                    self.cache.put(keys[idx], response)
         return results
-        
-def get_provider(config: dict) -> ModelProvider:
-    if config.get("use_mlx", False):
-        return MLXProvider()
+
+    def prewarm(self, model: str):
+        self.provider.prewarm(model)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.cache.evictions,
+            "entries": len(self.cache),
+        }
+
+class InstrumentedProvider(ModelProvider):
+    """Records every call of the wrapped provider (phase, wall time, tokens, retries) into a Tracer."""
+    def __init__(self, provider: ModelProvider, tracer: Tracer):
+        self.provider = provider
+        self.tracer = tracer
+
+    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
+        usage: List[Dict] = []
+        start = self.tracer.now()
+        with usage_sink(usage):
+            outputs = self.provider.get_batch_completion(model, messages_list, target_schema, temperature)
+        self.tracer.record(build_event(self.tracer, model, start, self.tracer.now() - start, outputs, usage))
+        return outputs
+
+    def prewarm(self, model: str):
+        self.provider.prewarm(model)
+
+def find_provider(provider: ModelProvider, provider_type: type) -> Optional[ModelProvider]:
+    """Finds a provider of the given type inside a chain of wrapping providers (and behind a router)."""
+    while provider is not None:
+        if isinstance(provider, provider_type):
+            return provider
+        if hasattr(provider, "backends"):
+            return next(filter(None, (find_provider(backend, provider_type) for backend in provider.backends())), None)
+        provider = getattr(provider, "provider", None)
+    return None
+
+def get_provider(config: dict, tracer: Optional[Tracer] = None) -> ModelProvider:
+    limits = GenerationLimits.from_config(config.get("generation_limits"))
+    mock_config = config.get("mock") or {}
+    routing_config = config.get("routing") or {}
+    if mock_config.get("enabled", False):
+        from mock_provider import MockProvider
+        provider = MockProvider(**{k: v for k, v in mock_config.items() if k != "enabled"})
+    elif routing_config.get("enabled", False):
+        from routing import build_routing_provider
+        provider = build_routing_provider(config, routing_config, limits=limits)
+    elif config.get("use_mlx", False):
+        provider = MLXProvider(
+            prefix_cache=config.get("mlx_prefix_cache", False),
+            prefix_cache_min_tokens=config.get("mlx_prefix_cache_min_tokens", 64),
+            memory_budget_gb=config.get("mlx_memory_budget_gb"),
+            prewarm=config.get("mlx_prewarm", False),
+            constrained_decoding=config.get("mlx_constrained_decoding", False),
+            limits=limits,
+            batch_token_budget=config.get("mlx_batch_token_budget"),
+            max_batch_size=config.get("mlx_max_batch_size")
+        )
     else:
-        return OpenAIProvider(config["base_url"], config["api_key"])
+        provider = OpenAIProvider(config["base_url"], config["api_key"], max_concurrency=config.get("max_concurrency", 1), limits=limits)
+
+    if config.get("cache_enabled", False):
+        cache = CompletionCache(
+            Path(config.get("cache_path", ".cache/completions.sqlite")),
+            max_bytes=int(config.get("cache_max_mb", 512) * 1024 * 1024)
+        )
+        provider = CachedProvider(
+            provider,
+            cache,
+            policy=config.get("cache_policy", "deterministic"),
+            max_temperature=config.get("cache_max_temperature", 0.1),
+            # The MLX prefix cache moves the schema hint into the system message
+            layout="schema_in_system" if config.get("mlx_prefix_cache", False) else None
+        )
+
+    if tracer is not None:
+        provider = InstrumentedProvider(provider, tracer)
+    return provider
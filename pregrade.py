@@ -0,0 +1,219 @@
+"""
+Deterministic pre-grading of student outputs.
+
+Outputs that fail for mechanical reasons (invalid JSON, schema violations, locations that are
+not in the article or only appear in the dateline) get a score and critique here, without a
+teacher call. Everything else is escalated to the teacher.
+"""
+
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+# Scores assigned to hard failures (teacher scale is 1-10)
+INVALID_JSON_SCORE = 1
+SCHEMA_VIOLATION_SCORE = 2
+UNGROUNDED_LOCATION_SCORE = 3
+
+MAX_REPORTED_ERRORS = 5
+# Prefix of every critique written here, so they can be told apart from the teacher's
+PREGRADE_MARKER = "[pre-grader]"
+
+_TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+Validator = Callable[[object, str, List[str]], None]
+
+
+def _compile(schema: dict) -> Validator:
+    """Compiles a JSON-schema subset into a closure; unknown keywords are ignored."""
+    if not isinstance(schema, dict):
+        return lambda value, path, errors: None
+
+    checks: List[Validator] = []
+
+    schema_type = schema.get("type")
+    if schema_type:
+        types = schema_type if isinstance(schema_type, list) else [schema_type]
+        type_checks = [_TYPE_CHECKS[t] for t in types if t in _TYPE_CHECKS]
+        if type_checks:
+            def check_type(value, path, errors):
+                if not any(check(value) for check in type_checks):
+                    errors.append(f"{path}: expected {'/'.join(types)}, got {type(value).__name__}")
+            checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = schema["enum"]
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append(f"{path}: {value!r} is not one of {allowed}")
+        checks.append(check_enum)
+
+    if "minLength" in schema or "maxLength" in schema:
+        min_len = schema.get("minLength", 0)
+        max_len = schema.get("maxLength")
+        def check_length(value, path, errors):
+            if isinstance(value, str) and (len(value) < min_len or (max_len is not None and len(value) > max_len)):
+                errors.append(f"{path}: string length {len(value)} outside [{min_len}, {max_len}]")
+        checks.append(check_length)
+
+    properties = {name: _compile(sub) for name, sub in (schema.get("properties") or {}).items()}
+    required = list(schema.get("required") or [])
+    no_extra = schema.get("additionalProperties") is False
+    if properties or required or no_extra:
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append(f"{path}: missing required field '{name}'")
+            for name, sub_validator in properties.items():
+                if name in value:
+                    sub_validator(value[name], f"{path}.{name}", errors)
+            if no_extra:
+                for name in value:
+                    if name not in properties:
+                        errors.append(f"{path}: unexpected field '{name}'")
+        checks.append(check_object)
+
+    items = schema.get("items")
+    item_validator = _compile(items) if isinstance(items, dict) else None
+    min_items = schema.get("minItems")
+    max_items = schema.get("maxItems")
+    if item_validator or min_items is not None or max_items is not None:
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return
+            if min_items is not None and len(value) < min_items:
+                errors.append(f"{path}: expected at least {min_items} items, got {len(value)}")
+            if max_items is not None and len(value) > max_items:
+                errors.append(f"{path}: expected at most {max_items} items, got {len(value)}")
+            if item_validator:
+                for n, item in enumerate(value):
+                    item_validator(item, f"{path}[{n}]", errors)
+        checks.append(check_array)
+
+    def validate(value, path, errors):
+        for check in checks:
+            check(value, path, errors)
+    return validate
+
+
+@lru_cache(maxsize=64)
+def _compiled_for(schema_json: str) -> Validator:
+    return _compile(json.loads(schema_json))
+
+
+def compile_validator(schema: dict) -> Validator:
+    """Returns the compiled validator for a schema, cached by its canonical JSON."""
+    return _compiled_for(json.dumps(schema, sort_keys=True))
+
+
+def validate(instance, schema: dict) -> List[str]:
+    errors: List[str] = []
+    compile_validator(schema)(instance, "$", errors)
+    return errors
+
+
+# --- LOCATION GROUNDING ---
+_DATELINE = re.compile(
+    r"^\s*(?:By [^\n]*?\.\s*)?(?:[^\n]*?\*\s*)?(?:[^.\n]*?\.\s+)?"
+    r"(?P<place>[A-Z][A-Z .'\-]{2,}(?:,\s*[A-Z][A-Za-z .'\-]+)?)\s*(?:\((?P<agency>[A-Za-z]+)\))?\s*(?:—|--|-)"
+)
+_LOCATION_STOPWORDS = {
+    "the", "and", "between", "near", "north", "south", "east", "west", "northern", "southern",
+    "eastern", "western", "central", "region", "province", "state", "city", "area", "of", "in",
+}
+
+
+def _fold(text: str) -> str:
+    """Lowercases and strips accents so 'Cotiporã' matches 'cotipora'."""
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in normalized if not unicodedata.combining(c)).lower()
+
+
+def _location_terms(location: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z][a-z'\-]{2,}", _fold(location)) if t not in _LOCATION_STOPWORDS]
+
+
+def split_dateline(article: str) -> Tuple[str, str]:
+    """Returns (dateline, body); the dateline is empty if none is recognized."""
+    match = _DATELINE.match(article)
+    if not match:
+        return "", article
+    return article[:match.end()], article[match.end():]
+
+
+def _collect_locations(value) -> List[str]:
+    found = []
+    if isinstance(value, dict):
+        for key, sub in value.items():
+            if key == "location" and isinstance(sub, str):
+                found.append(sub)
+            else:
+                found.extend(_collect_locations(sub))
+    elif isinstance(value, list):
+        for item in value:
+            found.extend(_collect_locations(item))
+    return found
+
+
+def check_locations(instance, article: str) -> List[str]:
+    """
+    Flags the output when none of its locations is grounded in the article body: each one is
+    either absent from the text or only present in the dateline / agency tag.
+    """
+    locations = [loc for loc in _collect_locations(instance) if loc.strip()]
+    if not locations:
+        return []
+
+    dateline, body = split_dateline(article)
+    folded_body = _fold(body)
+    folded_dateline = _fold(dateline)
+
+    problems = []
+    for location in locations:
+        terms = _location_terms(location)
+        if not terms:
+            continue
+        if any(term in folded_body for term in terms):
+            return []
+        if any(term in folded_dateline for term in terms):
+            problems.append(f"location '{location}' only appears in the dateline/reporting tag")
+        else:
+            problems.append(f"location '{location}' does not appear in the article")
+    return problems
+
+
+def pregrade(output: str, article: str, schema: Optional[dict], check_location_grounding: bool = True) -> Optional[Tuple[int, str]]:
+    """
+    Returns (score, critique) for a hard failure, or None if the output is plausible and
+    should go to the teacher.
+    """
+    try:
+        instance = json.loads(output)
+    except (json.JSONDecodeError, TypeError) as e:
+        return INVALID_JSON_SCORE, f"{PREGRADE_MARKER} Output is not valid JSON: {e}"
+
+    if schema:
+        errors = validate(instance, schema)
+        if errors:
+            shown = "; ".join(errors[:MAX_REPORTED_ERRORS])
+            more = f" (+{len(errors) - MAX_REPORTED_ERRORS} more)" if len(errors) > MAX_REPORTED_ERRORS else ""
+            return SCHEMA_VIOLATION_SCORE, f"{PREGRADE_MARKER} Output violates the schema: {shown}{more}"
+
+    if check_location_grounding:
+        problems = check_locations(instance, article)
+        if problems:
+            return UNGROUNDED_LOCATION_SCORE, f"{PREGRADE_MARKER} No location is grounded in the article text: " + "; ".join(problems[:MAX_REPORTED_ERRORS])
+
+    return None
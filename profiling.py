@@ -0,0 +1,193 @@
+"""
+Call-level instrumentation for model providers.
+
+Every provider call is recorded with its phase (student, teacher-grade, optimize, ...), wall
+time and token counts. Providers report per-item details (queue time, tokens, retries, outputs
+cut off by max_tokens or stopped early) through
+report_usage(), which lands in the sink of the call that is currently being traced.
+The trace is written as JSONL and in Chrome trace format (chrome://tracing, Perfetto).
+"""
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_phase = contextvars.ContextVar("phase", default="other")
+_usage_sink = contextvars.ContextVar("usage_sink", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """Tags provider calls made inside the block (and in contexts copied from it) with `name`."""
+    token = _phase.set(name)
+    try:
+        yield
+    finally:
+        _phase.reset(token)
+
+
+def current_phase() -> str:
+    return _phase.get()
+
+
+@contextmanager
+def usage_sink(sink: list):
+    token = _usage_sink.set(sink)
+    try:
+        yield
+    finally:
+        _usage_sink.reset(token)
+
+
+def report_usage(**fields):
+    """Called by providers once per generated item; a no-op outside a traced call."""
+    sink = _usage_sink.get()
+    if sink is not None:
+        sink.append(fields)
+
+
+class Tracer:
+    def __init__(self):
+        self.events: List[Dict] = []
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def now(self) -> float:
+        """Seconds since the tracer was created."""
+        return time.perf_counter() - self._origin
+
+    def record(self, event: Dict):
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, counter: str):
+        """Accumulates the block's duration into `<counter>_s` and its call count into `counter`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(counter)
+            self.count(f"{counter}_s", time.perf_counter() - start)
+
+    def summary(self) -> List[Dict]:
+        """Per-phase aggregates of the recorded provider calls."""
+        phases: Dict[str, Dict] = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            stats = phases.setdefault(event["phase"], {
+                "phase": event["phase"], "calls": 0, "items": 0, "failures": 0, "wall_s": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "retries": 0, "queue_s": 0.0, "ttft_s": [],
+                "truncated": 0, "stopped_early": 0, "repetition_aborts": 0,
+            })
+            stats["calls"] += 1
+            stats["items"] += event["items"]
+            stats["failures"] += event["failures"]
+            stats["wall_s"] += event["dur_s"]
+            stats["prompt_tokens"] += event["prompt_tokens"]
+            stats["completion_tokens"] += event["completion_tokens"]
+            stats["retries"] += event["retries"]
+            stats["queue_s"] += event["queue_s"]
+            stats["truncated"] += event["truncated"]
+            stats["stopped_early"] += event["stopped_early"]
+            stats["repetition_aborts"] += event["repetition_aborts"]
+            if event.get("ttft_s") is not None:
+                stats["ttft_s"].append(event["ttft_s"])
+
+        rows = []
+        for stats in phases.values():
+            ttfts = stats.pop("ttft_s")
+            stats["avg_ttft_s"] = sum(ttfts) / len(ttfts) if ttfts else None
+            stats["completion_tok_per_s"] = stats["completion_tokens"] / stats["wall_s"] if stats["wall_s"] else 0.0
+            rows.append(stats)
+        return sorted(rows, key=lambda r: r["wall_s"], reverse=True)
+
+    def write(self, directory: Path) -> Dict[str, Path]:
+        """Writes trace.jsonl, trace_chrome.json and profile.json into `directory`."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+
+        jsonl_path = directory / "trace.jsonl"
+        with open(jsonl_path, 'w', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+
+        threads = {}
+        chrome_events = []
+        for event in events:
+            tid = threads.setdefault(event["thread"], len(threads) + 1)
+            args = {k: v for k, v in event.items() if k not in ("name", "phase", "start_s", "dur_s", "thread", "item_spans")}
+            chrome_events.append({
+                "name": f"{event['phase']}:{event['model']}", "cat": event["phase"], "ph": "X",
+                "ts": event["start_s"] * 1e6, "dur": event["dur_s"] * 1e6, "pid": 1, "tid": tid, "args": args,
+            })
+            for span in event.get("item_spans", []):
+                item_tid = threads.setdefault(span["thread"], len(threads) + 1)
+                chrome_events.append({
+                    "name": f"{event['phase']}:item", "cat": event["phase"], "ph": "X",
+                    "ts": span["start_s"] * 1e6, "dur": span["dur_s"] * 1e6, "pid": 1, "tid": item_tid,
+                    "args": {k: v for k, v in span.items() if k not in ("start_s", "dur_s", "thread")},
+                })
+        for name, tid in threads.items():
+            chrome_events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+
+        chrome_path = directory / "trace_chrome.json"
+        with open(chrome_path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": chrome_events, "displayTimeUnit": "ms"}, f)
+
+        profile_path = directory / "profile.json"
+        with open(profile_path, 'w', encoding='utf-8') as f:
+            json.dump({"phases": self.summary(), "counters": counters, "elapsed_s": self.now()}, f, indent=2)
+
+        return {"jsonl": jsonl_path, "chrome": chrome_path, "profile": profile_path}
+
+
+def build_event(tracer: Tracer, model: str, start_s: float, dur_s: float, outputs: List[Optional[str]], usage: List[Dict]) -> Dict:
+    """Combines a provider call's timing with the per-item usage its provider reported."""
+    def total(key):
+        return sum(u.get(key) or 0 for u in usage)
+
+    ttfts = [u["ttft_s"] for u in usage if u.get("ttft_s") is not None]
+    item_spans = [
+        {
+            "thread": u.get("thread", threading.current_thread().name),
+            "start_s": u["start"] - tracer._origin,
+            "dur_s": u["end"] - u["start"],
+            "prompt_tokens": u.get("prompt_tokens"),
+            "completion_tokens": u.get("completion_tokens"),
+            "retries": u.get("retries", 0),
+        }
+        for u in usage if "start" in u and "end" in u
+    ]
+    return {
+        "name": "completion",
+        "phase": current_phase(),
+        "model": model,
+        "thread": threading.current_thread().name,
+        "start_s": start_s,
+        "dur_s": dur_s,
+        "items": len(outputs),
+        "failures": sum(1 for o in outputs if o is None),
+        "prompt_tokens": total("prompt_tokens"),
+        "completion_tokens": total("completion_tokens"),
+        "retries": total("retries"),
+        "queue_s": total("queue_s"),
+        "ttft_s": sum(ttfts) / len(ttfts) if ttfts else None,
+        "truncated": total("truncated"),
+        "stopped_early": total("stopped_early"),
+        "repetition_aborts": total("repetition_abort"),
+        "item_spans": item_spans,
+    }
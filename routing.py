@@ -0,0 +1,263 @@
+"""
+Routes provider calls across several endpoints per role.
+
+The "routing" config section lists endpoints for the student and the teacher; each entry is an
+OpenAI-compatible server ({"base_url", "api_key", "max_concurrency"}) or {"mlx": true} for the
+local MLX provider:
+
+    "routing": {
+        "enabled": true,
+        "student": [{"mlx": true}],
+        "teacher": [{"base_url": "http://box1:1234/v1"}, {"base_url": "http://box2:1234/v1", "max_concurrency": 8}]
+    }
+
+Requests made in the "student" phase (see profiling.phase) go to the student endpoints,
+everything else to the teacher endpoints. Routing by role rather than by model name keeps it
+correct when the student and teacher are the same model, and lets sweep sessions with
+different models share one router. The items of a batch are spread by least outstanding requests. An endpoint whose
+requests fail is put on exponential backoff. A background health check (GET /models) backs off
+endpoints that stop answering and brings them back as soon as they answer again. Failed items
+are retried on the other endpoints of the role.
+"""
+
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from models import ModelProvider, OpenAIProvider, get_console
+from profiling import current_phase
+
+STUDENT_PHASE = "student"
+
+
+class Endpoint:
+    def __init__(self, name: str, provider: ModelProvider, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 max_concurrency: int = 1):
+        self.name = name
+        self.provider = provider
+        self.base_url = base_url # None for local providers, which are not health-checked
+        self.api_key = api_key
+        self.max_concurrency = max(1, max_concurrency)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.backoff_until = 0.0
+        self.unreachable = False # set by a failed health check; only those backoffs are lifted by a passing one
+        self.stats = {"requests": 0, "failures": 0, "backoffs": 0, "health_checks_failed": 0}
+
+    def available(self, now: float) -> bool:
+        return now >= self.backoff_until
+
+    def load(self) -> float:
+        """Outstanding requests per unit of concurrency; the least loaded endpoint gets the next item."""
+        return self.outstanding / self.max_concurrency
+
+
+class EndpointPool:
+    """The endpoints of one role, with least-outstanding selection and failure backoff."""
+    def __init__(self, role: str, endpoints: List[Endpoint], backoff_s: float = 5.0, max_backoff_s: float = 120.0):
+        self.role = role
+        self.endpoints = endpoints
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self._lock = threading.Lock()
+
+    def assign(self, count: int, exclude: Optional[set] = None) -> List[Endpoint]:
+        """Picks an endpoint for each of `count` items and counts them as outstanding."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if not exclude or e.name not in exclude] or self.endpoints
+            healthy = [e for e in candidates if e.available(now)]
+            if not healthy:
+                # Everything is backing off: use the endpoint that comes back first rather than failing
+                healthy = [min(candidates, key=lambda e: e.backoff_until)]
+            chosen = []
+            for _ in range(count):
+                endpoint = min(healthy, key=Endpoint.load)
+                endpoint.outstanding += 1
+                endpoint.stats["requests"] += 1
+                chosen.append(endpoint)
+            return chosen
+
+    def release(self, endpoint: Endpoint, items: int, failures: int):
+        with self._lock:
+            endpoint.outstanding -= items
+            endpoint.stats["failures"] += failures
+            if failures and failures == items:
+                self._back_off(endpoint)
+            elif failures < items:
+                endpoint.consecutive_failures = 0
+
+    def _back_off(self, endpoint: Endpoint):
+        endpoint.consecutive_failures += 1
+        delay = min(self.max_backoff_s, self.backoff_s * 2 ** (endpoint.consecutive_failures - 1))
+        endpoint.backoff_until = time.monotonic() + delay
+        endpoint.stats["backoffs"] += 1
+        get_console().print(f"[yellow]Routing: {self.role} endpoint {endpoint.name} failing; backing off for {delay:.0f}s[/yellow]")
+
+    def health_result(self, endpoint: Endpoint, healthy: bool):
+        with self._lock:
+            if healthy:
+                if endpoint.unreachable:
+                    get_console().print(f"[green]Routing: {self.role} endpoint {endpoint.name} is reachable again[/green]")
+                    endpoint.unreachable = False
+                    endpoint.backoff_until = 0.0
+                    endpoint.consecutive_failures = 0
+            else:
+                endpoint.stats["health_checks_failed"] += 1
+                endpoint.unreachable = True
+                if endpoint.available(time.monotonic()):
+                    self._back_off(endpoint)
+
+
+class RoutingProvider(ModelProvider):
+    def __init__(self, student: EndpointPool, teacher: EndpointPool, health_check_interval_s: float = 30.0,
+                 health_check_timeout_s: float = 5.0):
+        self.student = student
+        self.teacher = teacher
+        self.health_check_interval_s = health_check_interval_s
+        self.health_check_timeout_s = health_check_timeout_s
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._health_thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def backends(self) -> List[ModelProvider]:
+        """The distinct providers behind the endpoints (see models.find_provider)."""
+        providers = []
+        for endpoint in self._all_endpoints():
+            if all(endpoint.provider is not p for p in providers):
+                providers.append(endpoint.provider)
+        return providers
+
+    def _all_pools(self) -> List[EndpointPool]:
+        return [self.student, self.teacher]
+
+    def _pool(self) -> EndpointPool:
+        """The pool for the role of the current request, taken from its phase tag."""
+        return self.student if current_phase() == STUDENT_PHASE else self.teacher
+
+    def _all_endpoints(self) -> List[Endpoint]:
+        return [endpoint for pool in self._all_pools() for endpoint in pool.endpoints]
+
+    def _start(self):
+        with self._lock:
+            if self._executor is None:
+                workers = sum(e.max_concurrency for e in self._all_endpoints())
+                self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="routing")
+            if self._health_thread is None and self.health_check_interval_s and any(e.base_url for e in self._all_endpoints()):
+                self._health_thread = threading.Thread(target=self._health_loop, name="routing-health", daemon=True)
+                self._health_thread.start()
+
+    def _health_loop(self):
+        import httpx
+        while True:
+            time.sleep(self.health_check_interval_s)
+            for pool in self._all_pools():
+                for endpoint in pool.endpoints:
+                    if endpoint.base_url:
+                        pool.health_result(endpoint, self._check(httpx, endpoint))
+
+    def _check(self, httpx, endpoint: Endpoint) -> bool:
+        try:
+            response = httpx.get(endpoint.base_url.rstrip("/") + "/models", timeout=self.health_check_timeout_s,
+                                 headers={"Authorization": f"Bearer {endpoint.api_key}"} if endpoint.api_key else None)
+            return response.status_code < 500
+        except Exception:
+            return False
+
+    def get_batch_completion(self, model: str, messages_list: List[List[Dict]], target_schema: Optional[dict] = None, temperature: float = 0.1) -> List[Optional[str]]:
+        self._start()
+        pool = self._pool()
+        outputs: List[Optional[str]] = [None] * len(messages_list)
+        pending = list(range(len(messages_list)))
+        tried: Dict[int, set] = {n: set() for n in pending}
+
+        # Failed items are retried once on each other endpoint of the pool
+        for _ in range(len(pool.endpoints)):
+            if not pending:
+                break
+            groups: Dict[str, tuple] = {}
+            for n, endpoint in zip(pending, self._assign(pool, pending, tried)):
+                groups.setdefault(endpoint.name, (endpoint, []))[1].append(n)
+                tried[n].add(endpoint.name)
+
+            # Each sub-batch runs in a copy of the caller's context so phase tags and usage reports carry over
+            futures = [
+                (endpoint, indices, self._executor.submit(
+                    contextvars.copy_context().run, endpoint.provider.get_batch_completion,
+                    model, [messages_list[n] for n in indices], target_schema, temperature
+                ))
+                for endpoint, indices in groups.values()
+            ]
+            for endpoint, indices, future in futures:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    get_console().print(f"[red]Routing: {endpoint.name} raised {e}[/red]")
+                    results = [None] * len(indices)
+                pool.release(endpoint, len(indices), sum(1 for r in results if r is None))
+                for n, result in zip(indices, results):
+                    outputs[n] = result
+            pending = [n for n in pending if outputs[n] is None and len(tried[n]) < len(pool.endpoints)]
+        return outputs
+
+    def _assign(self, pool: EndpointPool, pending: List[int], tried: Dict[int, set]) -> List[Endpoint]:
+        if not any(tried[n] for n in pending):
+            return pool.assign(len(pending))
+        return [pool.assign(1, exclude=tried[n])[0] for n in pending]
+
+    def prewarm(self, model: str):
+        for endpoint in self._pool().endpoints:
+            endpoint.provider.prewarm(model)
+
+    def stats(self) -> List[Dict]:
+        now = time.monotonic()
+        rows = []
+        for pool in self._all_pools():
+            for endpoint in pool.endpoints:
+                rows.append({"role": pool.role, "endpoint": endpoint.name, **endpoint.stats,
+                             "backing_off": not endpoint.available(now)})
+        return rows
+
+
+def build_routing_provider(config: dict, routing: dict, limits=None) -> RoutingProvider:
+    """Builds the endpoint pools from the "routing" config section; one MLX provider is shared by all {"mlx": true} entries."""
+    mlx_provider = None
+
+    def make_endpoint(role: str, n: int, entry: dict) -> Endpoint:
+        nonlocal mlx_provider
+        if entry.get("mlx", False):
+            if mlx_provider is None:
+                from models import MLXProvider
+                mlx_provider = MLXProvider(
+                    prefix_cache=config.get("mlx_prefix_cache", False),
+                    prefix_cache_min_tokens=config.get("mlx_prefix_cache_min_tokens", 64),
+                    memory_budget_gb=config.get("mlx_memory_budget_gb"),
+                    prewarm=config.get("mlx_prewarm", False),
+                    constrained_decoding=config.get("mlx_constrained_decoding", False),
+                    limits=limits,
+                    batch_token_budget=config.get("mlx_batch_token_budget"),
+                    max_batch_size=config.get("mlx_max_batch_size")
+                )
+            return Endpoint("mlx", mlx_provider)
+        base_url = entry["base_url"]
+        api_key = entry.get("api_key", config.get("api_key", ""))
+        max_concurrency = entry.get("max_concurrency", config.get("max_concurrency", 1))
+        # The router fails over to other endpoints itself, so client-side retries default to off
+        provider = OpenAIProvider(base_url, api_key, max_concurrency=max_concurrency, limits=limits,
+                                  max_retries=entry.get("max_retries", routing.get("max_retries", 0)))
+        return Endpoint(entry.get("name", f"{role}{n}:{base_url}"), provider, base_url, api_key, max_concurrency)
+
+    pools = {}
+    for role in ("student", "teacher"):
+        entries = routing.get(role) or [{"base_url": config["base_url"]}]
+        pools[role] = EndpointPool(
+            role, [make_endpoint(role, n, entry) for n, entry in enumerate(entries, start=1)],
+            backoff_s=routing.get("backoff_s", 5.0), max_backoff_s=routing.get("max_backoff_s", 120.0)
+        )
+    return RoutingProvider(
+        pools["student"], pools["teacher"],
+        health_check_interval_s=routing.get("health_check_interval_s", 30.0),
+        health_check_timeout_s=routing.get("health_check_timeout_s", 5.0)
+    )
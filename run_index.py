@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Index of every candidate (prompt + schema) graded in earlier runs.
+
+Each evaluation of a candidate in a run (one iteration) becomes one row, keyed by the
+candidate's content hash, the student model and the corpus fingerprint, with its mean score,
+the number of articles graded and the critiques. Prompts and schemas are stored once by content
+hash. Runs are found by their config_used.json anywhere under the runs directory (including
+sweeps); a run is re-scanned only when its log has changed since the last update. The corpus
+fingerprint is the one the run recorded in FINGERPRINT_FILE when it started, so editing the
+corpus later does not make its old scores match the new articles; runs without one are indexed
+but never matched.
+
+With run_index.warm_start a new run starts from the best earlier candidates for the same
+student model and corpus, and candidates already graded on the whole corpus are not graded again.
+
+    python run_index.py                 # update optimization_runs/index.sqlite, show the top 10
+    python run_index.py --top 20 --root optimization_runs
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from corpus import corpus_fingerprint
+from pregrade import PREGRADE_MARKER
+from runstore import CSV_FILE, JSONL_FILES, SQLITE_FILE, content_id, detect_backend, open_run_store
+from surrogate import SURROGATE_CRITIQUE
+
+INDEX_FILE = "index.sqlite"
+FINGERPRINT_FILE = "corpus_fingerprint.txt"
+# Bumped when indexed values change meaning; older indexes are rebuilt from the run logs
+INDEX_VERSION = 2
+
+
+def candidate_hash(prompt: str, schema: Optional[dict]) -> str:
+    return content_id(prompt + "\x1f" + json.dumps(schema, sort_keys=True))
+
+
+def is_teacher_critique(critique) -> bool:
+    """False for the placeholders logged by the pre-grader and the surrogate scorer."""
+    return bool(critique) and critique != SURROGATE_CRITIQUE and not str(critique).startswith(PREGRADE_MARKER)
+
+
+def recorded_fingerprint(run_dir: Path) -> Optional[str]:
+    path = run_dir / FINGERPRINT_FILE
+    return path.read_text(encoding='utf-8').strip() or None if path.exists() else None
+
+
+def log_signature(run_dir: Path) -> Optional[str]:
+    """Size and mtime of the run's log files; changes whenever rows are appended."""
+    parts = []
+    for name in (CSV_FILE, *JSONL_FILES, SQLITE_FILE):
+        path = run_dir / name
+        if path.exists():
+            stat = path.stat()
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts) or None
+
+
+class RunIndex:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Sessions of a sweep update the same index; wait for each other's transactions
+        self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            self._conn.executescript(f"""
+                DROP TABLE IF EXISTS runs;
+                DROP TABLE IF EXISTS evaluations;
+                PRAGMA user_version = {INDEX_VERSION};
+            """)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (run_dir TEXT PRIMARY KEY, signature TEXT, student_model TEXT, corpus TEXT);
+            CREATE TABLE IF NOT EXISTS texts (id TEXT PRIMARY KEY, text TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS evaluations (
+                run_dir TEXT, iteration INTEGER, candidate TEXT, student_model TEXT, corpus TEXT,
+                prompt_id TEXT, schema_id TEXT, articles INTEGER, mean_score REAL, feedback TEXT, scores TEXT,
+                PRIMARY KEY (run_dir, iteration, candidate)
+            );
+            CREATE INDEX IF NOT EXISTS evaluations_lookup ON evaluations (student_model, corpus, candidate);
+        """)
+
+    def close(self):
+        self._conn.close()
+
+    def update(self, root: Path, exclude: Optional[Path] = None) -> Dict[str, int]:
+        """Scans runs under `root` that are new or changed; returns {"scanned", "unchanged", "evaluations"}."""
+        known = dict(self._conn.execute("SELECT run_dir, signature FROM runs"))
+        stats = {"scanned": 0, "unchanged": 0, "evaluations": 0}
+        for config_path in sorted(Path(root).glob("**/config_used.json")):
+            run_dir = config_path.parent
+            if exclude is not None and run_dir.resolve() == Path(exclude).resolve():
+                continue
+            signature = log_signature(run_dir)
+            if signature is None:
+                continue
+            if known.get(str(run_dir)) == signature:
+                stats["unchanged"] += 1
+                continue
+            stats["evaluations"] += self._scan(run_dir, signature)
+            stats["scanned"] += 1
+        return stats
+
+    def _scan(self, run_dir: Path, signature: str) -> int:
+        with open(run_dir / "config_used.json", 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        student_model = config.get("student_model")
+        corpus = recorded_fingerprint(run_dir)
+        population = config.get("population_size", 1) > 1
+
+        # Rows grouped per (iteration, candidate); a candidate graded in several iterations gets one row each
+        groups: Dict[tuple, Dict] = {}
+        store = open_run_store(run_dir, detect_backend(run_dir))
+        try:
+            for row in store.rows():
+                # The legacy CSV has no candidate column; its candidates are told apart by prompt
+                key = (row["iteration"], row["candidate_id"] or row["prompt"])
+                group = groups.setdefault(key, {"prompt": row["prompt"], "schema": row["schema"], "candidate_id": row["candidate_id"], "grades": {}})
+                group["grades"][row["article_id"]] = (row["score"], row["critique"])
+        finally:
+            store.close()
+
+        records = []
+        for (iteration, _), group in groups.items():
+            schema = group["schema"]
+            if schema is None:
+                candidate_id = group["candidate_id"]
+                if population and candidate_id is None:
+                    candidate_id = self._saved_candidate(run_dir, iteration, group["prompt"])
+                schema = self._saved_schema(run_dir, iteration, candidate_id if population else None, config)
+            scores = [float(score) for score, _ in group["grades"].values() if isinstance(score, (int, float))]
+            feedback = [f"Article {article_id}: {critique}" for article_id, (_, critique) in group["grades"].items()
+                        if is_teacher_critique(critique)]
+            prompt_id = self._intern(group["prompt"])
+            schema_id = self._intern(json.dumps(schema, sort_keys=True))
+            records.append((
+                str(run_dir), iteration, candidate_hash(group["prompt"], schema), student_model, corpus, prompt_id, schema_id,
+                len(scores), sum(scores) / len(scores) if scores else None, json.dumps(feedback), json.dumps(scores)
+            ))
+
+        with self._conn:
+            self._conn.execute("DELETE FROM evaluations WHERE run_dir = ?", (str(run_dir),))
+            self._conn.executemany("INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+            self._conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)", (str(run_dir), signature, student_model, corpus))
+        return len(records)
+
+    def _intern(self, text: str) -> str:
+        text_id = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        self._conn.execute("INSERT OR IGNORE INTO texts VALUES (?, ?)", (text_id, text))
+        return text_id
+
+    @staticmethod
+    def _saved_candidate(run_dir: Path, iteration: int, prompt: str) -> Optional[str]:
+        """Id of the candidate whose prompt saved for that iteration is `prompt`."""
+        prefix = f"iter_{iteration}_cand_"
+        for path in (run_dir / "prompts").glob(f"{prefix}*.txt"):
+            if path.read_text(encoding='utf-8') == prompt:
+                return path.stem[len(prefix):]
+        return None
+
+    @staticmethod
+    def _saved_schema(run_dir: Path, iteration: int, candidate_id: Optional[str], config: Dict) -> Optional[dict]:
+        """The legacy CSV log has no schema column; the schema saved for that iteration stands in."""
+        suffix = f"_cand_{candidate_id}" if candidate_id is not None else ""
+        path = run_dir / "schemas" / f"iter_{iteration}{suffix}_schema.json"
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return config.get("starting_schema")
+
+    def _text(self, text_id: str) -> str:
+        return self._conn.execute("SELECT text FROM texts WHERE id = ?", (text_id,)).fetchone()[0]
+
+    def top(self, student_model: str, corpus: str, k: int, min_articles: int = 1) -> List[Dict]:
+        """The k best distinct candidates graded on at least min_articles articles, best first."""
+        cursor = self._conn.execute("""
+            SELECT candidate, prompt_id, schema_id, mean_score, articles, run_dir FROM evaluations
+            WHERE student_model = ? AND corpus = ? AND articles >= ? AND mean_score IS NOT NULL
+            ORDER BY mean_score DESC, articles DESC
+        """, (student_model, corpus, min_articles))
+        best = {}
+        for candidate, prompt_id, schema_id, mean_score, articles, run_dir in cursor:
+            if candidate not in best:
+                best[candidate] = {"prompt": self._text(prompt_id), "schema": json.loads(self._text(schema_id)),
+                                   "mean_score": mean_score, "articles": articles, "run_dir": run_dir}
+                if len(best) >= k:
+                    break
+        return list(best.values())
+
+    def lookup(self, student_model: str, corpus: str, prompt: str, schema: dict, min_articles: int) -> Optional[Dict]:
+        """The most complete earlier grading of this exact candidate, if it covered min_articles articles."""
+        row = self._conn.execute("""
+            SELECT mean_score, articles, feedback, scores, run_dir FROM evaluations
+            WHERE student_model = ? AND corpus = ? AND candidate = ? AND articles >= ?
+            ORDER BY articles DESC, run_dir DESC LIMIT 1
+        """, (student_model, corpus, candidate_hash(prompt, schema), min_articles)).fetchone()
+        if row is None:
+            return None
+        mean_score, articles, feedback, scores, run_dir = row
+        return {"mean_score": mean_score, "articles": articles, "feedback": json.loads(feedback),
+                "scores": json.loads(scores), "run_dir": run_dir}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index earlier runs and list the best candidates for the current config.")
+    parser.add_argument("--config", type=Path, default=Path("config.json"))
+    parser.add_argument("--root", type=Path, default=Path("optimization_runs"), help="Directory holding the runs")
+    parser.add_argument("--index", type=Path, help=f"Index file (default: <root>/{INDEX_FILE})")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    from rich.console import Console
+    from rich.markup import escape
+    from evaluate import TEST_ARTICLES, load_config
+
+    console = Console()
+    config = load_config(args.config)
+    index = RunIndex(args.index or args.root / INDEX_FILE)
+    stats = index.update(args.root)
+    console.print(f"Indexed {stats['scanned']} new or changed run(s) ({stats['evaluations']} evaluations), {stats['unchanged']} unchanged")
+    corpus = corpus_fingerprint(config.get("corpus"), TEST_ARTICLES)
+    for n, entry in enumerate(index.top(config["student_model"], corpus, args.top), start=1):
+        console.print(f"{n:2d}. [bold cyan]{entry['mean_score']:.2f}[/bold cyan] on {entry['articles']} articles ({escape(entry['run_dir'])}): {escape(entry['prompt'][:100])}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Per-run storage of graded student outputs.
+
+The legacy optimization_log.csv repeats the full prompt on every row. The compact backends
+intern prompts and schemas by content hash, store each once and reference it from the rows:
+
+  csv     optimization_log.csv (legacy layout, one row per grade)
+  jsonl   evaluations.jsonl + prompts.jsonl + schemas.jsonl
+  sqlite  run_log.sqlite (tables evaluations, prompts, schemas)
+
+All backends keep one open handle and buffer rows; the evaluator flushes after each corpus chunk
+and before every checkpoint, so disk I/O stays out of the student/teacher loop.
+
+    python runstore.py export optimization_runs/run_X --out run_X.csv   # legacy CSV
+    python runstore.py export optimization_runs/run_X --format parquet  # needs pyarrow
+    python runstore.py convert optimization_runs/run_X --to sqlite
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+CSV_FILE = "optimization_log.csv"
+JSONL_FILES = ("evaluations.jsonl", "prompts.jsonl", "schemas.jsonl")
+SQLITE_FILE = "run_log.sqlite"
+BACKENDS = ("csv", "jsonl", "sqlite")
+
+LEGACY_COLUMNS = ["Iteration", "Article_ID", "Student_Output", "Teacher_Score", "Teacher_Critique", "Prompt_Used"]
+ROW_FIELDS = ["iteration", "article_id", "output", "score", "critique", "prompt"]
+
+
+def content_id(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def schema_id(schema: Optional[dict]) -> Optional[str]:
+    """Content id of a schema, independent of key order; None for no schema."""
+    return content_id(json.dumps(schema, sort_keys=True)) if schema is not None else None
+
+
+def _parse_score(raw):
+    if not isinstance(raw, str):
+        return raw
+    try:
+        score = float(raw)
+    except ValueError:
+        return raw
+    return int(score) if score.is_integer() else score
+
+
+class RunStore:
+    """Buffered, thread-safe writer/reader for one run directory."""
+    backend = ""
+
+    def __init__(self, run_dir: Path, flush_every: int = 256):
+        self.run_dir = Path(run_dir)
+        self.flush_every = max(1, flush_every)
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def log(self, iteration: int, article_id: str, output: str, score, critique: str, prompt: str,
+            candidate_id: str = "1", schema: Optional[dict] = None):
+        row = {"iteration": iteration, "article_id": str(article_id), "output": output, "score": score,
+               "critique": critique, "prompt": prompt, "candidate_id": str(candidate_id or "1"), "schema": schema}
+        with self._lock:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.flush_every:
+                self._write_locked()
+
+    def flush(self):
+        with self._lock:
+            self._write_locked()
+
+    def _write_locked(self):
+        if self._buffer:
+            rows, self._buffer = self._buffer, []
+            self._write(rows)
+
+    def close(self):
+        self.flush()
+
+    def _write(self, rows: List[Dict]):
+        raise NotImplementedError
+
+    def rows(self) -> Iterator[Dict]:
+        """Yields every stored row with prompt (and schema, where kept) resolved."""
+        raise NotImplementedError
+
+    def resume_key(self, iteration: int, candidate_id: Optional[str], prompt: str, article_id: str) -> Tuple[int, str, str]:
+        """Key of one grade in grades()."""
+        return iteration, str(candidate_id), str(article_id)
+
+    def grades(self) -> Dict[Tuple[int, str, str], Tuple[str, Optional[str], object, str]]:
+        """{resume_key: (prompt, schema_id, score, critique)} for resuming a run; schema_id is None where no schema is kept."""
+        self.flush()
+        return {self.resume_key(row["iteration"], row["candidate_id"], row["prompt"], row["article_id"]):
+                    (row["prompt"], schema_id(row["schema"]), row["score"], row["critique"])
+                for row in self.rows()}
+
+
+class CsvRunStore(RunStore):
+    backend = "csv"
+
+    def __init__(self, run_dir: Path, flush_every: int = 256):
+        super().__init__(run_dir, flush_every)
+        self.path = self.run_dir / CSV_FILE
+        is_new = not self.path.exists()
+        self._file = open(self.path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if is_new:
+            self._writer.writerow(LEGACY_COLUMNS)
+            self._file.flush()
+
+    def _write(self, rows: List[Dict]):
+        self._writer.writerows([[row[field] for field in ROW_FIELDS] for row in rows])
+        self._file.flush()
+
+    def rows(self) -> Iterator[Dict]:
+        with open(self.path, 'r', newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                yield {
+                    "iteration": int(record["Iteration"]), "article_id": record["Article_ID"],
+                    "output": record["Student_Output"], "score": _parse_score(record["Teacher_Score"]),
+                    "critique": record["Teacher_Critique"], "prompt": record["Prompt_Used"],
+                    "candidate_id": None, "schema": None,
+                }
+
+    def resume_key(self, iteration: int, candidate_id: Optional[str], prompt: str, article_id: str) -> Tuple[int, str, str]:
+        # The legacy layout has no candidate column; candidates of one iteration differ by prompt
+        return iteration, content_id(prompt), str(article_id)
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class JsonlRunStore(RunStore):
+    backend = "jsonl"
+
+    def __init__(self, run_dir: Path, flush_every: int = 256):
+        super().__init__(run_dir, flush_every)
+        self.paths = {name: self.run_dir / name for name in JSONL_FILES}
+        self._known = {"prompts": set(), "schemas": set()}
+        for kind in self._known:
+            path = self.paths[f"{kind}.jsonl"]
+            if path.exists():
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._known[kind].update(json.loads(line)["id"] for line in f if line.strip())
+        self._files = {name: open(path, 'a', encoding='utf-8') for name, path in self.paths.items()}
+
+    def _intern(self, kind: str, text: str) -> str:
+        key = content_id(text)
+        if key not in self._known[kind]:
+            self._known[kind].add(key)
+            self._files[f"{kind}.jsonl"].write(json.dumps({"id": key, "text": text}) + "\n")
+        return key
+
+    def _write(self, rows: List[Dict]):
+        lines = []
+        for row in rows:
+            record = {k: row[k] for k in ("iteration", "candidate_id", "article_id", "score", "critique", "output")}
+            record["prompt_id"] = self._intern("prompts", row["prompt"])
+            record["schema_id"] = self._intern("schemas", json.dumps(row["schema"], sort_keys=True)) if row["schema"] is not None else None
+            lines.append(json.dumps(record) + "\n")
+        # Interned texts first, so a reader never sees a row whose prompt is missing
+        self._files["prompts.jsonl"].flush()
+        self._files["schemas.jsonl"].flush()
+        self._files["evaluations.jsonl"].writelines(lines)
+        self._files["evaluations.jsonl"].flush()
+
+    def _load_texts(self, name: str) -> Dict[str, str]:
+        with open(self.paths[name], 'r', encoding='utf-8') as f:
+            return {entry["id"]: entry["text"] for entry in map(json.loads, filter(str.strip, f))}
+
+    def rows(self) -> Iterator[Dict]:
+        prompts = self._load_texts("prompts.jsonl")
+        schemas = self._load_texts("schemas.jsonl")
+        with open(self.paths["evaluations.jsonl"], 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    schema_id = record.pop("schema_id")
+                    record["prompt"] = prompts[record.pop("prompt_id")]
+                    record["schema"] = json.loads(schemas[schema_id]) if schema_id else None
+                    yield record
+
+    def close(self):
+        super().close()
+        for f in self._files.values():
+            f.close()
+
+
+class SqliteRunStore(RunStore):
+    backend = "sqlite"
+
+    def __init__(self, run_dir: Path, flush_every: int = 256):
+        super().__init__(run_dir, flush_every)
+        self.path = self.run_dir / SQLITE_FILE
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS prompts (id TEXT PRIMARY KEY, text TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS schemas (id TEXT PRIMARY KEY, json TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS evaluations (
+                iteration INTEGER NOT NULL,
+                candidate_id TEXT NOT NULL,
+                article_id TEXT NOT NULL,
+                score,
+                critique TEXT,
+                output TEXT,
+                prompt_id TEXT NOT NULL REFERENCES prompts(id),
+                schema_id TEXT REFERENCES schemas(id)
+            );
+            CREATE INDEX IF NOT EXISTS evaluations_iteration ON evaluations (iteration, candidate_id);
+        """)
+
+    def _write(self, rows: List[Dict]):
+        prompts = {}
+        schemas = {}
+        records = []
+        for row in rows:
+            prompt_id = content_id(row["prompt"])
+            prompts[prompt_id] = row["prompt"]
+            schema_id = None
+            if row["schema"] is not None:
+                schema_json = json.dumps(row["schema"], sort_keys=True)
+                schema_id = content_id(schema_json)
+                schemas[schema_id] = schema_json
+            records.append((row["iteration"], row["candidate_id"], row["article_id"], row["score"], row["critique"], row["output"], prompt_id, schema_id))
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO prompts (id, text) VALUES (?, ?)", prompts.items())
+            self._conn.executemany("INSERT OR IGNORE INTO schemas (id, json) VALUES (?, ?)", schemas.items())
+            self._conn.executemany("INSERT INTO evaluations VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+
+    def rows(self) -> Iterator[Dict]:
+        cursor = self._conn.execute("""
+            SELECT e.iteration, e.candidate_id, e.article_id, e.score, e.critique, e.output, p.text, s.json
+            FROM evaluations e JOIN prompts p ON p.id = e.prompt_id LEFT JOIN schemas s ON s.id = e.schema_id
+            ORDER BY e.rowid
+        """)
+        for iteration, candidate_id, article_id, score, critique, output, prompt, schema_json in cursor:
+            yield {"iteration": iteration, "candidate_id": candidate_id, "article_id": article_id, "score": score,
+                   "critique": critique, "output": output, "prompt": prompt,
+                   "schema": json.loads(schema_json) if schema_json else None}
+
+    def close(self):
+        super().close()
+        self._conn.close()
+
+
+_STORES = {"csv": CsvRunStore, "jsonl": JsonlRunStore, "sqlite": SqliteRunStore}
+
+
+def detect_backend(run_dir: Path) -> Optional[str]:
+    """Backend of the run log already present in run_dir, if any."""
+    run_dir = Path(run_dir)
+    if (run_dir / SQLITE_FILE).exists():
+        return "sqlite"
+    if (run_dir / JSONL_FILES[0]).exists():
+        return "jsonl"
+    if (run_dir / CSV_FILE).exists():
+        return "csv"
+    return None
+
+
+def open_run_store(run_dir: Path, backend: Optional[str] = None, flush_every: int = 256) -> RunStore:
+    """Opens the run log in run_dir; an existing log keeps its backend, otherwise `backend` (default csv) is created."""
+    backend = detect_backend(run_dir) or backend or "csv"
+    if backend not in _STORES:
+        raise ValueError(f"Unknown run store backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    return _STORES[backend](run_dir, flush_every=flush_every)
+
+
+def export_csv(store: RunStore, path: Path) -> int:
+    """Writes the rows in the legacy optimization_log.csv layout; returns the row count."""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(LEGACY_COLUMNS)
+        for row in store.rows():
+            writer.writerow([row[field] for field in ROW_FIELDS])
+            count += 1
+    return count
+
+
+def export_parquet(store: RunStore, path: Path) -> int:
+    """Writes the rows as a Parquet table (prompt and schema dictionary-encoded); needs pyarrow."""
+    if not HAS_PYARROW:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    rows = list(store.rows())
+    table = pa.table({
+        "iteration": [row["iteration"] for row in rows],
+        "candidate_id": [row["candidate_id"] for row in rows],
+        "article_id": [row["article_id"] for row in rows],
+        "score": [None if row["score"] in (None, "") else float(row["score"]) for row in rows],
+        "critique": [row["critique"] for row in rows],
+        "output": [row["output"] for row in rows],
+        "prompt": pa.array([row["prompt"] for row in rows]).dictionary_encode(),
+        "schema": pa.array([json.dumps(row["schema"], sort_keys=True) if row["schema"] is not None else None for row in rows]).dictionary_encode(),
+    })
+    pq.write_table(table, path, compression="zstd")
+    return len(rows)
+
+
+def convert(run_dir: Path, backend: str, flush_every: int = 4096) -> RunStore:
+    """Copies an existing run log into another backend in the same directory."""
+    source = open_run_store(run_dir)
+    if source.backend == backend:
+        return source
+    target = _STORES[backend](run_dir, flush_every=flush_every)
+    for row in source.rows():
+        target.log(row["iteration"], row["article_id"], row["output"], row["score"], row["critique"],
+                   row["prompt"], row["candidate_id"], row["schema"])
+    target.flush()
+    source.close()
+    return target
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or convert run logs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="Write a run log as legacy CSV or Parquet")
+    export_parser.add_argument("run_dir", type=Path)
+    export_parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    export_parser.add_argument("--out", type=Path, help="Defaults to <run_dir>/optimization_log_export.<format>")
+    convert_parser = sub.add_parser("convert", help="Copy a run log into another backend")
+    convert_parser.add_argument("run_dir", type=Path)
+    convert_parser.add_argument("--to", choices=BACKENDS, default="sqlite")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        store = open_run_store(args.run_dir)
+        out = args.out or args.run_dir / f"optimization_log_export.{args.format}"
+        try:
+            count = (export_csv if args.format == "csv" else export_parquet)(store, out)
+        except RuntimeError as e:
+            parser.error(str(e))
+        finally:
+            store.close()
+        print(f"Exported {count} rows from the {store.backend} log to {out}")
+    else:
+        store = convert(args.run_dir, args.to)
+        store.close()
+        print(f"Run log of {args.run_dir} is now also stored as {args.to}")
@@ -0,0 +1,152 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+
+def rung_sizes(min_articles: int, eta: float, max_chunk: int) -> Iterator[int]:
+    """
+    Chunk sizes for successive-halving style evaluation: min_articles, then each rung grows the
+    evaluated total by a factor of eta, capped at max_chunk articles per chunk.
+    """
+    evaluated = 0
+    target = max(1, min_articles)
+    while True:
+        size = min(max_chunk, max(1, int(target - evaluated)))
+        yield size
+        evaluated += size
+        if evaluated >= target:
+            target = max(target + 1, int(math.ceil(target * eta)))
+
+
+def iter_sized_chunks(items: Iterable, sizes: Iterator[int]) -> Iterator[list]:
+    iterator = iter(items)
+    for size in sizes:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def length_buckets(lengths: List[int], token_budget: Optional[int], reserve: int = 0, max_batch: Optional[int] = None) -> List[List[int]]:
+    """
+    Groups request indices into batches of similar length. A batch is padded to its longest
+    prompt and each sequence may grow by `reserve` tokens, so a batch of n costs
+    n * (longest + reserve) tokens; batches stay within token_budget (a request that exceeds it
+    on its own gets a batch of one). Without a budget or cap everything goes into one batch in
+    the original order.
+    """
+    if not lengths:
+        return []
+    if token_budget is None and max_batch is None:
+        return [list(range(len(lengths)))]
+
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # Sorted ascending, so the newcomer is the longest prompt of the batch
+        cost = (len(batch) + 1) * (lengths[index] + reserve)
+        if batch and ((token_budget is not None and cost > token_budget) or (max_batch is not None and len(batch) >= max_batch)):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    batches.append(batch)
+    return batches
+
+
+class EarlyAbortTracker:
+    """
+    Tracks running scores per candidate and flags candidates whose upper confidence bound
+    (mean + z * std / sqrt(n)) falls below the score they would need to beat.
+    Thread-safe so the pipelined evaluator can feed it from worker threads.
+    """
+
+    def __init__(self, threshold: Optional[float], min_articles: int = 8, z: float = 1.96, min_std: float = 1.0):
+        self.threshold = threshold
+        self.min_articles = max(1, min_articles)
+        self.z = z
+        self.min_std = min_std
+        self._scores: Dict[str, List[float]] = {}
+        self.aborted: Dict[str, float] = {}  # candidate_id -> upper bound at abort time
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.threshold is not None and self.threshold > 0
+
+    def add(self, candidate_id: str, score: float) -> bool:
+        """Records a score; returns True if the candidate has just been aborted."""
+        with self._lock:
+            self._scores.setdefault(candidate_id, []).append(float(score))
+            if not self.active or candidate_id in self.aborted:
+                return False
+            bound = self._upper_bound(candidate_id)
+            if bound is not None and bound < self.threshold:
+                self.aborted[candidate_id] = bound
+                return True
+            return False
+
+    def check(self, candidate_id: str) -> bool:
+        """Re-evaluates the abort rule; used at rung boundaries by the batched evaluator."""
+        with self._lock:
+            if not self.active or candidate_id in self.aborted:
+                return candidate_id in self.aborted
+            bound = self._upper_bound(candidate_id)
+            if bound is not None and bound < self.threshold:
+                self.aborted[candidate_id] = bound
+                return True
+            return False
+
+    def is_aborted(self, candidate_id: str) -> bool:
+        with self._lock:
+            return candidate_id in self.aborted
+
+    def _upper_bound(self, candidate_id: str) -> Optional[float]:
+        scores = self._scores.get(candidate_id, [])
+        n = len(scores)
+        if n < self.min_articles:
+            return None
+        mean = sum(scores) / n
+        variance = sum((s - mean) ** 2 for s in scores) / (n - 1) if n > 1 else 0.0
+        std = max(math.sqrt(variance), self.min_std)
+        return mean + self.z * std / math.sqrt(n)
+
+    def stats(self, candidate_id: str) -> tuple:
+        """(n, mean) of the scores recorded for a candidate."""
+        with self._lock:
+            scores = self._scores.get(candidate_id, [])
+            return len(scores), (sum(scores) / len(scores) if scores else 0.0)
+
+
+class Speculation:
+    """
+    Runs `propose` on a background thread while the caller does something else, then
+    `follow_up(result)` on the same thread unless the speculation was discarded first.
+    The caller either takes the result() or discard()s it; requests already in flight cannot be
+    recalled, so discard() waits for them rather than letting them outlive the caller.
+    """
+
+    def __init__(self, propose: Callable[[], object], follow_up: Optional[Callable[[object], None]] = None):
+        self.discarded = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculative")
+        self._proposal = executor.submit(propose)
+        self._follow_up = executor.submit(self._run_follow_up, follow_up) if follow_up is not None else None
+        executor.shutdown(wait=False)
+
+    def _run_follow_up(self, follow_up: Callable[[object], None]):
+        if self._proposal.exception() is None and not self.discarded.is_set():
+            follow_up(self._proposal.result())
+
+    def result(self):
+        return self._proposal.result()
+
+    def wait(self):
+        """Blocks until the follow-up has finished (or was skipped)."""
+        if self._follow_up is not None:
+            self._follow_up.result()
+
+    def discard(self):
+        self.discarded.set()
+        self._proposal.exception()
+        self.wait()
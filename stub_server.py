@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Minimal OpenAI-compatible server for exercising the providers without a real model.
+
+Answers /v1/chat/completions with a canned response after an injected delay. When the
+request carries a json_schema response_format, the reply is a small instance of that
+schema, so the evaluation loop can run end-to-end against it. With echo, free-text requests are
+answered with their last message, so callers can check that replies come back in order.
+
+    python stub_server.py --port 1234 --latency 0.5 --jitter 0.2
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+def example_from_schema(schema: Optional[dict], rng: Optional[random.Random] = None):
+    """Builds a minimal value that satisfies the given JSON schema; numbers vary if an rng is given."""
+    if not schema:
+        return "Stub response."
+    if "enum" in schema:
+        return schema["enum"][0]
+    schema_type = schema.get("type", "object")
+    if schema_type == "object":
+        return {name: example_from_schema(prop, rng) for name, prop in schema.get("properties", {}).items()}
+    if schema_type == "array":
+        return [example_from_schema(schema.get("items", {}), rng) for _ in range(max(1, schema.get("minItems", 1)))]
+    if schema_type == "integer":
+        return rng.randint(4, 10) if rng else 7
+    if schema_type == "number":
+        return round(rng.uniform(4, 10), 2) if rng else 7.0
+    if schema_type == "boolean":
+        return False
+    return "stub"
+
+
+class StubState:
+    def __init__(self, latency: float, jitter: float, failure_rate: float, seed: int, echo: bool = False):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.echo = echo
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_requests = 0
+        self.failures = 0
+
+    def enter(self) -> tuple:
+        """Registers a request; returns (delay, request_number), with delay -1 for an injected failure."""
+        with self.lock:
+            self.in_flight += 1
+            self.total_requests += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            fail = self.rng.random() < self.failure_rate
+            self.failures += fail
+            return (delay if not fail else -1.0), self.total_requests
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def make_handler(state: StubState):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload: dict):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+            elif self.path.rstrip("/").endswith("/stats"):
+                with state.lock:
+                    self._send_json(200, {
+                        "total_requests": state.total_requests,
+                        "in_flight": state.in_flight,
+                        "max_in_flight": state.max_in_flight,
+                        "failures": state.failures
+                    })
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            delay, request_number = state.enter()
+            try:
+                if delay < 0:
+                    self._send_json(500, {"error": {"message": "injected failure"}})
+                    return
+                time.sleep(delay)
+
+                schema = (request.get("response_format") or {}).get("json_schema", {}).get("schema")
+                content = example_from_schema(schema)
+                if not isinstance(content, str):
+                    content = json.dumps(content)
+                elif state.echo and request.get("messages"):
+                    content = str(request["messages"][-1].get("content", ""))
+                elif request.get("temperature", 0) > 0.1:
+                    # Sampled free-text replies differ per request, like a real model's would
+                    content = f"Stub response #{request_number}."
+                prompt_chars = sum(len(str(m.get("content", ""))) for m in request.get("messages", []))
+                self._send_json(200, {
+                    "id": f"chatcmpl-stub-{request_number}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "stub-model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_chars // 4,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": prompt_chars // 4 + len(content) // 4
+                    }
+                })
+            finally:
+                state.leave()
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(host: str = "127.0.0.1", port: int = 1234, latency: float = 0.5, jitter: float = 0.0, failure_rate: float = 0.0, seed: int = 0,
+          echo: bool = False) -> ThreadingHTTPServer:
+    """Starts the stub server on a background thread and returns it (call .shutdown() to stop); port 0 picks a free port."""
+    state = StubState(latency, jitter, failure_rate, seed, echo)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible server with injected latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds to wait before answering each request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter added to the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--echo", action="store_true", help="Answer free-text requests with their last message")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.seed, args.echo)
+    print(f"Stub server listening on http://{args.host}:{args.port}/v1 (latency {args.latency}s)")
+    try:
+        while True:
+            time.sleep(5)
+            state = server.state
+            print(f"requests={state.total_requests} in_flight={state.in_flight} max_in_flight={state.max_in_flight}")
+    except KeyboardInterrupt:
+        server.shutdown()
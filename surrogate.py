@@ -0,0 +1,348 @@
+"""
+Local surrogate for the teacher's grades.
+
+SurrogateScorer is a small online regression over hashed features of a student output and its
+article: word unigrams and bigrams of the extracted values, words that do not occur in the
+article, and a few dense signals (valid JSON, number of events, share of grounded words, length).
+It runs on the CPU in pure Python and learns from every teacher grade as it arrives.
+
+An ensemble of linear models, each trained on an online bootstrap of the grades (AdaGrad on
+squared error), gives both the estimate (their mean) and its uncertainty (their spread). An
+output is graded locally only when the surrogate is trusted and its members agree within
+max_spread; everything else goes to the teacher.
+
+Trust is earned and lost on agreement with the teacher: each teacher-graded output that the
+surrogate would have graded itself is a check, and it counts as agreeing when the estimate was
+within `tolerance` of the teacher's score. The surrogate is trusted while at least
+min_agreement of the last `window` checks agree. A share of confident outputs (audit_rate)
+still goes to the teacher so agreement keeps being measured; when it drops, every output goes
+to the teacher again until agreement recovers.
+
+Outputs the teacher has graded before (e.g. cache hits of an unchanged prompt) are neither
+trained on again nor counted as checks, so repeats cannot inflate the agreement.
+
+The weights can be saved between runs (`path`); they are only reused for the same teacher model.
+Sessions of a sweep may share the file: a save takes a lock on it, and if another session saved
+since this one last read it, the file's weights plus what this session learned since then are
+written, so neither session's training is lost.
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import uuid
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from models import get_console
+
+try:
+    import fcntl
+except ImportError: # not on Windows; saves are then unlocked
+    fcntl = None
+
+SURROGATE_CRITIQUE = "(estimated by the surrogate scorer; no teacher critique)"
+
+MIN_SCORE = 0.0
+MAX_SCORE = 10.0
+HASH_BITS = 20
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _json_strings(value) -> List[str]:
+    """Every string value (not key) in a parsed JSON document, in order."""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [s for v in value.values() for s in _json_strings(v)]
+    if isinstance(value, list):
+        return [s for v in value for s in _json_strings(v)]
+    return []
+
+
+def extract_features(article: str, output: str) -> Tuple[Dict[str, float], Dict[str, float]]:
+    """(sparse, dense) features of one output: L2-normalized hashed-name counts and signals in [0, 1]."""
+    try:
+        parsed = json.loads(output)
+        valid = True
+    except ValueError:
+        parsed = None
+        valid = False
+    words = _words(" ".join(_json_strings(parsed))) if valid else _words(output)
+    article_words = set(_words(article))
+
+    counts: Dict[str, float] = {}
+    for n, word in enumerate(words):
+        counts["w:" + word] = counts.get("w:" + word, 0.0) + 1.0
+        if n:
+            bigram = "b:" + words[n - 1] + " " + word
+            counts[bigram] = counts.get(bigram, 0.0) + 1.0
+        if word not in article_words:
+            counts["u:" + word] = counts.get("u:" + word, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    sparse = {name: value / norm for name, value in counts.items()}
+
+    events = parsed.get("events") if isinstance(parsed, dict) else parsed if isinstance(parsed, list) else None
+    grounded = sum(1 for word in words if word in article_words)
+    dense = {
+        "d:bias": 1.0,
+        "d:valid_json": 1.0 if valid else 0.0,
+        "d:events": min(len(events), 10) / 10 if isinstance(events, list) else 0.0,
+        "d:no_events": 1.0 if isinstance(events, list) and not events else 0.0,
+        "d:grounded": grounded / len(words) if words else 0.0,
+        "d:length": min(math.log1p(len(output)) / 10, 1.0),
+    }
+    return sparse, dense
+
+
+class _Member:
+    """One linear model of the ensemble; its own hash salt gives it its own feature collisions."""
+    def __init__(self, salt: int, bits: int, weights: Optional[Dict[int, float]] = None,
+                 squares: Optional[Dict[int, float]] = None):
+        self.salt = salt
+        self.mask = (1 << bits) - 1
+        self.weights: Dict[int, float] = weights or {}
+        self.squares: Dict[int, float] = squares or {} # AdaGrad: sum of squared gradients per weight
+
+    def index(self, name: str) -> int:
+        return zlib.crc32(name.encode("utf-8"), self.salt) & self.mask
+
+    def vector(self, features: Dict[str, float]) -> Dict[int, float]:
+        vector: Dict[int, float] = {}
+        for name, value in features.items():
+            index = self.index(name)
+            vector[index] = vector.get(index, 0.0) + value
+        return vector
+
+    def predict(self, vector: Dict[int, float]) -> float:
+        return sum(self.weights.get(index, 0.0) * value for index, value in vector.items())
+
+    def train(self, vector: Dict[int, float], target: float, learning_rate: float):
+        error = self.predict(vector) - target
+        for index, value in vector.items():
+            gradient = error * value
+            squares = self.squares.get(index, 0.0) + gradient * gradient
+            self.squares[index] = squares
+            if squares:
+                self.weights[index] = self.weights.get(index, 0.0) - learning_rate * gradient / math.sqrt(squares)
+
+
+class SurrogateScorer:
+    def __init__(self, teacher_model: str = "", members: int = 5, learning_rate: float = 0.5,
+                 tolerance: float = 1.0, max_spread: float = 0.75, min_samples: int = 50, min_checks: int = 20,
+                 min_agreement: float = 0.8, window: int = 50, audit_rate: float = 0.1, max_seen: int = 100000,
+                 path: Optional[str] = None, seed: int = 0):
+        self.teacher_model = teacher_model
+        self.learning_rate = learning_rate
+        self.tolerance = tolerance
+        self.max_spread = max_spread
+        self.min_samples = min_samples
+        self.min_checks = min_checks
+        self.min_agreement = min_agreement
+        self.audit_rate = audit_rate
+        self.max_seen = max_seen
+        self.path = Path(path) if path else None
+        self.members = [_Member(salt, HASH_BITS) for salt in range(members)]
+        self.samples = 0 # teacher grades trained on, including those of earlier runs
+        self.checks: deque = deque(maxlen=window) # (agreed, absolute error) per check
+        self.trusted = False
+        self.seen: Dict[str, None] = {} # digests of the latest max_seen (article, output) pairs trained on, oldest first
+        self.stats = {"estimated": 0, "audited": 0, "uncertain": 0, "untrusted": 0, "trained": 0, "repeats": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._revision: Optional[str] = None # of the saved file this session last read or wrote
+        self._base: Optional[Dict] = None # the weights as of that revision
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    @classmethod
+    def from_config(cls, section: Optional[Dict], teacher_model: str) -> Optional["SurrogateScorer"]:
+        """None unless the "surrogate" config section is enabled."""
+        section = section or {}
+        if not section.get("enabled", False):
+            return None
+        return cls(teacher_model, **{k: v for k, v in section.items() if k != "enabled"})
+
+    def predict(self, article: str, output: str) -> Tuple[float, float]:
+        """(estimate, spread): mean and standard deviation of the members' predictions."""
+        sparse, dense = extract_features(article, output)
+        features = {**sparse, **dense}
+        predictions = [member.predict(member.vector(features)) for member in self.members]
+        mean = sum(predictions) / len(predictions)
+        spread = math.sqrt(sum((p - mean) ** 2 for p in predictions) / len(predictions))
+        return min(MAX_SCORE, max(MIN_SCORE, mean)), spread
+
+    def estimate(self, article: str, output: str) -> Optional[float]:
+        """The surrogate's grade if it may replace the teacher's for this output, else None."""
+        with self._lock:
+            if not self.trusted:
+                self.stats["untrusted"] += 1
+                return None
+            score, spread = self.predict(article, output)
+            if spread > self.max_spread:
+                self.stats["uncertain"] += 1
+                return None
+            if self._rng.random() < self.audit_rate:
+                self.stats["audited"] += 1
+                return None
+            self.stats["estimated"] += 1
+            return round(score, 1)
+
+    def observe(self, article: str, output: str, score: float):
+        """Checks the estimate for a teacher-graded output against the teacher's score, then trains on it."""
+        digest = hashlib.sha256(f"{article}\x1f{output}".encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            if digest in self.seen:
+                self.stats["repeats"] += 1
+                return
+            self.seen[digest] = None
+            if len(self.seen) > self.max_seen:
+                del self.seen[next(iter(self.seen))]
+        sparse, dense = extract_features(article, output)
+        features = {**sparse, **dense}
+        with self._lock:
+            vectors = [member.vector(features) for member in self.members]
+            if self.samples >= self.min_samples:
+                predictions = [member.predict(vector) for member, vector in zip(self.members, vectors)]
+                mean = sum(predictions) / len(predictions)
+                spread = math.sqrt(sum((p - mean) ** 2 for p in predictions) / len(predictions))
+                if spread <= self.max_spread:
+                    error = abs(min(MAX_SCORE, max(MIN_SCORE, mean)) - score)
+                    self.checks.append((error <= self.tolerance, error))
+                    self._update_trust()
+            # Online bootstrap: each member sees the grade Poisson(1) times
+            for member, vector in zip(self.members, vectors):
+                for _ in range(self._poisson()):
+                    member.train(vector, score, self.learning_rate)
+            self.samples += 1
+            self.stats["trained"] += 1
+
+    def _poisson(self) -> int:
+        threshold, count, product = math.exp(-1.0), 0, self._rng.random()
+        while product > threshold:
+            count += 1
+            product *= self._rng.random()
+        return count
+
+    def agreement(self) -> Optional[float]:
+        if not self.checks:
+            return None
+        return sum(1 for agreed, _ in self.checks if agreed) / len(self.checks)
+
+    def mean_error(self) -> Optional[float]:
+        if not self.checks:
+            return None
+        return sum(error for _, error in self.checks) / len(self.checks)
+
+    def _update_trust(self):
+        agreement = self.agreement()
+        trusted = len(self.checks) >= self.min_checks and agreement >= self.min_agreement
+        if trusted != self.trusted:
+            self.trusted = trusted
+            if trusted:
+                get_console().print(f"[green]Surrogate: {agreement * 100:.0f}% agreement with the Teacher over {len(self.checks)} checks; grading confident outputs locally[/green]")
+            else:
+                get_console().print(f"[yellow]Surrogate: agreement with the Teacher fell to {agreement * 100:.0f}%; sending every output to the Teacher[/yellow]")
+
+    def save(self):
+        """Writes the weights to `path`; called at every checkpoint and at the end of a run."""
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._file_lock():
+            on_disk = self._read_state()
+            with self._lock:
+                # Serialized under the lock: teacher workers keep training while the file is written
+                if on_disk is not None and on_disk.get("revision") != self._revision:
+                    self._merge(on_disk)
+                self._revision = uuid.uuid4().hex
+                self._base = self._snapshot()
+                state = json.dumps({
+                    "teacher_model": self.teacher_model,
+                    "hash_bits": HASH_BITS,
+                    "revision": self._revision,
+                    "seen": list(self.seen),
+                    **self._base,
+                })
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(state)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def load(self):
+        """Restores weights saved by an earlier run with the same teacher model and ensemble size."""
+        with self._file_lock():
+            state = self._read_state()
+        if state is None:
+            return
+        with self._lock:
+            self._restore(state)
+            self.seen = dict.fromkeys(state.get("seen", [])[-self.max_seen:])
+            self._revision = state.get("revision")
+            self._base = self._snapshot()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.path.with_name(self.path.name + ".lock"), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read_state(self) -> Optional[Dict]:
+        """The saved state, or None if there is none or it belongs to another teacher or ensemble."""
+        if not self.path.exists():
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if (state.get("teacher_model") != self.teacher_model or state.get("hash_bits") != HASH_BITS
+                or len(state.get("members", [])) != len(self.members)):
+            return None
+        return state
+
+    def _snapshot(self) -> Dict:
+        return {
+            "samples": self.samples,
+            "members": [{"salt": m.salt, "weights": dict(m.weights), "squares": dict(m.squares)} for m in self.members],
+        }
+
+    def _restore(self, state: Dict):
+        self.members = [
+            _Member(m["salt"], HASH_BITS, {int(k): v for k, v in m["weights"].items()}, {int(k): v for k, v in m["squares"].items()})
+            for m in state["members"]
+        ]
+        self.samples = state.get("samples", 0)
+
+    def _merge(self, on_disk: Dict):
+        """Adds what this session learned since its last read or write to the weights another session saved."""
+        base = self._base or {"samples": 0, "members": [{"weights": {}, "squares": {}} for _ in self.members]}
+        learned = self._snapshot()
+        self._restore(on_disk)
+        for member, mine, before in zip(self.members, learned["members"], base["members"]):
+            for name in ("weights", "squares"):
+                merged, own, old = getattr(member, name), mine[name], before[name]
+                for index in own.keys() | old.keys():
+                    delta = own.get(index, 0.0) - old.get(index, 0.0)
+                    if delta:
+                        merged[index] = merged.get(index, 0.0) + delta
+        self.samples += learned["samples"] - base["samples"]
+        for digest in on_disk.get("seen", []):
+            self.seen.setdefault(digest, None)
+        while len(self.seen) > self.max_seen:
+            del self.seen[next(iter(self.seen))]
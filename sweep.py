@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Runs several optimization sessions concurrently and ranks them.
+
+A sweep file lists config overrides on top of config.json, either as a grid (every
+combination of the listed values) or as explicit runs, or both:
+
+    {
+      "base": {"max_iterations": 5},
+      "grid": {"population_size": [1, 4], "context_budget.enabled": [true, false]},
+      "runs": [{"name": "packed", "teacher_pack_size": 4}]
+    }
+
+Dotted keys set a field inside a config section. Sessions with the same provider settings
+share one provider, so they also share its request concurrency limit (max_concurrency) and
+completion cache. Each session writes to its own directory under
+optimization_runs/sweep_<timestamp>/, and the sweep directory gets leaderboard.json/.csv.
+
+    python sweep.py sweep.json --workers 4
+"""
+
+import argparse
+import copy
+import csv
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from itertools import product
+from pathlib import Path
+from typing import Dict, List
+
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
+
+from evaluate import OptimizationSession, load_config
+from models import ModelProvider, get_provider
+
+# Config keys that select or configure the provider; sessions agreeing on all of them share one
+PROVIDER_KEYS = [
+    "mock", "use_mlx", "base_url", "api_key", "max_concurrency",
+    "mlx_prefix_cache", "mlx_prefix_cache_min_tokens", "mlx_memory_budget_gb", "mlx_prewarm",
+    "mlx_constrained_decoding", "mlx_batch_token_budget", "mlx_max_batch_size", "generation_limits", "routing",
+    "cache_enabled", "cache_path", "cache_max_mb", "cache_policy", "cache_max_temperature",
+]
+
+console = Console()
+
+
+def apply_override(config: Dict, key: str, value):
+    """Sets `key` in `config`; "section.field" sets a field inside a config section."""
+    if "." not in key:
+        config[key] = value
+        return
+    section, field = key.split(".", 1)
+    config[section] = dict(config.get(section) or {})
+    apply_override(config[section], field, value)
+
+
+def run_name(overrides: Dict) -> str:
+    name = "_".join(f"{key.rsplit('.', 1)[-1]}-{value}" for key, value in overrides.items()) or "base"
+    return re.sub(r"[^A-Za-z0-9_.=-]+", "", name)[:80]
+
+
+def expand_sweep(spec: Dict, base_config: Dict) -> List[Dict]:
+    """[{"name", "overrides", "config"}] for every grid combination and explicit run."""
+    base = copy.deepcopy(base_config)
+    for key, value in (spec.get("base") or {}).items():
+        apply_override(base, key, value)
+
+    variants = []
+    grid = spec.get("grid") or {}
+    if grid:
+        keys = list(grid)
+        variants.extend(dict(zip(keys, values)) for values in product(*(grid[k] for k in keys)))
+    variants.extend(dict(run) for run in spec.get("runs") or [])
+    if not variants:
+        variants.append({})
+
+    sessions = []
+    for n, overrides in enumerate(variants, start=1):
+        name = overrides.pop("name", None) or run_name(overrides)
+        config = copy.deepcopy(base)
+        for key, value in overrides.items():
+            apply_override(config, key, value)
+        sessions.append({"name": f"{n:02d}_{name}", "overrides": overrides, "config": config})
+    return sessions
+
+
+def provider_key(config: Dict) -> str:
+    return json.dumps({k: config.get(k) for k in PROVIDER_KEYS}, sort_keys=True, default=str)
+
+
+def shared_providers(sessions: List[Dict]) -> Dict[str, ModelProvider]:
+    """One provider per distinct provider configuration; each session adds its own tracing on top."""
+    providers = {}
+    for session in sessions:
+        key = provider_key(session["config"])
+        if key not in providers:
+            providers[key] = get_provider(session["config"])
+    return providers
+
+
+def run_session(session: Dict, provider: ModelProvider, run_dir: Path) -> Dict:
+    run_dir.mkdir(parents=True, exist_ok=True)
+    with open(run_dir / "console.log", 'w', encoding='utf-8') as log:
+        optimizer = OptimizationSession(session["config"], provider=provider, run_dir=run_dir,
+                                        console=Console(file=log, width=120, soft_wrap=True))
+        return optimizer.run()
+
+
+def describe_overrides(overrides: Dict) -> str:
+    return ", ".join(f"{key}={json.dumps(value)}" for key, value in overrides.items()) or "(base)"
+
+
+def write_leaderboard(sweep_dir: Path, rows: List[Dict]):
+    with open(sweep_dir / "leaderboard.json", 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2)
+    columns = ["rank", "name", "status", "best_score", "iterations", "requests", "elapsed_s", "overrides", "run_dir", "error"]
+    with open(sweep_dir / "leaderboard.csv", 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, overrides=json.dumps(row["overrides"])))
+
+
+def print_leaderboard(rows: List[Dict]):
+    table = Table(title="Sweep Leaderboard")
+    for column in ["#", "Run", "Best score", "Iterations", "Requests", "Elapsed s", "Overrides"]:
+        table.add_column(column, justify="left" if column in ("Run", "Overrides") else "right")
+    for row in rows:
+        if row["status"] != "ok":
+            table.add_row("-", escape(row["name"]), f"[red]{row['status']}[/red]", "-", "-", "-", escape(describe_overrides(row["overrides"])))
+            continue
+        table.add_row(
+            str(row["rank"]), escape(row["name"]), f"{row['best_score']:.2f}", str(row["iterations"]),
+            str(row["requests"]), f"{row['elapsed_s']:.1f}", escape(describe_overrides(row["overrides"]))
+        )
+    console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run optimization sessions with different configs side by side.")
+    parser.add_argument("sweep", type=Path, help="JSON file with base/grid/runs overrides")
+    parser.add_argument("--config", type=Path, default=Path("config.json"), help="Base config (default: config.json)")
+    parser.add_argument("--workers", type=int, default=4, help="Sessions running at the same time")
+    parser.add_argument("--out", type=Path, default=Path("optimization_runs"), help="Parent directory of the sweep directory")
+    parser.add_argument("--dry-run", action="store_true", help="Print the expanded sessions and exit")
+    args = parser.parse_args()
+
+    with open(args.sweep, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    sessions = expand_sweep(spec, load_config(args.config))
+    if args.dry_run:
+        for session in sessions:
+            console.print(f"{escape(session['name'])}: {escape(describe_overrides(session['overrides']))}")
+        return
+
+    sweep_dir = args.out / f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    with open(sweep_dir / "sweep.json", 'w', encoding='utf-8') as f:
+        json.dump({"spec": spec, "sessions": sessions}, f, indent=2)
+
+    providers = shared_providers(sessions)
+    console.print(f"Sweep: [bold]{len(sessions)}[/bold] sessions, {len(providers)} provider(s), {args.workers} at a time -> [bold]{sweep_dir}[/bold]")
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="session") as executor:
+        futures = {
+            executor.submit(run_session, session, providers[provider_key(session["config"])], sweep_dir / session["name"]): session
+            for session in sessions
+        }
+        for future in as_completed(futures):
+            session = futures[future]
+            row = {"name": session["name"], "overrides": session["overrides"], "run_dir": str(sweep_dir / session["name"])}
+            try:
+                result = future.result()
+            except Exception as e:
+                row.update(status="failed", error=repr(e))
+                console.print(f"[red]{escape(session['name'])} failed: {escape(repr(e))}[/red]")
+            else:
+                if result is None:
+                    row.update(status="not started", error="see console.log")
+                    console.print(f"[yellow]{escape(session['name'])} did not start; see its console.log[/yellow]")
+                else:
+                    row.update(status="ok", **{k: result[k] for k in ("best_score", "iterations", "requests", "elapsed_s")})
+                    console.print(f"{escape(session['name'])}: best score [bold cyan]{result['best_score']:.2f}[/bold cyan] after {result['iterations']} iteration(s)")
+            rows.append(row)
+
+    ranked = sorted((r for r in rows if r["status"] == "ok"), key=lambda r: r["best_score"], reverse=True)
+    for rank, row in enumerate(ranked, start=1):
+        row["rank"] = rank
+    rows = ranked + sorted((r for r in rows if r["status"] != "ok"), key=lambda r: r["name"])
+    write_leaderboard(sweep_dir, rows)
+    print_leaderboard(rows)
+    console.print(f"Leaderboard written to [bold]{sweep_dir / 'leaderboard.json'}[/bold] and [bold]{sweep_dir / 'leaderboard.csv'}[/bold]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+from itertools import islice
+
+from scheduling import EarlyAbortTracker, iter_sized_chunks, rung_sizes
+
+
+def test_rung_sizes_grow_by_eta_and_respect_chunk_cap():
+    assert list(islice(rung_sizes(8, 2, 10), 6)) == [8, 8, 10, 6, 10, 10]
+
+
+def test_iter_sized_chunks_stops_when_items_run_out():
+    assert list(iter_sized_chunks(range(10), iter([3, 3, 3, 3, 3]))) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+
+
+def test_tracker_aborts_once_upper_bound_is_below_threshold():
+    tracker = EarlyAbortTracker(8.0, min_articles=4, min_std=0.5)
+    assert [tracker.add("a", 2) for _ in range(4)] == [False, False, False, True]
+    assert tracker.is_aborted("a")
+    assert tracker.stats("a") == (4, 2.0)
+    # Already aborted: further scores do not abort it again
+    assert not tracker.add("a", 2)
+
+
+def test_tracker_keeps_candidates_that_can_still_reach_threshold():
+    tracker = EarlyAbortTracker(8.0, min_articles=4, min_std=1.0)
+    for score in (9, 7, 8, 9):
+        tracker.add("b", score)
+    assert not tracker.check("b")
+    assert not tracker.is_aborted("b")
+
+
+def test_tracker_without_threshold_never_aborts():
+    tracker = EarlyAbortTracker(None)
+    assert not tracker.active
+    assert not any(tracker.add("a", 0) for _ in range(20))
+    assert not tracker.check("a")
@@ -0,0 +1,7 @@
+from benchmark import IMPORT_BUDGET_MS, check_import_budget
+
+
+def test_evaluate_imports_within_budget_without_backends():
+    result = check_import_budget(IMPORT_BUDGET_MS)
+    assert result["heavy_modules"] == []
+    assert result["ok"], result
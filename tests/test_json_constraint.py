@@ -0,0 +1,78 @@
+import json
+import random
+
+import pytest
+
+from json_constraint import SchemaAutomaton, TokenConstraint, UnsupportedSchema, _demo_vocabulary, compile_schema, sample_document
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "events": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "event": {"type": "string"},
+                    "severity": {"type": "string", "enum": ["High", "Low"]},
+                    "count": {"type": "integer"},
+                },
+                "required": ["event", "severity"],
+            },
+        }
+    },
+    "required": ["events"],
+}
+
+
+def accepts(automaton: SchemaAutomaton, text: str) -> bool:
+    return automaton.is_complete(automaton.advance(automaton.initial, text))
+
+
+@pytest.mark.parametrize("text", [
+    '{"events":[]}',
+    '{"events":[{"event":"x","severity":"High"}]}',
+    '{"events":[{"event":"x","severity":"Low","count":-3},{"event":"","severity":"High"}]}',
+])
+def test_accepts_valid_documents(text):
+    assert accepts(compile_schema(SCHEMA), text)
+
+
+@pytest.mark.parametrize("text", [
+    '{"events":[{"event":"x","severity":"Mid"}]}',  # not in the enum
+    '{"events":[{"event":"x"}]}',  # missing required field
+    '{"events":[{"severity":"High","event":"x"}]}',  # properties out of schema order
+    '{"events":[{"event":"x","severity":"High","other":1}]}',  # unknown key
+    '{"events":[{"event":"x","severity":"High","count":1.5}]}',  # not an integer
+    '{"events": []}',  # insignificant whitespace
+])
+def test_rejects_invalid_documents(text):
+    assert not accepts(compile_schema(SCHEMA), text)
+
+
+def test_prefix_is_live_but_incomplete():
+    automaton = compile_schema(SCHEMA)
+    state = automaton.advance(automaton.initial, '{"events":[{"event":"x"')
+    assert state is not None
+    assert not automaton.is_complete(state)
+
+
+def test_unsupported_construct_raises():
+    with pytest.raises(UnsupportedSchema):
+        SchemaAutomaton({"$ref": "#/definitions/event"})
+
+
+def test_complete_document_only_allows_end_of_sequence():
+    constraint = TokenConstraint(compile_schema(SCHEMA), _demo_vocabulary())
+    state = constraint.automaton.advance(constraint.initial, '{"events":[]}')
+    assert constraint.allowed(state) == constraint.vocabulary.eos_ids
+
+
+def test_sampled_documents_are_valid():
+    constraint = TokenConstraint(compile_schema(SCHEMA), _demo_vocabulary())
+    rng = random.Random(0)
+    for _ in range(20):
+        document = sample_document(constraint, rng)
+        assert document is not None
+        parsed = json.loads(document)
+        assert all(event["severity"] in ("High", "Low") for event in parsed["events"])
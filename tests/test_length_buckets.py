@@ -0,0 +1,13 @@
+from scheduling import length_buckets
+
+
+def test_length_buckets_respect_padded_token_budget():
+    assert length_buckets([5, 100, 6, 90], 300, reserve=10) == [[0, 2, 3], [1]]
+    assert length_buckets([1, 2], None) == [[0, 1]]
+
+
+def test_length_buckets_cap_batch_size_and_isolate_oversized_prompts():
+    assert length_buckets([3, 1, 2, 4, 5], None, max_batch=2) == [[1, 2], [0, 3], [4]]
+    # A prompt over the budget on its own still gets a batch
+    assert length_buckets([10, 500, 20], 100) == [[0, 2], [1]]
+    assert length_buckets([], 100) == []
@@ -0,0 +1,24 @@
+import pytest
+
+from models import OpenAIProvider
+from stub_server import serve
+
+
+@pytest.fixture
+def stub():
+    server = serve(port=0, latency=0.05, jitter=0.04, failure_rate=0.25, seed=3, echo=True)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_batch_keeps_order_and_returns_none_for_failures(stub):
+    provider = OpenAIProvider(f"http://127.0.0.1:{stub.server_address[1]}/v1", "stub", max_concurrency=8, max_retries=0)
+    messages_list = [[{"role": "user", "content": f"item {n}"}] for n in range(40)]
+
+    outputs = provider.get_batch_completion("stub-model", messages_list, temperature=0.0)
+
+    assert len(outputs) == len(messages_list)
+    assert all(output == f"item {n}" for n, output in enumerate(outputs) if output is not None)
+    assert outputs.count(None) == stub.state.failures > 0
+    assert stub.state.max_in_flight > 1
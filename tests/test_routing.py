@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from profiling import phase
+from routing import build_routing_provider
+from stub_server import serve
+
+CONFIG = {"base_url": "http://127.0.0.1:1/v1", "api_key": "stub"}
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(port=0, **kwargs):
+        server = serve(port=port, latency=kwargs.pop("latency", 0.02), echo=True, **kwargs)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def url(server) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def batch(n: int):
+    return [[{"role": "user", "content": f"item {i}"}] for i in range(n)]
+
+
+def wait_until(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_requests_are_routed_by_phase(servers):
+    student, teacher = servers(), servers()
+    router = build_routing_provider(CONFIG, {
+        "student": [{"base_url": url(student)}], "teacher": [{"base_url": url(teacher)}], "health_check_interval_s": 0,
+    })
+
+    with phase("student"):
+        assert router.get_batch_completion("same-model", batch(3), temperature=0.0) == ["item 0", "item 1", "item 2"]
+    assert (student.state.total_requests, teacher.state.total_requests) == (3, 0)
+
+    with phase("meta_eval"):
+        router.get_batch_completion("same-model", batch(2), temperature=0.0)
+    assert (student.state.total_requests, teacher.state.total_requests) == (3, 2)
+
+
+def test_items_go_to_the_least_loaded_endpoint(servers):
+    small, large = servers(), servers()
+    router = build_routing_provider(CONFIG, {
+        "teacher": [{"base_url": url(small), "max_concurrency": 1}, {"base_url": url(large), "max_concurrency": 3}],
+        "health_check_interval_s": 0,
+    })
+
+    outputs = router.get_batch_completion("teacher-model", batch(8), temperature=0.0)
+
+    assert outputs == [f"item {i}" for i in range(8)]
+    # Outstanding requests per unit of concurrency: 2 of 8 items on the single-slot endpoint
+    assert (small.state.total_requests, large.state.total_requests) == (2, 6)
+
+
+def test_failing_endpoint_backs_off_and_its_items_are_retried(servers):
+    failing, healthy = servers(failure_rate=1.0), servers()
+    router = build_routing_provider(CONFIG, {
+        "teacher": [{"base_url": url(failing)}, {"base_url": url(healthy)}],
+        "backoff_s": 60.0, "health_check_interval_s": 0,
+    })
+
+    assert router.get_batch_completion("teacher-model", batch(4), temperature=0.0) == [f"item {i}" for i in range(4)]
+    stats = {row["endpoint"]: row for row in router.stats()}
+    failing_stats = next(row for name, row in stats.items() if url(failing) in name)
+    assert failing_stats["backoffs"] == 1 and failing_stats["backing_off"]
+
+    # While it backs off, every item goes to the healthy endpoint
+    sent = failing.state.total_requests
+    router.get_batch_completion("teacher-model", batch(4), temperature=0.0)
+    assert failing.state.total_requests == sent
+
+
+def test_health_check_brings_an_unreachable_endpoint_back(servers):
+    flaky, steady = servers(), servers()
+    port = flaky.server_address[1]
+    router = build_routing_provider(CONFIG, {
+        "teacher": [{"base_url": url(flaky)}, {"base_url": url(steady)}],
+        "backoff_s": 60.0, "health_check_interval_s": 0.05, "health_check_timeout_s": 0.5,
+    })
+    endpoint = router.teacher.endpoints[0]
+    router.get_batch_completion("teacher-model", batch(1), temperature=0.0) # starts the health check
+
+    flaky.shutdown()
+    flaky.server_close()
+    assert wait_until(lambda: endpoint.unreachable and not endpoint.available(time.monotonic()))
+
+    # Back long before the 60 s backoff would expire
+    servers(port=port)
+    assert wait_until(lambda: not endpoint.unreachable and endpoint.available(time.monotonic()))
+    assert endpoint.stats["health_checks_failed"] >= 1
@@ -0,0 +1,94 @@
+import json
+import sqlite3
+
+from pregrade import PREGRADE_MARKER
+from run_index import FINGERPRINT_FILE, INDEX_VERSION, RunIndex
+from runstore import open_run_store
+from surrogate import SURROGATE_CRITIQUE
+
+SCHEMA = {"type": "object", "properties": {"events": {"type": "array"}}}
+
+
+def make_run(root, name, grades, fingerprint="corpus-a", student_model="student", backend="sqlite"):
+    """A run directory whose log holds `grades`: {(iteration, candidate_id, prompt): [(score, critique), ...]}."""
+    run_dir = root / name
+    run_dir.mkdir(parents=True)
+    (run_dir / "config_used.json").write_text(json.dumps({"student_model": student_model, "starting_schema": SCHEMA}))
+    if fingerprint is not None:
+        (run_dir / FINGERPRINT_FILE).write_text(fingerprint)
+    store = open_run_store(run_dir, backend)
+    for (iteration, candidate_id, prompt), rows in grades.items():
+        for n, (score, critique) in enumerate(rows):
+            store.log(iteration, f"a{n}", "{}", score, critique, prompt, candidate_id, SCHEMA)
+    store.close()
+    return run_dir
+
+
+def test_index_from_another_version_is_rebuilt(tmp_path):
+    path = tmp_path / "index.sqlite"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE runs (run_dir TEXT PRIMARY KEY, signature TEXT);
+        INSERT INTO runs VALUES ('old_run', 'stale');
+        PRAGMA user_version = 1;
+    """)
+    conn.close()
+
+    index = RunIndex(path)
+    assert index._conn.execute("PRAGMA user_version").fetchone()[0] == INDEX_VERSION
+    assert index._conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0
+    # The stale signature is gone, so runs are scanned again
+    make_run(tmp_path / "runs", "run_1", {(1, "1", "prompt"): [(7, "ok")]})
+    assert index.update(tmp_path / "runs")["scanned"] == 1
+    index.close()
+
+
+def test_lookup_matches_only_runs_with_the_same_recorded_fingerprint(tmp_path):
+    runs = tmp_path / "runs"
+    make_run(runs, "run_a", {(1, "1", "recorded"): [(8, "good"), (6, "fine")]})
+    make_run(runs, "run_b", {(1, "1", "unrecorded"): [(9, "great")]}, fingerprint=None)
+    index = RunIndex(tmp_path / "index.sqlite")
+    assert index.update(runs) == {"scanned": 2, "unchanged": 0, "evaluations": 2}
+
+    entry = index.lookup("student", "corpus-a", "recorded", SCHEMA, min_articles=2)
+    assert (entry["mean_score"], entry["articles"], entry["scores"]) == (7.0, 2, [8.0, 6.0])
+    assert index.lookup("student", "corpus-b", "recorded", SCHEMA, min_articles=1) is None
+    assert index.lookup("other-student", "corpus-a", "recorded", SCHEMA, min_articles=1) is None
+    assert index.lookup("student", "corpus-a", "recorded", SCHEMA, min_articles=3) is None
+    # A run without a recorded fingerprint is indexed but never matched
+    assert index.lookup("student", "corpus-a", "unrecorded", SCHEMA, min_articles=1) is None
+    assert index.update(runs)["unchanged"] == 2
+    index.close()
+
+
+def test_placeholder_critiques_are_not_indexed_as_feedback(tmp_path):
+    runs = tmp_path / "runs"
+    make_run(runs, "run_a", {(1, "1", "prompt"): [
+        (0, f"{PREGRADE_MARKER} Output is not valid JSON"), (6, SURROGATE_CRITIQUE), (5, ""), (4, "Missed the location"),
+    ]}, backend="csv")
+    index = RunIndex(tmp_path / "index.sqlite")
+    index.update(runs)
+
+    entry = index.lookup("student", "corpus-a", "prompt", SCHEMA, min_articles=4)
+    assert entry["feedback"] == ["Article a3: Missed the location"]
+    assert entry["scores"] == [0.0, 6.0, 5.0, 4.0]
+    index.close()
+
+
+def test_top_ranks_distinct_candidates_by_mean_score(tmp_path):
+    runs = tmp_path / "runs"
+    make_run(runs, "run_a", {
+        (1, "1", "weak"): [(3, "x"), (4, "x")],
+        (2, "2.1", "strong"): [(9, "x"), (8, "x")],
+        (2, "2.2", "unfinished"): [(10, "x")],
+    })
+    make_run(runs, "run_b", {(1, "1", "strong"): [(7, "x"), (7, "x")], (1, "2", "middle"): [(6, "x"), (6, "x")]})
+    index = RunIndex(tmp_path / "index.sqlite")
+    index.update(runs)
+
+    top = index.top("student", "corpus-a", k=3, min_articles=2)
+    assert [(entry["prompt"], entry["mean_score"]) for entry in top] == [("strong", 8.5), ("middle", 6.0), ("weak", 3.5)]
+    assert top[0]["run_dir"].endswith("run_a")
+    assert [entry["prompt"] for entry in index.top("student", "corpus-a", k=1)] == ["unfinished"]
+    assert index.top("student", "corpus-b", k=3) == []
+    index.close()
@@ -0,0 +1,87 @@
+import json
+
+from surrogate import SurrogateScorer
+
+
+def output(n: int) -> str:
+    return json.dumps({"events": [{"event": f"event {n}", "location": "paris"}]})
+
+
+def make_scorer(**kwargs) -> SurrogateScorer:
+    settings = {"min_samples": 10, "min_checks": 5, "window": 10, "audit_rate": 0.0, "max_spread": 5.0, **kwargs}
+    return SurrogateScorer("teacher", **settings)
+
+
+def train(scorer: SurrogateScorer, start: int, count: int, score: float = 6.0):
+    for n in range(start, start + count):
+        scorer.observe(f"article {n} in paris", output(n), score)
+
+
+def test_estimates_only_once_trusted():
+    scorer = make_scorer()
+    train(scorer, 0, 9)
+    assert scorer.estimate("article in paris", output(100)) is None
+    assert scorer.stats["untrusted"] == 1
+
+    train(scorer, 9, 20)
+    assert scorer.trusted and scorer.agreement() == 1.0
+    assert abs(scorer.estimate("article in paris", output(100)) - 6.0) <= scorer.tolerance
+
+
+def test_disagreement_sends_everything_back_to_the_teacher():
+    scorer = make_scorer()
+    train(scorer, 0, 30)
+    assert scorer.trusted
+
+    train(scorer, 30, 5, score=0.0)
+    assert not scorer.trusted
+    assert scorer.agreement() < scorer.min_agreement
+    assert scorer.estimate("article in paris", output(100)) is None
+
+
+def test_repeats_are_not_learned_twice_and_seen_is_capped():
+    scorer = make_scorer(max_seen=3)
+    train(scorer, 0, 2)
+    train(scorer, 0, 2)
+    assert scorer.stats["trained"] == 2 and scorer.stats["repeats"] == 2
+
+    train(scorer, 2, 3)
+    assert len(scorer.seen) == 3
+    # The oldest digest was dropped, so that output counts as new again
+    train(scorer, 0, 1)
+    assert scorer.stats["trained"] == 6
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "cache" / "surrogate.json"
+    scorer = make_scorer(path=str(path))
+    train(scorer, 0, 20)
+    scorer.save()
+    assert [p.name for p in path.parent.iterdir() if p.suffix == ".tmp"] == []
+
+    restored = make_scorer(path=str(path))
+    assert restored.samples == 20
+    assert restored.predict("article in paris", output(100)) == scorer.predict("article in paris", output(100))
+    # Outputs learned by the earlier run are not learned again
+    train(restored, 0, 1)
+    assert restored.stats["repeats"] == 1
+
+    assert SurrogateScorer("other teacher", path=str(path)).samples == 0
+    assert make_scorer(path=str(path), members=3).samples == 0
+
+
+def test_sessions_sharing_a_file_keep_each_others_training(tmp_path):
+    path = tmp_path / "surrogate.json"
+    base = make_scorer(path=str(path))
+    train(base, 0, 10)
+    base.save()
+
+    first, second = make_scorer(path=str(path)), make_scorer(path=str(path))
+    train(first, 100, 5)
+    train(second, 200, 7)
+    first.save()
+    second.save()
+
+    assert second.samples == 22
+    assert make_scorer(path=str(path)).samples == 22
+    assert len(make_scorer(path=str(path)).seen) == 22